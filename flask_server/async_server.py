@@ -0,0 +1,279 @@
+# Async serving mode: uvicorn async_server:app --host 127.0.0.1 --port 8900
+#
+# An ASGI front for the Flask app. /search_by_bert bodies are parsed first on the event loop, so the
+# Ollama generation is awaited without holding a thread; the request then runs through the regular Flask
+# view (SQL, encoding, ranking, response formatting) on a bounded pool of CPU threads. Requests beyond
+# the configured queues are answered 503 with Retry-After instead of piling up. Other routes go straight
+# to the CPU pool. Needs uvicorn (or another ASGI server) and httpx.
+import asyncio
+import collections
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from server import app as flask_app
+from bert_search import PARSED_QUERY_ENVIRON_KEY, RETRIEVAL_MODES, DEFAULT_RETRIEVAL
+from ollama_client import async_ollama_client
+from ollama_parser import parse_user_query_async, PARSE_MODES, DEFAULT_PARSE_MODE
+from pagination import parse_page_options, parse_stream_option
+from ranking import parse_ranking_options
+from logging_setup import REQUEST_ID_HEADER, get_logger, new_request_id, request_id_context
+from metrics import STAGE_TIMINGS_ENVIRON_KEY, collect_stages, registry
+
+log = get_logger(__name__)
+
+# Threads running the Flask views (SQL, encoding, ranking); torch and numpy release the GIL in the heavy parts
+CPU_WORKERS = int(os.environ.get("PERFUME_ASYNC_CPU_WORKERS", os.cpu_count() or 1))
+# Requests admitted beyond the CPU threads (waiting for a thread) before new ones are rejected with 503.
+# A request holds its place from admission to response, so the CPU queue never exceeds this.
+CPU_QUEUE = int(os.environ.get("PERFUME_ASYNC_CPU_QUEUE", "64"))
+# Requests that may wait for their Ollama parse at the same time, independently of the CPU queue: a parsed
+# request then waits (still counted here) for a CPU place, so a finished parse is never thrown away
+MAX_PENDING_PARSES = int(os.environ.get("PERFUME_ASYNC_MAX_PARSES", "512"))
+RETRY_AFTER_SECONDS = 1
+
+# Routes whose query is parsed on the event loop before the view runs
+PRE_PARSED_ROUTES = ("/search_by_bert",)
+
+# pre_parse() result when the view should parse (or reject) the request itself
+NOT_PARSED = object()
+
+
+async def pre_parse(body):
+    """
+    Parsed query of a /search_by_bert body, awaiting Ollama when needed. Returns NOT_PARSED for
+    bodies the view rejects anyway and for parse_mode "rules" (no network wait to take off a thread).
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return NOT_PARSED
+    if not isinstance(data, dict) or not isinstance(data.get("query", ""), str):
+        return NOT_PARSED
+    parse_mode = data.get("parse_mode", DEFAULT_PARSE_MODE)
+    if parse_mode not in PARSE_MODES or parse_mode == "rules":
+        return NOT_PARSED
+    if data.get("retrieval", DEFAULT_RETRIEVAL) not in RETRIEVAL_MODES:
+        return NOT_PARSED
+    try:
+        parse_ranking_options(data)
+        parse_page_options(data)
+        parse_stream_option(data)
+    except ValueError:
+        return NOT_PARSED
+    return await parse_user_query_async(data.get("query", ""), parse_mode)
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ of an ASGI HTTP request (PEP 3333 strings are latin-1)"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name != "content-length":
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsyncServer:
+    """ASGI application: LLM parses awaited on the event loop, Flask views on a bounded thread pool"""
+
+    def __init__(self, wsgi_app, cpu_workers=CPU_WORKERS, cpu_queue=CPU_QUEUE,
+                 max_pending_parses=MAX_PENDING_PARSES):
+        self.wsgi_app = wsgi_app
+        self.pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="cpu")
+        self.max_admitted = cpu_workers + cpu_queue
+        self.max_pending_parses = max_pending_parses
+        # Only touched from the event loop, so no lock is needed
+        self.admitted = 0
+        self.pending_parses = 0
+        self._cpu_waiters = collections.deque()  # futures of parsed requests waiting for a CPU place
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope: {scope['type']}")
+
+        if scope["method"] == "POST" and scope["path"] in PRE_PARSED_ROUTES:
+            # Admitted against the parse slots only: waiting for Ollama does not hold a CPU place. Once
+            # parsed, the request keeps its parse slot until it gets a CPU place, which bounds the wait.
+            if self.pending_parses >= self.max_pending_parses:
+                await self._reject(send, scope["path"], "parse")
+                return
+            self.pending_parses += 1
+            try:
+                environ = await self._parsed_environ(scope, receive)
+                await self._enter_cpu(wait=True)
+            finally:
+                self.pending_parses -= 1
+        else:
+            if not await self._enter_cpu(wait=False):
+                await self._reject(send, scope["path"], "cpu")
+                return
+            try:
+                environ = wsgi_environ(scope, await read_body(receive))
+            except BaseException:
+                self._leave_cpu()
+                raise
+
+        try:
+            await self._run_wsgi(environ, send)
+        finally:
+            self._leave_cpu()
+
+    async def _parsed_environ(self, scope, receive):
+        """
+        WSGI environ of a pre-parsed route, with the parse awaited on the loop. The parse is logged under
+        the request's id (passed on to Flask) and its stages reach the Server-Timing header. A parse that
+        fails is handed to the view as a failed parse, which answers it like the sync path does.
+        """
+        body = await read_body(receive)
+        environ = wsgi_environ(scope, body)
+        header_key = "HTTP_" + REQUEST_ID_HEADER.upper().replace("-", "_")
+        environ[header_key] = new_request_id(environ.get(header_key))
+        with request_id_context(environ[header_key]), collect_stages() as timings:
+            try:
+                parsed = await pre_parse(body)
+            except Exception:
+                log.exception("Query parse failed")
+                parsed = None
+        environ[STAGE_TIMINGS_ENVIRON_KEY] = timings
+        if parsed is not NOT_PARSED:
+            environ[PARSED_QUERY_ENVIRON_KEY] = parsed
+        return environ
+
+    async def _enter_cpu(self, wait):
+        """
+        Take a CPU place (running or queued for a thread). Without `wait`, returns False when all are
+        taken; with it, waits in arrival order for one to be handed over by _leave_cpu().
+        """
+        if self.admitted < self.max_admitted and not self._cpu_waiters:
+            self.admitted += 1
+            return True
+        if not wait:
+            return False
+        future = asyncio.get_running_loop().create_future()
+        self._cpu_waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._leave_cpu()  # the place was handed over just before the cancellation
+            elif future in self._cpu_waiters:
+                self._cpu_waiters.remove(future)
+            raise
+        return True
+
+    def _leave_cpu(self):
+        """Release a CPU place: hand it to the first waiting request, if any"""
+        while self._cpu_waiters:
+            future = self._cpu_waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.admitted -= 1
+
+    async def _run_wsgi(self, environ, send):
+        loop = asyncio.get_running_loop()
+        status, headers, iterable, iterator, body = await loop.run_in_executor(
+            self.pool, call_wsgi_app, self.wsgi_app, environ)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        if iterator is None:
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        # Streamed body (NDJSON results): each chunk is produced on the pool, sent from the loop
+        try:
+            chunk = body
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self.pool, next, iterator, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                await loop.run_in_executor(self.pool, iterable.close)
+
+    async def _reject(self, send, path, stage):
+        registry.inc("perfume_async_rejected_total", help_text="Requests rejected with 503 by the async server",
+                     stage=stage)
+        log.debug("Rejecting %s: %s queue full", path, stage)
+        body = json.dumps({"error": "Server busy, retry later"}).encode("utf-8")
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(RETRY_AFTER_SECONDS).encode("latin-1")),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_ollama_client.close()
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+def call_wsgi_app(wsgi_app, environ):
+    """
+    Run a WSGI app on the calling (pool) thread: (status, ASGI headers, iterable, iterator, body).
+    Responses with a Content-Length are read whole (iterator None); streamed ones return their first chunk.
+    """
+    started = {}
+
+    def start_response(status, response_headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response_headers]
+        return lambda data: started.setdefault("written", []).append(data)
+
+    iterable = wsgi_app(environ, start_response)
+    written = b"".join(started.get("written", []))
+    if any(name == b"content-length" for name, _ in started["headers"]):
+        try:
+            return started["status"], started["headers"], iterable, None, written + b"".join(iterable)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    iterator = iter(iterable)
+    return started["status"], started["headers"], iterable, iterator, written + next(iterator, b"")
+
+
+app = AsyncServer(flask_app)
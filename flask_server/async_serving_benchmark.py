@@ -0,0 +1,184 @@
+# Sustained throughput and tail latency of /search_by_bert: the sync model (gunicorn, one gthread worker
+# with --threads threads) vs the async server (uvicorn, one event loop with --threads CPU threads), both
+# pinned to the same CPUs. Every request carries a distinct query, so each one waits for a (fake) Ollama
+# generation before the encoding and ranking. A catalog of synthetic products and the synthetic encoder
+# of pipeline_benchmark are used; load comes from a closed loop of --concurrency clients.
+#
+#   python async_serving_benchmark.py --n 10000 --threads 4 --concurrency 8 32 128 --ollama-delay 0.3
+# Needs gunicorn, uvicorn and httpx.
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+SERVERS = ("sync", "async")
+
+# Numbers appended to the queries: unique across runs, so no request is answered from a cache
+REQUEST_IDS = itertools.count()
+
+
+def serve(args):
+    """Child process: load the app with the synthetic encoder and serve it until killed"""
+    if args.cpus:
+        os.sched_setaffinity(0, args.cpus)
+
+    import bert_model
+    from pipeline_benchmark import SyntheticEncoder
+    bert_model._model = SyntheticEncoder(bert_model.MODEL_DIM)
+
+    if args.serve == "sync":
+        from gunicorn.app.base import BaseApplication
+        from server import app
+
+        class SyncServer(BaseApplication):
+            def load_config(self):
+                for key, value in {"bind": f"127.0.0.1:{args.port}", "workers": 1, "worker_class": "gthread",
+                                   "threads": args.threads, "timeout": 120, "loglevel": "warning"}.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return app
+
+        SyncServer().run()
+    else:
+        import uvicorn
+        os.environ["PERFUME_ASYNC_CPU_WORKERS"] = str(args.threads)
+        from async_server import app
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+def wait_until_ready(url, timeout=120):
+    import httpx
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/ready", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def closed_loop(url, queries, concurrency, seconds, k):
+    """
+    `concurrency` clients sending requests back to back for `seconds`.
+    Returns the (status, latency) pairs and the time until the last request completed.
+    """
+    import httpx
+    results = []
+    start = time.perf_counter()
+    deadline = start + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def user():
+            while time.perf_counter() < deadline:
+                i = next(REQUEST_IDS)
+                body = {"query": f"{queries[i % len(queries)]} {i}", "k": k, "parse_mode": "llm"}
+                sent = time.perf_counter()
+                try:
+                    status = (await client.post("/search_by_bert", json=body)).status_code
+                except httpx.HTTPError as e:
+                    print(f"❌ {type(e).__name__}: {e}", flush=True)
+                    status = 0
+                results.append((status, time.perf_counter() - sent))
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def run_server(mode, args, queries):
+    """Start one server in a child process and run every concurrency level against it"""
+    command = [sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(args.port),
+               "--threads", str(args.threads)]
+    if args.cpus:
+        command += ["--cpus"] + [str(c) for c in args.cpus]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f"http://127.0.0.1:{args.port}"
+    rows = []
+    try:
+        wait_until_ready(url)
+        for concurrency in args.concurrency:
+            print(f"⏱ {mode} server, {concurrency} clients...", flush=True)
+            results, elapsed = asyncio.run(closed_loop(url, queries, concurrency, args.seconds, args.k))
+            ok = np.array([seconds for status, seconds in results if status == 200])
+            rows.append({
+                "server": mode, "clients": concurrency,
+                "ok_per_s": len(ok) / elapsed,
+                "p50_ms": np.percentile(ok, 50) * 1000 if len(ok) else np.nan,
+                "p95_ms": np.percentile(ok, 95) * 1000 if len(ok) else np.nan,
+                "p99_ms": np.percentile(ok, 99) * 1000 if len(ok) else np.nan,
+                "rejected_503": sum(status == 503 for status, _ in results),
+                "errors": sum(status not in (200, 503) for status, _ in results),
+            })
+    finally:
+        process.terminate()
+        process.wait()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async serving of /search_by_bert under load")
+    parser.add_argument("--n", type=int, default=10000, help="products in the synthetic catalog")
+    parser.add_argument("--threads", type=int, default=4, help="request threads (sync) / CPU threads (async)")
+    parser.add_argument("--cpus", type=int, nargs="+", help="CPUs both servers are pinned to (default: all)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--seconds", type=float, default=15, help="duration of each load run")
+    parser.add_argument("--ollama-delay", type=float, default=0.3, help="fake Ollama seconds per generation")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=20250809)
+    parser.add_argument("--serve", choices=SERVERS, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8911, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="perfume_async_")
+    os.environ["PERFUME_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'catalog.db')}"
+    os.environ["PERFUME_EMBEDDING_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ["PERFUME_WARMUP"] = "eager"
+    os.environ.setdefault("PERFUME_LOG_LEVEL", "WARNING")
+
+    # The fake Ollama runs in its own process, so it does not compete with the load generator for the GIL
+    fake_ollama_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ollama.py")
+    fake_ollama = subprocess.Popen([sys.executable, fake_ollama_script, "--port", str(args.port + 1),
+                                    "--delay", str(args.ollama_delay)], stdout=subprocess.DEVNULL)
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{args.port + 1}"
+    # Ollama serving requests in parallel (OLLAMA_NUM_PARALLEL): the client cap is not the bottleneck
+    os.environ["OLLAMA_MAX_CONCURRENCY"] = str(max(args.concurrency))
+
+    import bert_model
+    from pipeline_benchmark import SyntheticEncoder, synthetic_products, synthetic_queries
+    from import_csv_to_db import full_import
+    from embedding_store import EmbeddingStoreBuilder
+    from server_config import app
+    bert_model._model = SyntheticEncoder(bert_model.MODEL_DIM)
+    builder = EmbeddingStoreBuilder(os.environ["PERFUME_EMBEDDING_DIR"])
+    with app.app_context():
+        full_import(synthetic_products(args.n, args.seed), builder, batch_size=5000)
+    queries = synthetic_queries(200, args.seed + 1)
+    print(f"📦 {args.n} products, fake Ollama {args.ollama_delay * 1000:.0f} ms per generation")
+
+    rows = []
+    try:
+        for mode in SERVERS:
+            rows += run_server(mode, args, queries)
+    finally:
+        fake_ollama.terminate()
+
+    cpus = f"CPUs {args.cpus}" if args.cpus else f"{os.cpu_count()} CPUs"
+    print(f"\n✅ {args.threads} threads per server, {cpus}, {args.seconds:.0f} s per run\n")
+    print(pd.DataFrame(rows).to_markdown(index=False, floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# SQL attribute filter of /search_by_bert (the ATTRIBUTE_INDEX_ENABLED = False path): the previous
+# LIKE '%x%' conditions on the comma-joined products columns vs the semi-joins on the normalized
+# attribute_values / product_attributes tables. A synthetic catalog is loaded through the import
+# pipeline; both versions must return the same ids for every query. Prints the query plans
+# (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on MySQL) and the latency of each version.
+#
+#   python attribute_filter_benchmark.py --n 1000000
+#   PERFUME_DATABASE_URI=mysql+pymysql://... python attribute_filter_benchmark.py --n 1000000
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+
+def legacy_dynamic_sql(parsed_query):
+    """build_dynamic_sql before the attribute tables: LIKE scans of the products columns"""
+    sql = "SELECT id, name, description, positive_rate FROM products WHERE 1=1"
+    params = {}
+    if parsed_query.get("main_accords"):
+        sql += " AND (" + " OR ".join(
+            f"main_accords LIKE :accord_{i}" for i in range(len(parsed_query["main_accords"]))) + ")"
+        for i, accord in enumerate(parsed_query["main_accords"]):
+            params[f"accord_{i}"] = f"%{accord.lower()}%"
+    if parsed_query.get("gender"):
+        sql += " AND LOWER(gender) = :gender"
+        params["gender"] = parsed_query["gender"].lower()
+    for field, prefix in (("suitable_season", "season"), ("suitable_time", "time")):
+        if parsed_query.get(field):
+            clauses = []
+            for i, value in enumerate(parsed_query[field]):
+                clauses.append(f"LOWER({field}) LIKE :{prefix}_{i}")
+                params[f"{prefix}_{i}"] = f"%{value.lower()}%"
+            sql += " AND (" + " OR ".join(clauses) + ")"
+    for field in ("longevity", "sillage"):
+        if parsed_query.get(field):
+            sql += f" AND LOWER({field}) LIKE :{field}"
+            params[field] = f"%{parsed_query[field].lower()}%"
+    return sql, params
+
+
+def random_parsed_queries(n, seed):
+    from pipeline_benchmark import ACCORDS, GENDERS, SEASONS, TIMES, LONGEVITY, SILLAGE
+    rng = np.random.default_rng(seed)
+    queries = []
+    while len(queries) < n:
+        query = {}
+        if rng.random() < 0.7:
+            query["main_accords"] = [str(a) for a in rng.choice(ACCORDS, size=rng.integers(1, 3), replace=False)]
+        if rng.random() < 0.6:
+            query["gender"] = str(rng.choice(GENDERS))
+        if rng.random() < 0.5:
+            query["suitable_season"] = [str(s) for s in rng.choice(SEASONS, size=rng.integers(1, 3), replace=False)]
+        if rng.random() < 0.4:
+            query["suitable_time"] = [str(rng.choice(TIMES))]
+        if rng.random() < 0.4:
+            query["longevity"] = str(rng.choice(LONGEVITY))
+        if rng.random() < 0.3:
+            query["sillage"] = str(rng.choice(SILLAGE))
+        if query:
+            queries.append(query)
+    return queries
+
+
+def query_plan(conn, sql, params):
+    from sqlalchemy import text
+    explain = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    return [" | ".join(str(v) for v in row) for row in conn.execute(text(explain + sql), params)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LIKE scans vs normalized attribute tables")
+    parser.add_argument("--n", type=int, default=1000000, help="products in the synthetic catalog")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    if "PERFUME_DATABASE_URI" not in os.environ:
+        workdir = tempfile.mkdtemp(prefix="perfume_attr_")
+        os.environ["PERFUME_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'catalog.db')}"
+    os.environ.setdefault("PERFUME_LOG_LEVEL", "WARNING")
+
+    from sqlalchemy import text
+    from server_config import app, db
+    from import_csv_to_db import full_import
+    from pipeline_benchmark import synthetic_products
+    from bert_search import build_dynamic_sql
+    from product_store import attribute_values
+
+    start = time.perf_counter()
+    with app.app_context():
+        full_import(synthetic_products(args.n, args.seed), None, batch_size=20000)
+    print(f"📦 {args.n} products loaded in {time.perf_counter() - start:.1f} s")
+
+    queries = random_parsed_queries(args.queries, args.seed)
+    rows = []
+    with app.app_context(), db.engine.connect() as conn:
+        attributes = attribute_values(conn)
+        builders = (("like", legacy_dynamic_sql), ("normalized", lambda q: build_dynamic_sql(q, attributes)))
+        example = {"main_accords": ["vanilla"], "gender": "female", "suitable_season": ["winter"]}
+        for name, build in builders:
+            print(f"\n🔎 {name} plan for {example}:")
+            for line in query_plan(conn, *build(example)):
+                print("   ", line)
+
+        for query in queries:
+            timings, results = {}, {}
+            for name, build in builders:
+                sql, params = build(query)
+                best = float("inf")
+                for _ in range(args.repeat):
+                    t = time.perf_counter()
+                    ids = [r[0] for r in conn.execute(text(sql), params)]
+                    best = min(best, time.perf_counter() - t)
+                timings[name] = best
+                results[name] = sorted(ids)
+            if results["like"] != results["normalized"]:
+                raise SystemExit(f"❌ Different results for {query}")
+            rows.append({"matched": len(results["like"]), "like_ms": timings["like"] * 1000,
+                         "normalized_ms": timings["normalized"] * 1000})
+
+    df = pd.DataFrame(rows)
+    df["speedup"] = df["like_ms"] / df["normalized_ms"]
+    df["matched_share"] = pd.cut(df["matched"] / args.n, [0, 0.01, 0.05, 0.2, 1.0], include_lowest=True)
+    table = df.groupby("matched_share", observed=True).agg(
+        queries=("matched", "size"), like_ms=("like_ms", "median"),
+        normalized_ms=("normalized_ms", "median"), speedup=("speedup", "median"))
+    print(f"\n✅ Identical results on {len(df)} queries ({args.n} products)\n")
+    print(table.to_markdown(floatfmt=".2f"))
+    print(f"\nAll queries: {df['like_ms'].median():.1f} ms -> {df['normalized_ms'].median():.1f} ms median")
+
+
+if __name__ == "__main__":
+    main()
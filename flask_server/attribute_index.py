@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import text
+from catalog_version import get_catalog_version
+from shared_index import SharedIndex
+
+# Comma-separated columns and single-valued columns filtered by substring (same as LIKE '%x%')
+LIST_ATTRIBUTES = ("main_accords", "suitable_season", "suitable_time")
+SCALAR_ATTRIBUTES = ("longevity", "sillage")
+
+# How often (seconds) the catalog version is re-checked on the request path
+REFRESH_INTERVAL = 5.0
+
+# Matched positions cached per (column, term); terms come from free-form LLM output, so the cache is an LRU
+MAX_CACHED_TERMS = 4096
+
+LOAD_SQL = """
+SELECT id, name, description, positive_rate, gender,
+       main_accords, suitable_season, suitable_time, longevity, sillage
+FROM products ORDER BY id
+"""
+
+
+def split_values(raw):
+    """'warm spicy, Vanilla' -> ['warm spicy', 'vanilla']"""
+    if raw is None:
+        return []
+    return [v.strip().lower() for v in str(raw).split(",") if v.strip()]
+
+
+class AttributeIndex:
+    """
+    In-memory inverted index over the structured product attributes.
+    Each (attribute, value) maps to a sorted array of row positions; a parsed query
+    is evaluated as OR within a field and AND across fields on a boolean mask.
+    """
+
+    def __init__(self, rows, version=0):
+        rows = list(rows)
+        n = len(rows)
+        self.version = version
+        self.size = n
+        self.ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.names = np.array([r[1] for r in rows], dtype=object)
+        self.descriptions = np.array([r[2] or "" for r in rows], dtype=object)
+        self.positive_rates = np.array([r[3] for r in rows], dtype=np.float32)
+
+        columns = ("gender",) + LIST_ATTRIBUTES + SCALAR_ATTRIBUTES
+        postings = {col: {} for col in columns}
+        for pos, row in enumerate(rows):
+            for col, raw in zip(columns, row[4:]):
+                if col in LIST_ATTRIBUTES:
+                    values = split_values(raw)
+                elif raw is not None:
+                    values = [str(raw).strip().lower()]
+                else:
+                    values = []
+                for value in values:
+                    postings[col].setdefault(value, []).append(pos)
+
+        self._postings = {
+            col: {value: np.array(p, dtype=np.int64) for value, p in values.items()}
+            for col, values in postings.items()
+        }
+        self._term_cache = OrderedDict()  # (column, term, exact) -> positions, least recently used first
+        self._term_cache_lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def _positions_matching(self, column, term, exact=False):
+        """Row positions whose column contains term (or equals it when exact)"""
+        key = (column, term, exact)
+        with self._term_cache_lock:
+            cached = self._term_cache.get(key)
+            if cached is not None:
+                self._term_cache.move_to_end(key)
+                return cached
+
+        values = self._postings[column]
+        if exact:
+            matched = [values[term]] if term in values else []
+        else:
+            matched = [p for value, p in values.items() if term in value]
+        result = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+        with self._term_cache_lock:
+            self._term_cache[key] = result
+            while len(self._term_cache) > MAX_CACHED_TERMS:
+                self._term_cache.popitem(last=False)
+        return result
+
+    def _any_of(self, column, terms):
+        mask = np.zeros(self.size, dtype=bool)
+        for term in terms:
+            mask[self._positions_matching(column, term.lower())] = True
+        return mask
+
+    def filter(self, parsed_query):
+        """
+        Row positions matching the parsed query, in id order.
+        Mirrors the WHERE clause produced by bert_search.build_dynamic_sql.
+        """
+        mask = np.ones(self.size, dtype=bool)
+
+        if parsed_query.get("main_accords"):
+            mask &= self._any_of("main_accords", parsed_query["main_accords"])
+
+        if parsed_query.get("gender"):
+            gender_mask = np.zeros(self.size, dtype=bool)
+            gender_mask[self._positions_matching("gender", parsed_query["gender"].lower(), exact=True)] = True
+            mask &= gender_mask
+
+        for column in ("suitable_season", "suitable_time"):
+            if parsed_query.get(column) and isinstance(parsed_query[column], list):
+                mask &= self._any_of(column, parsed_query[column])
+
+        for column in SCALAR_ATTRIBUTES:
+            if parsed_query.get(column) and parsed_query[column] != "undefined":
+                mask &= self._any_of(column, [parsed_query[column]])
+
+        return np.nonzero(mask)[0]
+
+
+def load_attribute_index(engine, current=None):
+    """Read the products table and build a fresh index"""
+    with engine.connect() as conn:
+        version = get_catalog_version(conn)
+        rows = conn.execute(text(LOAD_SQL)).fetchall()
+    return AttributeIndex(rows, version)
+
+
+# Index shared by the request handlers
+_shared = SharedIndex("attribute index", load_attribute_index)
+
+
+def get_attribute_index(db):
+    """
+    Return the shared index. When the catalog version changed (checked at most every REFRESH_INTERVAL
+    seconds), it is rebuilt in the background and the current one is served until then.
+    """
+    return _shared.get(db, REFRESH_INTERVAL)
@@ -1,6 +1,73 @@
-from sentence_transformers import SentenceTransformer
+import os
+import threading
 
-# Load model
-model = SentenceTransformer("paraphrase-MiniLM-L6-v2")
+# Name of the sentence-transformer model (also used to fingerprint stored embeddings)
+MODEL_NAME = "paraphrase-MiniLM-L6-v2"
+MODEL_DIM = 384
 
+# Inference backend for the encoder (CPU):
+#   "torch"      - full-precision PyTorch (reference)
+#   "torch_int8" - PyTorch with dynamic int8 quantization of the Linear layers
+#   "onnx"       - ONNX Runtime
+#   "onnx_int8"  - ONNX Runtime with the int8-quantized export (ONNX_INT8_FILE)
+# Every backend must stay within the cosine tolerance checked by encoder_backend_benchmark.py,
+# so embeddings stored by one backend can be queried with another.
+ENCODER_BACKENDS = ("torch", "torch_int8", "onnx", "onnx_int8")
+ENCODER_BACKEND = os.environ.get("PERFUME_ENCODER_BACKEND", "torch")
+# Intra-op threads used by torch / ONNX Runtime (0 = library default)
+ENCODER_THREADS = int(os.environ.get("PERFUME_ENCODER_THREADS", "0"))
+ONNX_INT8_FILE = os.environ.get("PERFUME_ONNX_INT8_FILE", "onnx/model_qint8_avx2.onnx")
 
+# The model (and torch) is loaded on first use, not at import time
+_model = None
+_model_lock = threading.Lock()
+
+
+def load_model(backend=ENCODER_BACKEND, threads=ENCODER_THREADS):
+    """Build a SentenceTransformer for MODEL_NAME running on the given backend"""
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    if backend.startswith("onnx"):
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+            session_options.inter_op_num_threads = 1
+        model_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+        if backend == "onnx_int8":
+            model_kwargs["file_name"] = ONNX_INT8_FILE
+        return SentenceTransformer(MODEL_NAME, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    if backend == "torch_int8":
+        # Weights of the Linear layers stored as int8, activations quantized on the fly
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def get_model():
+    """Return the shared SentenceTransformer, loading it on first call"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+
+def is_model_loaded():
+    return _model is not None
+
+
+def __getattr__(name):
+    # Backwards compatibility for `from bert_model import model` in scripts
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
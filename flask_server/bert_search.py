@@ -1,61 +1,103 @@
-from flask import Blueprint, request, jsonify
+import logging
+import time
+from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy import text
 from server_config import db
-from bert_similarity import compute_similarity
-from ollama_parser import parse_user_query
+from catalog_version import get_catalog_version
+from product_store import RANKING_COLUMNS, find_products_by_ids, attribute_values
+import numpy as np
+from bert_similarity import score_candidates
+from attribute_index import get_attribute_index
+from bm25_index import get_bm25_index
+from ollama_parser import parse_user_query, PARSE_MODES, DEFAULT_PARSE_MODE
+from ranking import parse_ranking_options, apply_filter_strictness, reciprocal_rank_fusion, top_k_indices
+from pagination import parse_page_options, wants_stream, page_response, encode_cursor, MAX_OFFSET
+from query_cache import parsed_query_cache
+from query_encoder import query_encoder
+from response_cache import response_cache
+from logging_setup import get_logger
+from metrics import span, record_stage
+
+log = get_logger(__name__)
 
 # Define the blueprint for BERT-based search
 bert_search_bp = Blueprint("bert_search", __name__)
 
-# Function to dynamically construct SQL query based on parsed conditions
-def build_dynamic_sql(parsed_query):
-    base_sql = "SELECT id, name, description FROM products WHERE 1=1"
-    conditions = []
-    params = {}
+# "semantic": BERT similarity blended with positive_rate
+# "hybrid": the semantic ranking fused with BM25 keyword ranking (reciprocal rank fusion)
+RETRIEVAL_MODES = ("semantic", "hybrid")
+DEFAULT_RETRIEVAL = "semantic"
+# In hybrid mode both rankings are cut to k * HYBRID_POOL_MULTIPLIER candidates before fusion
+HYBRID_POOL_MULTIPLIER = 20
 
-    # main_accords
-    if parsed_query.get("main_accords"):
-        conditions.append(" AND (" + " OR ".join(
-            [f"main_accords LIKE :accord_{i}" for i in range(len(parsed_query["main_accords"]))]) + ")"
-        )
-        for i, accord in enumerate(parsed_query["main_accords"]):
-            params[f"accord_{i}"] = f"%{accord.lower()}%"
+# The SQL fallback reads matching rows in chunks of this size and keeps only the best ones
+SQL_FETCH_CHUNK = 5000
+
+# Attribute filters run on the normalized attribute tables. The wanted values are resolved to attribute ids
+# in memory (substring match within the stored values like the attribute index, gender exact); products are
+# read from the product_attributes primary key of the most selective field, and the other fields are checked
+# with (product_id, attribute_id) index probes, so no filter scans the products table.
+DRIVING_FILTER_SQL = " AND id IN (SELECT product_id FROM product_attributes WHERE attribute_id IN ({ids}))"
+PROBE_FILTER_SQL = (
+    " AND EXISTS (SELECT 1 FROM product_attributes pa"
+    " WHERE pa.product_id = products.id AND pa.attribute_id IN ({ids}))"
+)
 
-    # gender
+# WSGI environ entry holding the parsed query when async_server.py already parsed it (awaiting Ollama
+# without a thread) before handing the request to this view
+PARSED_QUERY_ENVIRON_KEY = "perfume.parsed_query"
+
+# Bind parameter prefix of each filtered field
+ATTRIBUTE_PARAM_PREFIX = {
+    "main_accords": "accord",
+    "gender": "gender",
+    "suitable_season": "season",
+    "suitable_time": "time",
+    "longevity": "longevity",
+    "sillage": "sillage",
+}
+
+
+def attribute_filters(parsed_query):
+    """[(field, lowercased terms, exact)] of the attributes a parsed query filters on"""
+    filters = []
+    if parsed_query.get("main_accords"):
+        filters.append(("main_accords", parsed_query["main_accords"], False))
     if parsed_query.get("gender"):
-        conditions.append(" AND LOWER(gender) = :gender")
-        params["gender"] = parsed_query["gender"].lower()
-
-    # suitable_season
-    if parsed_query.get("suitable_season"):
-        season_list = parsed_query["suitable_season"]
-        if isinstance(season_list, list):
-            season_clauses = []
-            for i, season in enumerate(season_list):
-                key = f"season_{i}"
-                season_clauses.append(f"LOWER(suitable_season) LIKE :{key}")
-                params[key] = f"%{season.lower()}%"
-            conditions.append(" AND (" + " OR ".join(season_clauses) + ")")
-
-    # suitable_time
-    if parsed_query.get("suitable_time"):
-        time_list = parsed_query["suitable_time"]
-        if isinstance(time_list, list):
-            time_clauses = []
-            for i, t in enumerate(time_list):
-                key = f"time_{i}"
-                time_clauses.append(f"LOWER(suitable_time) LIKE :{key}")
-                params[key] = f"%{t.lower()}%"
-            conditions.append(" AND (" + " OR ".join(time_clauses) + ")")
-
-    if parsed_query.get("longevity") and parsed_query["longevity"] != "undefined":
-        conditions.append(" AND LOWER(longevity) LIKE :longevity")
-        params["longevity"] = f"%{parsed_query['longevity'].lower()}%"
-
-    if parsed_query.get("sillage") and parsed_query["sillage"] != "undefined":
-        conditions.append(" AND LOWER(sillage) LIKE :sillage")
-        params["sillage"] = f"%{parsed_query['sillage'].lower()}%"
-    
+        filters.append(("gender", [parsed_query["gender"]], True))
+    for field in ("suitable_season", "suitable_time"):
+        if parsed_query.get(field) and isinstance(parsed_query[field], list):
+            filters.append((field, parsed_query[field], False))
+    for field in ("longevity", "sillage"):
+        if parsed_query.get(field) and parsed_query[field] != "undefined":
+            filters.append((field, [parsed_query[field]], False))
+    return [(field, [t.lower() for t in terms], exact) for field, terms, exact in filters]
+
+
+# Function to dynamically construct SQL query based on parsed conditions
+def build_dynamic_sql(parsed_query, attributes):
+    """attributes: {field: [(value, attribute id, product count)]} from product_store.attribute_values"""
+    base_sql = f"SELECT {', '.join(RANKING_COLUMNS)} FROM products WHERE 1=1"
+    groups = []
+    for field, terms, exact in attribute_filters(parsed_query):
+        matched = [
+            (attribute_id, count) for value, attribute_id, count in attributes.get(field, [])
+            if (value in terms if exact else any(term in value for term in terms))
+        ]
+        if not matched:
+            return base_sql + " AND 1 = 0", {}
+        groups.append((sum(count for _, count in matched), field, [attribute_id for attribute_id, _ in matched]))
+
+    conditions = []
+    params = {}
+    for position, (_, field, attribute_ids) in enumerate(sorted(groups)):
+        keys = []
+        for i, attribute_id in enumerate(attribute_ids):
+            key = f"{ATTRIBUTE_PARAM_PREFIX[field]}_{i}"
+            params[key] = attribute_id
+            keys.append(f":{key}")
+        template = DRIVING_FILTER_SQL if position == 0 else PROBE_FILTER_SQL
+        conditions.append(template.format(ids=", ".join(keys)))
 
     final_sql = base_sql + "".join(conditions)
     return final_sql, params
@@ -63,49 +105,264 @@ def build_dynamic_sql(parsed_query):
 # Main route for BERT-based semantic search
 @bert_search_bp.route('/search_by_bert', methods=['POST'])
 def search_by_bert():
+    """
+    Body: {"query": ..., "k": 5, "cursor" | "offset": ..., "stream": false, ...}
+    Returns one page of k results; the cursor of the next page is in the X-Next-Cursor header.
+    With "stream": true (or Accept: application/x-ndjson) results are sent as NDJSON lines.
+    """
     data = request.json
     user_query = data.get("query", "")
-    print("🧪 Raw user query:", user_query)
+    log.debug("Raw user query: %s", user_query)
+
+    # Optional per-request ranking parameters: k, similarity_weight, positive_weight,
+    # positive_rate_power, filter_strictness (defaults from ranking_config.json) and the page position
+    try:
+        options = parse_ranking_options(data)
+        page = parse_page_options(data)
+        stream = wants_stream(data, request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Optional parser selection: "rules", "rules_then_llm" or "llm"
+    parse_mode = data.get("parse_mode", DEFAULT_PARSE_MODE)
+    if parse_mode not in PARSE_MODES:
+        return jsonify({"error": f"parse_mode must be one of {list(PARSE_MODES)}"}), 400
 
-    # Parse structured information from the user query using a language model
-    parsed_query = parse_user_query(user_query)
-    print("🧠 Parsed structured query:", parsed_query)
+    retrieval = data.get("retrieval", DEFAULT_RETRIEVAL)
+    if retrieval not in RETRIEVAL_MODES:
+        return jsonify({"error": f"retrieval must be one of {list(RETRIEVAL_MODES)}"}), 400
+
+    # Parse structured information from the user query (rule-based parser and/or language model)
+    if PARSED_QUERY_ENVIRON_KEY in request.environ:
+        parsed_query = request.environ[PARSED_QUERY_ENVIRON_KEY]
+    else:
+        parsed_query = parse_user_query(user_query, parse_mode)
+    log.debug("Parsed structured query: %s", parsed_query)
 
     if not parsed_query:
         return jsonify({"error": "Failed to parse query"}), 400
 
-    # Dynamically build SQL query from structured fields
-    sql, params = build_dynamic_sql(parsed_query)
-    print("Constructed SQL:", sql)
-    print("SQL parameters:", params)
+    # Attributes that filter the candidates (all of them unless filter_strictness is relaxed)
+    filters = apply_filter_strictness(parsed_query, options["filter_strictness"])
 
-    result = db.session.execute(text(sql), params)
+    offset = page["offset"]
+    if current_app.config.get("RESPONSE_CACHE_ENABLED", True):
+        # Popular queries are answered from the response cache. Entries carry the catalog version of the
+        # snapshot they were computed from, so they are invalidated together with the indexes.
+        with span("response_cache"):
+            version = catalog_snapshot_version()
+            request_key = response_cache.request_key(user_query, filters, options, retrieval, offset)
+        results, has_more = response_cache.get_or_compute(
+            version, request_key, lambda: _cacheable_page(user_query, filters, options, retrieval, offset))
+    else:
+        results, has_more, _ = search_page(user_query, filters, options, retrieval, offset)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Results %d-%d: %s", offset + 1, offset + len(results),
+                  ", ".join(f"{r['name']} ({r['final_score']:.3f})" for r in results))
+
+    next_offset = offset + options["k"]
+    next_cursor = encode_cursor({"offset": next_offset}) if has_more and next_offset <= MAX_OFFSET else None
+    return page_response(results, next_cursor, stream)
+
+
+def catalog_snapshot_version():
+    """Catalog version search_page reads from: the attribute index's, or the database's on the SQL path"""
+    if current_app.config.get("ATTRIBUTE_INDEX_ENABLED", True):
+        return get_attribute_index(db).version
+    return get_catalog_version(db.session.connection())
 
-    products = [
-        {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2]
-        }
-        for row in result
-    ]
 
-    print(f"🎯 Number of matched products: {len(products)}")
-    for p in products:
-        print("➡️ Product:", p["name"])
+def search_page(user_query, filters, options, retrieval=DEFAULT_RETRIEVAL, offset=0):
+    """
+    (results, has_more, catalog version) of one page, with the in-memory attribute index (no SQL round trip)
+    or SQL. The version is the one of the data the page was computed from.
+    """
+    if current_app.config.get("ATTRIBUTE_INDEX_ENABLED", True):
+        return search_with_attribute_index(user_query, filters, options, retrieval, offset)
+    return search_with_sql(user_query, filters, options, retrieval, offset)
 
-    if not products:
-        return jsonify([])
 
-    # Compute semantic similarity between query and product descriptions
-    results = compute_similarity(user_query, products)
-    print("🔍 Top 5 similarity-based recommendations:")
-    for r in results:
-        print(f"{r['name']} - Score: {r['final_score']:.3f}")
+def _cacheable_page(user_query, filters, options, retrieval, offset):
+    """((results, has_more), version) for the response cache; version None when the page mixes versions"""
+    results, has_more, version = search_page(user_query, filters, options, retrieval, offset)
+    # The BM25 index syncs on its own timer; a hybrid page computed while it lags is not stored
+    if retrieval == "hybrid" and get_bm25_index(db).version != version:
+        version = None
+    return (results, has_more), version
+
+
+def search_with_attribute_index(user_query, parsed_query, options, retrieval=DEFAULT_RETRIEVAL, offset=0):
+    """Hot path: bitset filtering in memory, then ranking on the candidate arrays"""
+    index = get_attribute_index(db)
+    with span("attribute_filter"):
+        positions = index.filter(parsed_query)
+    log.debug("Number of matched products: %d", len(positions))
+
+    if len(positions) == 0:
+        return [], False, index.version
+
+    results, has_more = rank_candidates(
+        user_query,
+        index.ids[positions],
+        index.names[positions],
+        index.descriptions[positions],
+        index.positive_rates[positions],
+        options,
+        retrieval,
+        offset
+    )
+    return results, has_more, index.version
+
+
+def _rows_to_arrays(rows):
+    """(ids, names, descriptions, positive_rates) arrays of RANKING_COLUMNS row mappings"""
+    return (
+        np.array([row["id"] for row in rows], dtype=np.int64),
+        np.array([row["name"] for row in rows], dtype=object),
+        np.array([row["description"] or "" for row in rows], dtype=object),
+        np.array([row["positive_rate"] if row["positive_rate"] is not None else np.nan for row in rows],
+                 dtype=np.float32),
+    )
+
+
+def search_with_sql(user_query, parsed_query, options, retrieval=DEFAULT_RETRIEVAL, offset=0):
+    """
+    Fallback path: filter with the dynamically built SQL query.
+    Matching rows are streamed in chunks and only the best `depth` of them are kept,
+    so memory stays bounded however broad the filter is.
+    """
+    # Read first: the rows below come from the same transaction
+    version = get_catalog_version(db.session.connection())
+    sql, params = build_dynamic_sql(parsed_query, attribute_values(db.session.connection()))
+    log.debug("Constructed SQL: %s with parameters %s", sql, params)
+
+    depth = offset + options["k"] + 1
+    if retrieval == "hybrid":
+        depth *= HYBRID_POOL_MULTIPLIER
+
+    best = None  # (ids, names, descriptions, positive_rates, final scores) of the best rows so far
+    all_ids = []  # every matching id; only needed to restrict the BM25 ranking in hybrid mode
+    matched = 0
+    sql_seconds = 0.0
+    start = time.perf_counter()
+    result = db.session.connection().execution_options(stream_results=True).execute(text(sql), params).mappings()
+    while True:
+        rows = result.fetchmany(SQL_FETCH_CHUNK)
+        sql_seconds += time.perf_counter() - start
+        if not rows:
+            break
+        matched += len(rows)
+        ids, names, descriptions, rates = _rows_to_arrays(rows)
+        if retrieval == "hybrid":
+            all_ids.append(ids)
+
+        winners, _, final_scores = score_candidates(
+            user_query, ids, descriptions, rates,
+            k=depth, similarity_weight=options["similarity_weight"], positive_weight=options["positive_weight"],
+            positive_rate_power=options["positive_rate_power"]
+        )
+        chunk = (ids[winners], names[winners], descriptions[winners], rates[winners], final_scores)
+        if best is not None:
+            chunk = tuple(np.concatenate([a, b]) for a, b in zip(best, chunk))
+        keep = top_k_indices(chunk[4], depth)
+        best = tuple(a[keep] for a in chunk)
+        start = time.perf_counter()
+
+    # Database time only (the chunks are scored in between fetches)
+    record_stage("sql", sql_seconds)
+
+    log.debug("Number of matched products: %d", matched)
+    if best is None:
+        return [], False, version
+
+    ids, names, descriptions, rates, _ = best
+    if retrieval == "hybrid":
+        # Keyword matches outside the semantic pool still take part in the fusion
+        with span("bm25"):
+            lexical_ids, _ = get_bm25_index(db).search(user_query, depth, allowed_ids=np.concatenate(all_ids))
+        extra_ids = np.setdiff1d(lexical_ids, ids)
+        if len(extra_ids):
+            extra = fetch_products_by_id(extra_ids)
+            ids, names, descriptions, rates = (
+                np.concatenate([a, b]) for a, b in zip((ids, names, descriptions, rates), extra)
+            )
+
+    # Candidates are already narrowed down; re-rank them for the requested page
+    results, has_more = rank_candidates(user_query, ids, names, descriptions, rates, options, retrieval, offset)
+    return results, has_more, version
+
+
+def fetch_products_by_id(product_ids):
+    """(ids, names, descriptions, positive_rates) arrays for the given ids"""
+    rows = find_products_by_ids(db.session.connection(), product_ids, columns=RANKING_COLUMNS)
+    return _rows_to_arrays(list(rows.values()))
+
+
+def rank_candidates(user_query, ids, names, descriptions, positive_rates, options, retrieval, offset=0):
+    """
+    Rank the filtered candidates and build the response dicts for one page.
+    Returns (page of results, whether more results follow).
+    """
+    k = options["k"]
+    depth = offset + k + 1  # one extra result tells whether there is a next page
+    if retrieval == "hybrid":
+        winners, cosine_scores, final_scores, bm25_scores = rank_candidates_hybrid(
+            user_query, ids, descriptions, positive_rates, options, depth
+        )
+    else:
+        # Compute semantic similarity between query and product descriptions
+        winners, cosine_scores, final_scores = score_candidates(
+            user_query, ids, descriptions, positive_rates,
+            k=depth, similarity_weight=options["similarity_weight"], positive_weight=options["positive_weight"],
+            positive_rate_power=options["positive_rate_power"]
+        )
+        bm25_scores = None
+
+    results = []
+    for i, score in zip(winners[offset:offset + k], final_scores[offset:offset + k]):
+        item = {
+            "id": int(ids[i]),
+            "name": names[i],
+            "description": descriptions[i],
+            # NaN when the approximate vector index did not retrieve this product
+            "similarity": None if np.isnan(cosine_scores[i]) else float(cosine_scores[i]),
+            "final_score": float(score)
+        }
+        if bm25_scores is not None:
+            item["bm25"] = bm25_scores.get(int(i), 0.0)
+        results.append(item)
+    return results, len(winners) > offset + k
 
-    return jsonify(results)
 
+def rank_candidates_hybrid(user_query, ids, descriptions, positive_rates, options, depth):
+    """
+    Reciprocal rank fusion of the semantic ranking and the BM25 ranking of the same candidates.
+    Returns (winners, cosine scores of all candidates, fused scores of the winners, BM25 score by candidate).
+    """
+    pool = min(len(ids), depth * HYBRID_POOL_MULTIPLIER)
+    semantic_order, cosine_scores, _ = score_candidates(
+        user_query, ids, descriptions, positive_rates,
+        k=pool, similarity_weight=options["similarity_weight"], positive_weight=options["positive_weight"],
+        positive_rate_power=options["positive_rate_power"]
+    )
 
+    with span("bm25"):
+        lexical_ids, lexical_scores = get_bm25_index(db).search(user_query, pool, allowed_ids=ids)
+    order = np.argsort(ids, kind="stable")
+    lexical_order = order[np.searchsorted(ids[order], lexical_ids)]
+    bm25_scores = dict(zip(lexical_order.tolist(), lexical_scores.tolist()))
 
+    with span("fusion"):
+        winners, fused_scores = reciprocal_rank_fusion([semantic_order, lexical_order], depth)
+    return winners, cosine_scores, fused_scores, bm25_scores
 
 
+# Cache / batching counters of the search pipeline
+@bert_search_bp.route('/search_by_bert/stats', methods=['GET'])
+def search_by_bert_stats():
+    return jsonify({
+        "parsed_query_cache": parsed_query_cache.stats(),
+        "query_encoder": query_encoder.stats(),
+        "response_cache": response_cache.stats()
+    })
@@ -1,37 +1,112 @@
-from sentence_transformers import util
-from bert_model import model
+import numpy as np
+from query_encoder import query_encoder
+from embedding_store import get_product_store, get_vector_index
+from vector_index import VECTOR_INDEX_KIND
+from metrics import span
+from ranking import (
+    rank_products, DEFAULT_TOP_K, DEFAULT_SIMILARITY_WEIGHT, DEFAULT_POSITIVE_WEIGHT, DEFAULT_POSITIVE_RATE_POWER
+)
 
-def compute_similarity(user_query, products):
+# With an approximate vector index, candidate sets larger than this are searched through the index;
+# the k * ANN_POOL_MULTIPLIER most similar products are then re-ranked with the positive_rate blend
+ANN_MIN_CANDIDATES = 50000
+ANN_POOL_MULTIPLIER = 20
+
+# Candidate embeddings are gathered and scored this many rows at a time,
+# so memory per request does not grow with the size of the filtered candidate set
+SCORE_CHUNK = 16384
+
+def score_candidates(user_query, product_ids, descriptions, positive_rates, k=DEFAULT_TOP_K,
+                     similarity_weight=DEFAULT_SIMILARITY_WEIGHT,
+                     positive_weight=DEFAULT_POSITIVE_WEIGHT,
+                     positive_rate_power=DEFAULT_POSITIVE_RATE_POWER):
     """
-    Calculate the BERT similarity between the input user_query and all product descriptions
-    Superimpose positive_rate, sort and return Top 5.
+    Array version of compute_similarity.
+    Returns (winner indices best first, cosine similarity of every candidate, final scores of the winners).
     """
+    # Cached, micro-batched query encoding (concurrent requests share one model call)
+    with span("query_encode"):
+        user_embedding = query_encoder.encode(user_query)
 
-    user_embedding = model.encode([user_query], convert_to_tensor=True)
+    # The vector index is built from the store, so it is only trusted while the store matches the catalog
+    store = get_product_store()
+    if VECTOR_INDEX_KIND != "exact" and len(product_ids) > ANN_MIN_CANDIDATES and not store.verify_hashes:
+        return _score_candidates_ann(store, user_embedding, product_ids, descriptions, positive_rates,
+                                     k, similarity_weight, positive_weight, positive_rate_power)
 
+    # Product vectors come from the precomputed embedding store, so only the query is encoded here.
+    # Both sides are L2-normalized, so the dot product is the cosine similarity
+    cosine_scores = np.empty(len(product_ids), dtype=np.float32)
+    with span("similarity"):
+        for start in range(0, len(product_ids), SCORE_CHUNK):
+            end = start + SCORE_CHUNK
+            chunk_descriptions = None if descriptions is None else descriptions[start:end]
+            cosine_scores[start:end] = store.lookup(product_ids[start:end], chunk_descriptions) @ user_embedding
 
-    product_descriptions = [p["description"] for p in products]
-    product_embeddings = model.encode(product_descriptions, convert_to_tensor=True)
+    with span("rank"):
+        winners, final_scores = rank_products(cosine_scores, positive_rates, k,
+                                              similarity_weight, positive_weight, positive_rate_power)
+    return winners, cosine_scores, final_scores
+
+
+def _score_candidates_ann(store, user_embedding, product_ids, descriptions, positive_rates, k,
+                          similarity_weight, positive_weight, positive_rate_power):
+    """
+    Filtered approximate search; candidates outside the retrieved pool get a NaN similarity.
+    Candidates the index does not know (added since it was built) are scored exactly and join the pool.
+    """
+    product_ids = np.asarray(product_ids, dtype=np.int64)
+    positive_rates = np.asarray(positive_rates, dtype=np.float32)
+    pool_size = min(len(product_ids), k * ANN_POOL_MULTIPLIER)
+    index = get_vector_index()
+    with span("vector_search"):
+        hit_ids, hit_scores = index.search(user_embedding, pool_size, allowed_ids=product_ids)
 
+    # Map the retrieved ids back to candidate positions
+    order = np.argsort(product_ids, kind="stable")
+    positions = order[np.searchsorted(product_ids[order], hit_ids)]
 
-    cosine_scores = util.cos_sim(user_embedding, product_embeddings)[0]
+    unindexed = np.nonzero(~index.contains(product_ids))[0]
+    if len(unindexed):
+        with span("similarity"):
+            unindexed_descriptions = None if descriptions is None else [descriptions[i] for i in unindexed]
+            unindexed_scores = store.lookup(product_ids[unindexed], unindexed_descriptions) @ user_embedding
+        positions = np.concatenate([positions, unindexed])
+        hit_scores = np.concatenate([hit_scores, unindexed_scores.astype(np.float32)])
 
+    with span("rank"):
+        pool_winners, final_scores = rank_products(hit_scores, positive_rates[positions], k,
+                                                   similarity_weight, positive_weight, positive_rate_power)
+    cosine_scores = np.full(len(product_ids), np.nan, dtype=np.float32)
+    cosine_scores[positions] = hit_scores
+    return positions[pool_winners], cosine_scores, final_scores
 
-    results = []
-    for product, score in zip(products, cosine_scores):
-        similarity = float(score)
-        positive_rate = product.get("positive_rate", 0)
-        final_score = similarity * 0.7 + positive_rate * 0.3
 
-        results.append({
-            "id": product["id"],
-            "name": product["name"],
-            "description": product["description"],
-            "similarity": similarity,
-            "final_score": final_score
-        })
+def compute_similarity(user_query, products, k=DEFAULT_TOP_K,
+                       similarity_weight=DEFAULT_SIMILARITY_WEIGHT,
+                       positive_weight=DEFAULT_POSITIVE_WEIGHT,
+                       positive_rate_power=DEFAULT_POSITIVE_RATE_POWER):
+    """
+    Calculate the BERT similarity between the input user_query and all product descriptions
+    Superimpose positive_rate, sort and return the Top k (5 by default).
+    """
+    product_ids = [p["id"] for p in products]
+    product_descriptions = [p["description"] for p in products]
+    positive_rates = np.array([p.get("positive_rate") for p in products], dtype=np.float32)
 
-    # Sort by final_score and take the top 5
-    results = sorted(results, key=lambda x: x["final_score"], reverse=True)[:5]
+    winners, cosine_scores, final_scores = score_candidates(
+        user_query, product_ids, product_descriptions, positive_rates,
+        k, similarity_weight, positive_weight, positive_rate_power
+    )
 
-    return results
+    # Only the winners are turned into response dicts
+    return [
+        {
+            "id": products[i]["id"],
+            "name": products[i]["name"],
+            "description": products[i]["description"],
+            "similarity": float(cosine_scores[i]),
+            "final_score": float(score)
+        }
+        for i, score in zip(winners, final_scores)
+    ]
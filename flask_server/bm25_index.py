@@ -0,0 +1,315 @@
+import re
+import threading
+import zlib
+from collections import Counter
+import numpy as np
+from sqlalchemy import text
+from catalog_version import get_catalog_version
+from ranking import top_k_indices
+from logging_setup import get_logger
+from shared_index import SharedIndex
+
+log = get_logger(__name__)
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Term-frequency weight of each indexed field (BM25F-style: weighted counts summed per document)
+FIELD_WEIGHTS = {"name": 2.0, "main_accords": 1.5, "description": 1.0}
+
+# How often (seconds) the catalog version is re-checked on the request path
+REFRESH_INTERVAL = 5.0
+
+LOAD_SQL = "SELECT id, name, main_accords, description FROM products ORDER BY id"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be by for from in into is it of on or that the this to with
+""".split())
+
+
+# raw token -> index term ("" for stopwords); bounded so odd inputs cannot grow it forever
+_TERMS = {}
+MAX_CACHED_TERMS = 1_000_000
+
+
+def _term(token):
+    if token in STOPWORDS:
+        return ""
+    # Light plural folding: "notes" -> "note", "accords" -> "accord" (but not "musk", "glass")
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text_value):
+    """Lowercased alphanumeric terms without stopwords"""
+    if not text_value:
+        return []
+    raw = TOKEN_PATTERN.findall(str(text_value).lower())
+    terms = list(map(_TERMS.get, raw))
+    if None in terms:
+        for i, term in enumerate(terms):
+            if term is None:
+                terms[i] = term = _term(raw[i])
+                if len(_TERMS) < MAX_CACHED_TERMS:
+                    _TERMS[raw[i]] = term
+    return [t for t in terms if t]
+
+
+class BM25Index:
+    """
+    Tokenized inverted index over product name, main accords and description, scored with BM25.
+    Documents can be added, replaced and removed one at a time; removed rows stay in the
+    posting lists as tombstones until compact().
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B, field_weights=None):
+        self.k1 = k1
+        self.b = b
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self.version = 0
+        self._count = 0
+        self._ids = []
+        self._digests = []
+        self._doc_terms = []  # row -> terms of the document (to undo df on removal)
+        self._doc_len = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._row_of = {}  # id -> row
+        self._row_lookup = np.empty(0, dtype=np.int64)  # dense id -> row (-1 if absent), for allowed_ids
+        self._postings = {}  # term -> ([rows], [weighted tf])
+        self._df = {}  # term -> number of live documents containing it
+        self._posting_arrays = {}  # term -> (rows, tfs) as arrays, rebuilt when the list grew
+        self._total_len = 0.0
+        self._lock = threading.RLock()  # searches see either the old or the new version of a document
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def copy(self):
+        """Independent copy to sync while this one keeps serving searches (lists and arrays are copied)"""
+        with self._lock:
+            clone = BM25Index(self.k1, self.b, self.field_weights)
+            clone.version = self.version
+            clone._count = self._count
+            clone._ids = list(self._ids)
+            clone._digests = list(self._digests)
+            clone._doc_terms = list(self._doc_terms)
+            clone._doc_len = self._doc_len.copy()
+            clone._alive = self._alive.copy()
+            clone._row_of = dict(self._row_of)
+            clone._row_lookup = self._row_lookup.copy()
+            clone._postings = {term: (list(rows), list(tfs)) for term, (rows, tfs) in self._postings.items()}
+            clone._df = dict(self._df)
+            clone._posting_arrays = dict(self._posting_arrays)  # replaced, never modified in place
+            clone._total_len = self._total_len
+            return clone
+
+    @staticmethod
+    def _digest(fields):
+        return zlib.crc32("\x1f".join(str(fields.get(f) or "") for f in FIELD_WEIGHTS).encode("utf-8"))
+
+    def _weighted_terms(self, fields):
+        counts = {}
+        for field, weight in self.field_weights.items():
+            for term, n in Counter(tokenize(fields.get(field))).items():
+                counts[term] = counts.get(term, 0.0) + n * weight
+        return counts
+
+    def _reserve(self, extra):
+        needed = self._count + extra
+        if needed > len(self._alive):
+            capacity = max(needed, 2 * len(self._alive), 16)
+            self._doc_len = np.concatenate([self._doc_len, np.zeros(capacity - len(self._doc_len), np.float32)])
+            self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), bool)])
+
+    def _reserve_id(self, doc_id):
+        if doc_id >= len(self._row_lookup):
+            grown = np.full(max(doc_id + 1, 2 * len(self._row_lookup)), -1, dtype=np.int64)
+            grown[:len(self._row_lookup)] = self._row_lookup
+            self._row_lookup = grown
+
+    def add(self, doc_id, name=None, main_accords=None, description=None):
+        """Index one product, replacing any previous version of it"""
+        fields = {"name": name, "main_accords": main_accords, "description": description}
+        with self._lock:
+            self._remove(doc_id)
+            counts = self._weighted_terms(fields)
+            self._reserve(1)
+            row = self._count
+            self._count += 1
+            self._ids.append(int(doc_id))
+            self._digests.append(self._digest(fields))
+            self._doc_terms.append(tuple(counts))
+            self._doc_len[row] = sum(counts.values())
+            self._alive[row] = True
+            self._row_of[int(doc_id)] = row
+            self._reserve_id(int(doc_id))
+            self._row_lookup[int(doc_id)] = row
+            self._total_len += float(self._doc_len[row])
+
+            postings, df = self._postings, self._df
+            for term, tf in counts.items():
+                posting = postings.get(term)
+                if posting is None:
+                    posting = postings[term] = ([], [])
+                posting[0].append(row)
+                posting[1].append(tf)
+                df[term] = df.get(term, 0) + 1
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        row = self._row_of.pop(int(doc_id), None)
+        if row is None:
+            return
+        self._alive[row] = False
+        self._row_lookup[int(doc_id)] = -1
+        self._total_len -= float(self._doc_len[row])
+        for term in self._doc_terms[row]:
+            self._df[term] -= 1
+
+    def sync(self, rows):
+        """
+        Bring the index in line with (id, name, main_accords, description) rows:
+        only new or changed products are re-tokenized, missing ones are removed.
+        Returns (updated, removed) counts.
+        """
+        seen = set()
+        updated = 0
+        for doc_id, name, main_accords, description in rows:
+            doc_id = int(doc_id)
+            seen.add(doc_id)
+            fields = {"name": name, "main_accords": main_accords, "description": description}
+            row = self._row_of.get(doc_id)
+            if row is None or self._digests[row] != self._digest(fields):
+                self.add(doc_id, name, main_accords, description)
+                updated += 1
+
+        stale = [doc_id for doc_id in self._row_of if doc_id not in seen]
+        for doc_id in stale:
+            self.remove(doc_id)
+        if self._count > 2 * max(len(self), 1):
+            self.compact()
+        return updated, len(stale)
+
+    def compact(self):
+        """Rebuild the posting lists without removed rows"""
+        with self._lock:
+            live = [(doc_id, row) for doc_id, row in self._row_of.items()]
+            old_postings = self._postings
+            keep = np.zeros(self._count, dtype=bool)
+            keep[[row for _, row in live]] = True
+            new_row = np.cumsum(keep) - 1
+
+            self._postings = {}
+            for term, (rows, tfs) in old_postings.items():
+                kept = [(int(new_row[r]), tf) for r, tf in zip(rows, tfs) if keep[r]]
+                if kept:
+                    self._postings[term] = ([r for r, _ in kept], [tf for _, tf in kept])
+            self._df = {term: len(rows) for term, (rows, _) in self._postings.items()}
+
+            order = np.flatnonzero(keep)
+            self._ids = [self._ids[r] for r in order]
+            self._digests = [self._digests[r] for r in order]
+            self._doc_terms = [self._doc_terms[r] for r in order]
+            self._doc_len = self._doc_len[order].copy()
+            self._alive = np.ones(len(order), dtype=bool)
+            self._row_of = {doc_id: int(new_row[row]) for doc_id, row in live}
+            self._row_lookup[:] = -1
+            for doc_id, row in self._row_of.items():
+                self._row_lookup[doc_id] = row
+            self._count = len(order)
+            self._posting_arrays = {}
+
+    def _posting(self, term):
+        arrays = self._posting_arrays.get(term)
+        rows, tfs = self._postings[term]
+        if arrays is None or len(arrays[0]) != len(rows):
+            arrays = (np.array(rows, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            self._posting_arrays[term] = arrays
+        return arrays
+
+    def scores(self, query):
+        """BM25 score of every row (0 for rows sharing no term with the query)"""
+        with self._lock:
+            return self._scores(query)
+
+    def _scores(self, query):
+        n = len(self)
+        scores = np.zeros(self._count, dtype=np.float32)
+        if n == 0:
+            return scores
+        avg_len = self._total_len / n
+
+        for term in set(tokenize(query)):
+            df = self._df.get(term, 0)
+            if df <= 0:
+                continue
+            rows, tfs = self._posting(term)
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self._doc_len[rows] / avg_len)
+            # Each row appears once per posting list, so plain fancy-index += is safe
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+        scores[~self._alive[:self._count]] = 0.0
+        return scores
+
+    def search(self, query, k=10, allowed_ids=None):
+        """Return (ids, BM25 scores) of the k best matching products, optionally restricted to allowed_ids"""
+        with self._lock:
+            return self._search(query, k, allowed_ids)
+
+    def _search(self, query, k, allowed_ids):
+        scores = self._scores(query)
+        if allowed_ids is not None:
+            allowed_ids = np.asarray(allowed_ids, dtype=np.int64)
+            allowed_ids = allowed_ids[(allowed_ids >= 0) & (allowed_ids < len(self._row_lookup))]
+            rows = self._row_lookup[allowed_ids]
+            allowed = np.zeros(self._count, dtype=bool)
+            allowed[rows[rows >= 0]] = True
+            scores[~allowed] = 0.0
+
+        matched = np.flatnonzero(scores > 0)
+        best = matched[top_k_indices(scores[matched], k)]
+        return np.array([self._ids[r] for r in best], dtype=np.int64), scores[best]
+
+
+def build_bm25_index(rows, version=0):
+    """Index (id, name, main_accords, description) rows"""
+    index = BM25Index()
+    index.sync(rows)
+    index.version = version
+    return index
+
+
+def load_bm25_index(engine, current=None):
+    """
+    Build the index from the products table, or sync a copy of the current one with it
+    (only new or changed products are re-tokenized; `current` keeps serving searches meanwhile)
+    """
+    with engine.connect() as conn:
+        version = get_catalog_version(conn)
+        rows = conn.execute(text(LOAD_SQL)).fetchall()
+    if current is None:
+        return build_bm25_index(rows, version)
+    index = current.copy()
+    updated, removed = index.sync(rows)
+    index.version = version
+    log.info("BM25 index synced to catalog version %s: %d updated, %d removed", version, updated, removed)
+    return index
+
+
+# Index shared by the request handlers
+_shared = SharedIndex("BM25 index", load_bm25_index)
+
+
+def get_bm25_index(db):
+    """
+    Return the shared index. When the catalog version changed (checked at most every REFRESH_INTERVAL
+    seconds), a copy is synced in the background and the current one is served until then.
+    """
+    return _shared.get(db, REFRESH_INTERVAL)
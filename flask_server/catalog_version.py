@@ -0,0 +1,34 @@
+from sqlalchemy import text
+
+# Single-row table holding a counter that is bumped every time the products table is reloaded.
+# In-process caches (attribute index, ...) compare it against the version they were built from.
+CREATE_CATALOG_META_SQL = """
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+)
+"""
+
+
+def ensure_catalog_meta(connection):
+    """Create the catalog_meta table and its single row if they do not exist"""
+    connection.execute(text(CREATE_CATALOG_META_SQL))
+    row = connection.execute(text("SELECT version FROM catalog_meta WHERE id = 1")).fetchone()
+    if row is None:
+        connection.execute(text("INSERT INTO catalog_meta (id, version) VALUES (1, 0)"))
+
+
+def bump_catalog_version(connection):
+    """Mark the catalog as changed; call inside the transaction that modified products"""
+    ensure_catalog_meta(connection)
+    connection.execute(text("UPDATE catalog_meta SET version = version + 1 WHERE id = 1"))
+    return get_catalog_version(connection)
+
+
+def get_catalog_version(connection):
+    """Current catalog version (0 if the catalog was never stamped)"""
+    try:
+        row = connection.execute(text("SELECT version FROM catalog_meta WHERE id = 1")).fetchone()
+    except Exception:
+        return 0
+    return row[0] if row else 0
@@ -0,0 +1,104 @@
+# Queries/sec of the data access layer (product_store) against a local SQLite stand-in for MySQL.
+# A synthetic catalog is loaded through the import pipeline, then each query shape is run from
+# several threads: with the configured connection pool vs a new connection per query, selecting the
+# needed columns vs SELECT *, and the attribute filter with vs without the secondary indexes.
+#
+#   python data_access_benchmark.py --n 100000 --threads 4
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+def run_queries(engine, query, count, threads, seed):
+    """Run `count` queries per thread, each thread on its own connection checkout per query; returns qps"""
+    def worker(worker_id):
+        rng = np.random.default_rng(seed + worker_id)
+        for _ in range(count):
+            with engine.connect() as conn:
+                query(conn, rng)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return count * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data access layer queries/sec on SQLite")
+    parser.add_argument("--n", type=int, default=100000, help="products in the synthetic catalog")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--count", type=int, default=300, help="queries per thread and scenario")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="perfume_dal_")
+    uri = f"sqlite:///{os.path.join(workdir, 'catalog.db')}"
+    os.environ["PERFUME_DATABASE_URI"] = uri
+    os.environ.setdefault("PERFUME_LOG_LEVEL", "WARNING")
+
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import NullPool
+    from server_config import app, engine_options
+    from import_csv_to_db import full_import, PRODUCT_INDEXES
+    from pipeline_benchmark import synthetic_products, ACCORDS, GENDERS, LONGEVITY, SILLAGE
+    from product_store import find_products_by_keyword, find_products_by_ids, SUMMARY_COLUMNS
+
+    start = time.perf_counter()
+    with app.app_context():
+        full_import(synthetic_products(args.n, args.seed), None, batch_size=5000)
+    print(f"📦 {args.n} products loaded in {time.perf_counter() - start:.1f} s ({uri})")
+
+    pooled = create_engine(uri, **engine_options(uri))
+    unpooled = create_engine(uri, poolclass=NullPool)
+
+    def keyword(conn, rng):
+        find_products_by_keyword(conn, str(rng.choice(ACCORDS)), {"max_price": 200}, limit=21)
+
+    def by_ids(conn, rng):
+        find_products_by_ids(conn, rng.integers(1, args.n + 1, size=20), {"max_price": 200},
+                             columns=SUMMARY_COLUMNS)
+
+    def by_ids_select_star(conn, rng):
+        ids = ", ".join(str(i) for i in rng.integers(1, args.n + 1, size=20))
+        rows = conn.execute(text(f"SELECT * FROM products WHERE id IN ({ids})")).fetchall()
+        [(row[0], row[1], row[9]) for row in rows]
+
+    def attribute_filter(conn, rng):
+        conn.execute(
+            text("SELECT COUNT(*) FROM products WHERE gender = :gender AND longevity = :longevity "
+                 "AND sillage = :sillage"),
+            {"gender": str(rng.choice(GENDERS)), "longevity": str(rng.choice(LONGEVITY)),
+             "sillage": str(rng.choice(SILLAGE))}
+        ).scalar()
+
+    scenarios = [
+        ("keyword LIKE page", keyword),
+        ("20 products by id", by_ids),
+        ("20 products by id, SELECT *", by_ids_select_star),
+        ("gender + longevity + sillage count", attribute_filter),
+    ]
+    rows = []
+    for name, query in scenarios:
+        for pool_name, engine in (("pooled", pooled), ("new connection", unpooled)):
+            qps = run_queries(engine, query, args.count, args.threads, args.seed)
+            rows.append({"query": name, "connections": pool_name, "indexes": "yes", "qps": qps})
+
+    # The attribute filter without its secondary index (what the table had before)
+    with pooled.begin() as conn:
+        conn.execute(text("DROP INDEX ix_products_attributes"))
+    qps = run_queries(pooled, attribute_filter, args.count, args.threads, args.seed)
+    rows.append({"query": "gender + longevity + sillage count", "connections": "pooled", "indexes": "no", "qps": qps})
+    with pooled.begin() as conn:
+        conn.execute(text(f"CREATE INDEX ix_products_attributes ON products "
+                          f"({', '.join(PRODUCT_INDEXES['attributes'])})"))
+
+    print(f"\n⏱ Queries/sec ({args.threads} threads x {args.count} queries)\n")
+    print(pd.DataFrame(rows).to_markdown(index=False, floatfmt=".0f"))
+
+
+if __name__ == "__main__":
+    main()
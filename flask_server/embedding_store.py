@@ -0,0 +1,408 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from bert_model import get_model, MODEL_NAME, MODEL_DIM
+from catalog_version import get_catalog_version
+from vector_index import build_vector_index, load_vector_index, VECTOR_INDEX_KIND
+from logging_setup import get_logger
+
+log = get_logger(__name__)
+
+# Directory holding the precomputed product embeddings
+STORE_DIR = os.environ.get(
+    "PERFUME_EMBEDDING_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embeddings")
+)
+
+# float16 halves the file size; similarities are computed in float32 either way
+STORE_DTYPE = os.environ.get("PERFUME_EMBEDDING_DTYPE", "float32")
+
+ENCODE_BATCH_SIZE = 256
+
+EMBEDDINGS_FILE = "product_embeddings.npy"
+IDS_FILE = "product_ids.npy"
+HASHES_FILE = "description_hashes.npy"
+META_FILE = "meta.json"
+VECTOR_INDEX_FILE = "vector_index_{kind}.npz"
+
+# Each build is written to its own version directory; CURRENT names the live one and is swapped
+# atomically, so a reader never mixes files of two builds. The previous build is kept for readers
+# that still have it mapped.
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = 2
+
+# How often (seconds) the shared store is checked against CURRENT and the catalog version
+REFRESH_INTERVAL = 5.0
+
+
+def description_hash(description):
+    """Stable 64-bit hash of a product description"""
+    digest = hashlib.blake2b((description or "").encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def compute_fingerprint(ids, hashes, model_name=MODEL_NAME):
+    """Fingerprint of the store contents: model name + (id, description hash) pairs"""
+    h = hashlib.sha256(model_name.encode("utf-8"))
+    h.update(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(hashes, dtype=np.uint64).tobytes())
+    return h.hexdigest()
+
+
+def encode_descriptions(descriptions):
+    """Encode descriptions into L2-normalized vectors (cosine similarity becomes a dot product)"""
+    return get_model().encode(
+        descriptions,
+        batch_size=ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    ).astype(np.float32)
+
+
+class EmbeddingStore:
+    """
+    Read-only view over the product embedding matrix, keyed by products.id.
+    catalog_version is the products table version the store was built for; while it differs from the
+    live version (verify_hashes), lookups check each row's description hash and re-encode mismatches.
+    """
+
+    def __init__(self, ids, embeddings, hashes, fingerprint, model_name=MODEL_NAME, path=None,
+                 catalog_version=None):
+        self.ids = ids
+        self.embeddings = embeddings
+        self.hashes = hashes
+        self.fingerprint = fingerprint
+        self.model_name = model_name
+        self.path = path
+        self.catalog_version = catalog_version
+        self.verify_hashes = False
+
+        # Dense id -> row position table, so lookups are a single fancy-index
+        size = int(ids.max()) + 1 if len(ids) else 0
+        self._row_of = np.full(size, -1, dtype=np.int64)
+        self._row_of[ids] = np.arange(len(ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for(self, product_ids):
+        """Return the row position of each id, -1 where the id is not stored"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        rows = np.full(len(product_ids), -1, dtype=np.int64)
+        in_range = (product_ids >= 0) & (product_ids < len(self._row_of))
+        rows[in_range] = self._row_of[product_ids[in_range]]
+        return rows
+
+    def lookup(self, product_ids, descriptions=None):
+        """
+        Return a float32 matrix with one embedding per id.
+        Ids missing from the store (e.g. added since the last refresh) are encoded on the fly, and so are
+        ids whose stored description hash differs from the given description when verify_hashes is set.
+        """
+        rows = self.rows_for(product_ids)
+        missing = rows < 0
+        if self.verify_hashes and descriptions is not None:
+            for i in np.nonzero(~missing)[0]:
+                if description_hash(descriptions[i] or "") != int(self.hashes[rows[i]]):
+                    missing[i] = True
+
+        result = np.empty((len(rows), self.embeddings.shape[1]), dtype=np.float32)
+        result[~missing] = self.embeddings[rows[~missing]]
+        if missing.any():
+            if descriptions is None:
+                raise KeyError("Product ids not in embedding store and no descriptions given")
+            todo = [descriptions[i] for i in np.nonzero(missing)[0]]
+            result[missing] = encode_descriptions(todo)
+        return result
+
+
+def _empty_store():
+    dim = MODEL_DIM
+    ids = np.empty(0, dtype=np.int64)
+    return EmbeddingStore(ids, np.empty((0, dim), dtype=np.float32),
+                          np.empty(0, dtype=np.uint64), compute_fingerprint(ids, ids))
+
+
+def current_store_path(store_dir=STORE_DIR):
+    """Directory of the live build: the one named by CURRENT, or store_dir itself for a pre-versioning store"""
+    try:
+        with open(os.path.join(store_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return os.path.join(store_dir, f.read().strip())
+    except FileNotFoundError:
+        return store_dir
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(path, meta):
+    tmp_meta = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_meta, os.path.join(path, META_FILE))
+
+
+def load_embedding_store(store_dir=STORE_DIR, mmap=True):
+    """Memory-map the live store from disk; returns None if missing or built with another model"""
+    path = current_store_path(store_dir)
+    meta = _read_meta(path)
+    if meta is None:
+        return None
+    if meta.get("model") != MODEL_NAME:
+        log.warning("Embedding store was built with %s, expected %s; ignoring it", meta.get("model"), MODEL_NAME)
+        return None
+
+    mode = "r" if mmap else None
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mode)
+    ids = np.load(os.path.join(path, IDS_FILE))
+    hashes = np.load(os.path.join(path, HASHES_FILE))
+    return EmbeddingStore(ids, embeddings, hashes, meta["fingerprint"], meta["model"], path,
+                          meta.get("catalog_version"))
+
+
+def _publish(store_dir, version_name):
+    """Point CURRENT at a complete version directory (atomic rename) and drop old versions"""
+    tmp_path = os.path.join(store_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version_name)
+    os.replace(tmp_path, os.path.join(store_dir, CURRENT_FILE))
+
+    versions = sorted(name for name in os.listdir(store_dir)
+                      if name.startswith("v-") and os.path.isdir(os.path.join(store_dir, name)))
+    for name in versions[:-KEEP_VERSIONS]:
+        if name != version_name:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+
+
+class EmbeddingStoreBuilder:
+    """
+    Incremental store writer used by the import pipeline.
+    Rows are added batch by batch; descriptions already encoded in the previous store
+    (same text, whatever the id) are reused, the rest are encoded in large batches.
+    With keep_existing=True the previous store is the starting point (incremental upserts).
+    """
+
+    def __init__(self, store_dir=STORE_DIR, dtype=STORE_DTYPE, keep_existing=False,
+                 encode_workers=1, encode_chunk=4096):
+        self.store_dir = store_dir
+        self.dtype = dtype
+        self.encode_workers = encode_workers
+        self.encode_chunk = encode_chunk
+        self.encoded = 0
+        self.reused = 0
+
+        self.previous = load_embedding_store(store_dir)
+        self._row_by_hash = {}
+        if self.previous is not None:
+            self._row_by_hash = {int(h): i for i, h in enumerate(self.previous.hashes)}
+
+        self._id_chunks, self._hash_chunks, self._vector_chunks = [], [], []
+        if keep_existing and self.previous is not None and len(self.previous):
+            self._append(self.previous.ids, self.previous.hashes, np.asarray(self.previous.embeddings))
+
+        self._pending_ids, self._pending_hashes, self._pending_texts = [], [], []
+        self._pool = None
+
+    def _append(self, ids, hashes, vectors):
+        self._id_chunks.append(np.asarray(ids, dtype=np.int64))
+        self._hash_chunks.append(np.asarray(hashes, dtype=np.uint64))
+        self._vector_chunks.append(np.asarray(vectors, dtype=np.float32))
+
+    def add(self, ids, descriptions):
+        """Queue (id, description) pairs; encodes once enough new descriptions are pending"""
+        reuse_ids, reuse_hashes, reuse_rows = [], [], []
+        for product_id, description in zip(ids, descriptions):
+            description = description or ""
+            h = description_hash(description)
+            row = self._row_by_hash.get(h)
+            if row is not None:
+                reuse_ids.append(product_id)
+                reuse_hashes.append(h)
+                reuse_rows.append(row)
+            else:
+                self._pending_ids.append(product_id)
+                self._pending_hashes.append(h)
+                self._pending_texts.append(description)
+
+        if reuse_rows:
+            self._append(reuse_ids, reuse_hashes, self.previous.embeddings[np.array(reuse_rows)])
+            self.reused += len(reuse_rows)
+        if len(self._pending_texts) >= self.encode_chunk:
+            self._encode_pending()
+
+    def _encode_pending(self):
+        if not self._pending_texts:
+            return
+        if self.encode_workers > 1:
+            # Spread encoding over several CPU processes
+            if self._pool is None:
+                self._pool = get_model().start_multi_process_pool(["cpu"] * self.encode_workers)
+            vectors = get_model().encode_multi_process(
+                self._pending_texts, self._pool, batch_size=ENCODE_BATCH_SIZE, normalize_embeddings=True
+            ).astype(np.float32)
+        else:
+            vectors = encode_descriptions(self._pending_texts)
+
+        self._append(self._pending_ids, self._pending_hashes, vectors)
+        self.encoded += len(self._pending_texts)
+        self._pending_ids, self._pending_hashes, self._pending_texts = [], [], []
+
+    def finish(self, catalog_version=None):
+        """
+        Encode what is left, write the store to disk and return it memory-mapped.
+        catalog_version is the products table version the rows belong to (stamped into meta.json).
+        """
+        self._encode_pending()
+        if self._pool is not None:
+            get_model().stop_multi_process_pool(self._pool)
+            self._pool = None
+
+        dim = get_model().get_sentence_embedding_dimension()
+        if self._id_chunks:
+            ids = np.concatenate(self._id_chunks)
+            hashes = np.concatenate(self._hash_chunks)
+            embeddings = np.concatenate(self._vector_chunks)
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            hashes = np.empty(0, dtype=np.uint64)
+            embeddings = np.empty((0, dim), dtype=np.float32)
+
+        # Later rows win for duplicate ids (upserts), then sort by id
+        reversed_ids = ids[::-1]
+        _, last = np.unique(reversed_ids, return_index=True)
+        keep = len(ids) - 1 - last
+        ids, hashes, embeddings = ids[keep], hashes[keep], embeddings[keep]
+
+        fingerprint = compute_fingerprint(ids, hashes)
+        log.info("Embedding store: encoded %d, reused %d, total %d products", self.encoded, self.reused, len(ids))
+        if self.previous is not None and self.previous.fingerprint == fingerprint:
+            # Same contents: only the catalog version stamp changes (meta.json is replaced atomically)
+            meta = _read_meta(self.previous.path)
+            if meta.get("catalog_version") != catalog_version:
+                meta["catalog_version"] = catalog_version
+                _write_meta(self.previous.path, meta)
+            return load_embedding_store(self.store_dir)
+
+        version_name = f"v-{time.strftime('%Y%m%d%H%M%S')}-{fingerprint[:12]}"
+        path = os.path.join(self.store_dir, version_name)
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, EMBEDDINGS_FILE), embeddings.astype(self.dtype))
+        np.save(os.path.join(path, IDS_FILE), ids)
+        np.save(os.path.join(path, HASHES_FILE), hashes)
+        _write_meta(path, {
+            "model": MODEL_NAME,
+            "dtype": self.dtype,
+            "dim": dim,
+            "count": int(len(ids)),
+            "fingerprint": fingerprint,
+            "catalog_version": catalog_version
+        })
+        _publish(self.store_dir, version_name)
+        return load_embedding_store(self.store_dir)
+
+
+def build_embedding_store(rows, store_dir=STORE_DIR, dtype=STORE_DTYPE, catalog_version=None):
+    """
+    Build the store from (id, description) rows and write it to disk.
+    Vectors of unchanged descriptions are reused from the previous store.
+    """
+    builder = EmbeddingStoreBuilder(store_dir, dtype)
+    rows = list(rows)
+    builder.add([r[0] for r in rows], [r[1] for r in rows])
+    return builder.finish(catalog_version)
+
+
+# Store shared by the request handlers, memory-mapped on first use and reloaded when a new build
+# is published or its catalog version stamp changes
+product_store = None
+_store_lock = threading.Lock()
+_last_check = 0.0
+
+
+def _live_catalog_version():
+    """Version of the products table the server reads, None when it cannot be read"""
+    try:
+        from server_config import app, db
+        with app.app_context(), db.engine.connect() as conn:
+            return get_catalog_version(conn)
+    except Exception:
+        return None
+
+
+def get_product_store(store_dir=STORE_DIR):
+    """
+    Return the shared store, re-checked at most every REFRESH_INTERVAL seconds. While the store was not
+    built for the live catalog version (e.g. during a reimport), lookups verify description hashes.
+    """
+    global product_store, _last_check
+    now = time.monotonic()
+    if product_store is not None and now - _last_check < REFRESH_INTERVAL:
+        return product_store
+
+    with _store_lock:
+        if product_store is not None and now - _last_check < REFRESH_INTERVAL:
+            return product_store
+        path = current_store_path(store_dir)
+        meta = _read_meta(path) or {}
+        store = product_store
+        if (store is None or store.path != path or store.fingerprint != meta.get("fingerprint")
+                or store.catalog_version != meta.get("catalog_version")):
+            store = load_embedding_store(store_dir) or _empty_store()
+        live_version = _live_catalog_version()
+        store.verify_hashes = live_version is None or store.catalog_version != live_version
+        product_store = store
+        _last_check = time.monotonic()
+    return product_store
+
+
+# Approximate index over the store, only used when PERFUME_VECTOR_INDEX is not "exact"
+product_index = None
+
+
+def get_vector_index(kind=VECTOR_INDEX_KIND):
+    """
+    Return the vector index matching the current store (it follows the store's reloads), loading it
+    from the store's version directory or building (and saving) it when missing or stale.
+    """
+    global product_index
+    store = get_product_store()
+    if product_index is not None and product_index.fingerprint == store.fingerprint and product_index.kind == kind:
+        return product_index
+
+    path = os.path.join(store.path, VECTOR_INDEX_FILE.format(kind=kind)) if store.path else None
+    index = load_vector_index(path) if path and os.path.exists(path) else None
+    if index is None or index.fingerprint != store.fingerprint or index.kind != kind:
+        log.info("Building %s vector index over %d products", kind, len(store))
+        index = build_vector_index(store.ids, np.asarray(store.embeddings, dtype=np.float32), kind)
+        index.fingerprint = store.fingerprint
+        if path:
+            index.save(path)
+
+    product_index = index
+    return product_index
+
+
+def refresh_embedding_store():
+    """Re-sync the store with the products table (re-encodes only new or changed descriptions)"""
+    from sqlalchemy import text
+    from server_config import db, app
+
+    global product_store
+    with app.app_context():
+        rows = db.session.execute(text("SELECT id, description FROM products ORDER BY id")).fetchall()
+        version = get_catalog_version(db.session.connection())
+    product_store = build_embedding_store(rows, catalog_version=version)
+    return product_store
+
+
+if __name__ == "__main__":
+    refresh_embedding_store()
@@ -0,0 +1,122 @@
+# Validation and latency/memory benchmark of the encoder backends in bert_model.py.
+# Each backend runs in its own process so its resident memory is measured in isolation.
+import argparse
+import multiprocessing
+import resource
+import time
+import numpy as np
+import pandas as pd
+from bert_model import ENCODER_BACKENDS, load_model
+from ranking import rank_products
+
+# Embeddings must keep at least this cosine similarity with the torch reference
+COSINE_TOLERANCE = 0.99
+
+# Same queries as experiment_evaluation.py
+EVALUATION_QUERIES = [
+    "Sweet girly fragrance", "Fresh summer fragrance", "Sexy date fragrance",
+    "Unisex woody fragrance", "Sweet fruity fragrance", "Sporty and energetic scent",
+    "Oriental scent for dating", "Woody floral scent", "Campus everyday fragrance", "Milky fragrance",
+]
+
+
+def rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, threads, descriptions, batch_sizes, repeats):
+    """Child process: load one backend, embed the validation texts and time encode() per batch size"""
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    model = load_model(backend, threads)
+    load_seconds = time.perf_counter() - start
+
+    def encode(texts, batch_size=32):
+        return model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                            normalize_embeddings=True).astype(np.float32)
+
+    encode(descriptions[:32])  # warmup
+    desc_embeddings = encode(descriptions, 256)
+    query_embeddings = encode(EVALUATION_QUERIES)
+
+    latencies = {}
+    for batch_size in batch_sizes:
+        batch = (descriptions * (batch_size // len(descriptions) + 1))[:batch_size]
+        times = []
+        for _ in range(repeats):
+            t = time.perf_counter()
+            encode(batch, batch_size)
+            times.append(time.perf_counter() - t)
+        latencies[batch_size] = times
+
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "model_rss_mb": rss_mb() - base_rss,
+        "latencies": latencies,
+        "desc_embeddings": desc_embeddings,
+        "query_embeddings": query_embeddings,
+    }
+
+
+def top5(desc_embeddings, query_embeddings, positive_rates):
+    """compute_similarity ranking: cosine blended with positive_rate through rank_products"""
+    return [rank_products(desc_embeddings @ q, positive_rates, 5)[0].tolist() for q in query_embeddings]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder backend validation and benchmark")
+    parser.add_argument("--backends", nargs="+", default=list(ENCODER_BACKENDS), choices=ENCODER_BACKENDS)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = library default)")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 32, 256])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--catalog", default="fragrance_with_positive.csv")
+    parser.add_argument("--limit", type=int, default=5000, help="descriptions used for validation")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.catalog).head(args.limit)
+    descriptions = df["description"].fillna("").tolist()
+    positive_rates = df["positive_rate"].fillna(0.0).to_numpy(dtype=np.float32)
+
+    # The torch backend is the reference the others are validated against
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with ctx.Pool(1) as pool:
+            results[backend] = pool.apply(run_backend, (backend, args.threads, descriptions,
+                                                        args.batch_sizes, args.repeats))
+        print(f"{backend}: loaded in {results[backend]['load_seconds']:.2f} s")
+
+    reference = results["torch"]
+    reference_top5 = top5(reference["desc_embeddings"], reference["query_embeddings"], positive_rates)
+
+    rows = []
+    ok = True
+    for backend in backends:
+        r = results[backend]
+        cosines = np.concatenate([
+            np.sum(r["desc_embeddings"] * reference["desc_embeddings"], axis=1),
+            np.sum(r["query_embeddings"] * reference["query_embeddings"], axis=1),
+        ])
+        same_top5 = sum(a == b for a, b in zip(top5(r["desc_embeddings"], r["query_embeddings"], positive_rates),
+                                               reference_top5))
+        valid = cosines.min() >= COSINE_TOLERANCE and same_top5 == len(EVALUATION_QUERIES)
+        ok = ok and valid
+        row = {"backend": backend, "min_cosine": cosines.min(), "mean_cosine": cosines.mean(),
+               "top5_unchanged": f"{same_top5}/{len(EVALUATION_QUERIES)}", "valid": valid,
+               "rss_mb": r["model_rss_mb"]}
+        for batch_size, times in r["latencies"].items():
+            row[f"b{batch_size}_p50_ms"] = np.percentile(times, 50) * 1000
+            row[f"b{batch_size}_p95_ms"] = np.percentile(times, 95) * 1000
+        rows.append(row)
+
+    print(f"\n📊 Encoder backends ({len(descriptions)} descriptions, threads={args.threads or 'default'})\n")
+    print(pd.DataFrame(rows).to_markdown(index=False, floatfmt=".4f"))
+    print("\n✅ all backends within tolerance" if ok else f"\n❌ a backend is below cosine {COSINE_TOLERANCE} "
+                                                       "or changes the top-5")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import hashlib
+import os
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+from bert_model import MODEL_NAME
+from embedding_store import encode_descriptions
+from ranking import blend_scores, DEFAULT_SIMILARITY_WEIGHT
+
+# Metrics are reported at every cutoff in DEFAULT_KS
+DEFAULT_KS = (1, 3, 5, 10)
+
+# A document is relevant to a query when it contains at least this many of the query's keywords
+MIN_KEYWORD_HITS = 2
+
+# Queries are scored against the catalog this many at a time (bounds the query x document matrix)
+QUERY_CHUNK = 256
+
+EVALUATION_CACHE_DIR = os.environ.get(
+    "PERFUME_EVALUATION_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "embeddings")
+)
+
+
+def keyword_matrix(descriptions, keywords):
+    """Boolean (keyword x document) matrix: does the lowercased description contain the keyword"""
+    lowered = pd.Series(descriptions, dtype=object).fillna("").str.lower()
+    matrix = np.zeros((len(keywords), len(lowered)), dtype=bool)
+    for row, keyword in enumerate(keywords):
+        matrix[row] = lowered.str.contains(keyword.lower(), regex=False).to_numpy()
+    return matrix
+
+
+def relevance_matrix(descriptions, keyword_lists, min_hits=MIN_KEYWORD_HITS):
+    """
+    Boolean (query x document) relevance labels for lists of keywords, one list per query.
+    Every distinct keyword is matched against the catalog once; the keyword hits of all
+    queries are then counted with one matrix product.
+    """
+    vocabulary = sorted({kw.lower() for keywords in keyword_lists for kw in keywords})
+    column = {kw: i for i, kw in enumerate(vocabulary)}
+    contains = keyword_matrix(descriptions, vocabulary).astype(np.int32)
+
+    selection = np.zeros((len(keyword_lists), len(vocabulary)), dtype=np.int32)
+    for row, keywords in enumerate(keyword_lists):
+        for kw in set(k.lower() for k in keywords):
+            selection[row, column[kw]] = 1
+    return (selection @ contains) >= min_hits
+
+
+def top_k_rows(scores, k):
+    """Row-wise version of ranking.top_k_indices for a (query x document) score matrix"""
+    scores = np.asarray(scores)
+    k = min(int(k), scores.shape[1])
+    if k < scores.shape[1]:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        idx.sort(axis=1)  # keep catalog order among equal scores
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def top_k_masked(scores, k, mask):
+    """
+    top_k_rows restricted to the documents where mask is True (e.g. the attribute filter of each query).
+    Rows with fewer than k candidates are padded with -1.
+    """
+    scores = np.where(mask, scores, -np.inf)
+    ranked = top_k_rows(scores, k)
+    ranked[np.isneginf(np.take_along_axis(scores, ranked, axis=1))] = -1
+    return ranked
+
+
+def pad_rankings(rankings, depth=None):
+    """Stack ranked index lists of different lengths into a matrix, padding with -1 (no result)"""
+    depth = depth or max((len(r) for r in rankings), default=0)
+    ranked = np.full((len(rankings), depth), -1, dtype=np.int64)
+    for row, ranking in enumerate(rankings):
+        ranking = np.asarray(ranking, dtype=np.int64)[:depth]
+        ranked[row, :len(ranking)] = ranking
+    return ranked
+
+
+def ranking_metrics(ranked, relevance, ks=DEFAULT_KS):
+    """
+    Precision@k, recall@k and NDCG@k (binary gains) of ranked results for every k in ks.
+    ranked: (query x depth) document indices best first, -1 for missing results.
+    relevance: (query x document) boolean labels.
+    Returns {k: {"precision": array, "recall": array, "ndcg": array}} with one value per query.
+    """
+    ranked = np.asarray(ranked, dtype=np.int64)
+    relevance = np.asarray(relevance, dtype=bool)
+    gains = np.take_along_axis(relevance, np.maximum(ranked, 0), axis=1) & (ranked >= 0)
+    if gains.shape[1] < max(ks):
+        gains = np.pad(gains, ((0, 0), (0, max(ks) - gains.shape[1])))
+
+    discounts = 1.0 / np.log2(np.arange(2, max(ks) + 2))
+    cumulative_discounts = np.concatenate([[0.0], np.cumsum(discounts)])
+    dcg = np.cumsum(gains * discounts, axis=1)
+    hits = np.cumsum(gains, axis=1)
+    total_relevant = relevance.sum(axis=1)
+
+    result = {}
+    for k in ks:
+        ideal = cumulative_discounts[np.minimum(total_relevant, k)]
+        result[k] = {
+            "precision": hits[:, k - 1] / k,
+            "recall": np.divide(hits[:, k - 1], total_relevant,
+                                out=np.zeros(len(ranked)), where=total_relevant > 0),
+            "ndcg": np.divide(dcg[:, k - 1], ideal, out=np.zeros(len(ranked)), where=ideal > 0),
+        }
+    return result
+
+
+def metrics_frame(metrics, query_names, **columns):
+    """Long DataFrame (one row per query and k) from the output of ranking_metrics"""
+    frames = []
+    for k, values in metrics.items():
+        frame = pd.DataFrame({"query": query_names, **columns, "k": k})
+        for name, array in values.items():
+            frame[name] = array
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def cached_description_embeddings(descriptions, cache_dir=EVALUATION_CACHE_DIR):
+    """
+    L2-normalized description vectors, encoded once and cached on disk under a hash
+    of the model name and the descriptions (a changed catalog gets a new file).
+    """
+    h = hashlib.sha256(MODEL_NAME.encode("utf-8"))
+    for description in descriptions:
+        h.update((description or "").encode("utf-8") + b"\x1f")
+    path = os.path.join(cache_dir, f"evaluation_{h.hexdigest()[:16]}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+
+    embeddings = encode_descriptions(list(descriptions))
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(path, embeddings)
+    return embeddings
+
+
+# Catalog arrays of the worker processes (set once per worker, not sent with every task)
+_doc_embeddings = None
+_positive_rates = None
+
+
+def _init_worker(doc_embeddings, positive_rates):
+    global _doc_embeddings, _positive_rates
+    _doc_embeddings = doc_embeddings
+    _positive_rates = positive_rates
+
+
+def _evaluate_chunk(task):
+    query_embeddings, relevance, ks, weights = task
+    similarities = query_embeddings @ _doc_embeddings.T
+    results = []
+    for weight in weights:
+        ranked = top_k_rows(blend_scores(similarities, _positive_rates, weight, 1.0 - weight), max(ks))
+        results.append((weight, ranking_metrics(ranked, relevance, ks)))
+    return results
+
+
+def evaluate_blend(query_embeddings, doc_embeddings, positive_rates, relevance, ks=DEFAULT_KS,
+                   weights=(DEFAULT_SIMILARITY_WEIGHT,), query_names=None, processes=1):
+    """
+    Score every query against every document (one matrix product per chunk of QUERY_CHUNK queries)
+    and evaluate the blend similarity_weight * cosine + (1 - similarity_weight) * positive_rate
+    for each weight in weights (1.0 = pure semantic ranking) at every k in ks.
+    Embeddings must be L2-normalized. With processes > 1 the query chunks are spread over a process pool.
+    Returns a long DataFrame: query, similarity_weight, k, precision, recall, ndcg.
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+    doc_embeddings = np.asarray(doc_embeddings, dtype=np.float32)
+    positive_rates = np.nan_to_num(np.asarray(positive_rates, dtype=np.float32), nan=0.0)
+    relevance = np.asarray(relevance, dtype=bool)
+    ks = tuple(sorted(set(ks)))
+    weights = tuple(weights)
+    if query_names is None:
+        query_names = list(range(len(query_embeddings)))
+
+    starts = range(0, len(query_embeddings), QUERY_CHUNK)
+    tasks = [(query_embeddings[s:s + QUERY_CHUNK], relevance[s:s + QUERY_CHUNK], ks, weights) for s in starts]
+
+    if processes > 1 and len(tasks) > 1:
+        with get_context().Pool(processes, initializer=_init_worker,
+                                initargs=(doc_embeddings, positive_rates)) as pool:
+            chunk_results = pool.map(_evaluate_chunk, tasks)
+    else:
+        _init_worker(doc_embeddings, positive_rates)
+        chunk_results = [_evaluate_chunk(task) for task in tasks]
+
+    frames = []
+    for start, results in zip(starts, chunk_results):
+        names = query_names[start:start + QUERY_CHUNK]
+        for weight, metrics in results:
+            frames.append(metrics_frame(metrics, names, similarity_weight=weight))
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize(frame, by=("similarity_weight", "k")):
+    """Mean precision / recall / NDCG over the queries"""
+    return frame.groupby(list(by), as_index=False)[["precision", "recall", "ndcg"]].mean()
@@ -1,16 +1,15 @@
-# fair_benchmark_single_file.py
+# Offline evaluation of the search methods (keyword, semantic, BM25 and hybrids) on keyword-labelled queries
+import argparse
 import time
 import numpy as np
 import pandas as pd
-from sklearn.metrics import ndcg_score
-from sklearn.metrics.pairwise import cosine_similarity
-
-# load the public data
-df = pd.read_csv("fragrance_with_positive.csv")
-df["description"] = df["description"].fillna("")
-df["positive_rate"] = df["positive_rate"].fillna(0.0)
-descriptions = df["description"].tolist()
-positive_rate = df["positive_rate"].to_numpy()
+from vector_index import build_vector_index, VECTOR_INDEX_KIND
+from bm25_index import build_bm25_index
+from ranking import reciprocal_rank_fusion, rank_products
+from evaluation import (
+    DEFAULT_KS, relevance_matrix, pad_rankings, ranking_metrics, metrics_frame,
+    cached_description_embeddings, evaluate_blend, summarize,
+)
 
 # queries & keywords (for static annotation of "whether relevant")
 queries = {
@@ -26,102 +25,139 @@ queries = {
     "Milky fragrance": ["milky", "sweet", "powdery", "vanilla"],
 }
 
-# relevance and metrics
-def is_relevant(desc: str, keywords: list[str]) -> int:
-    return int(sum(1 for kw in keywords if kw in desc.lower()) >= 2)
-
-def eval_top5(indices: np.ndarray, relevance: np.ndarray):
-    if len(indices) == 0:
-        return 0.0, 0.0
-    top_k = relevance[indices]
-    precision = float(top_k.mean())
-    ndcg = ndcg_score(
-        [relevance],
-        [np.isin(np.arange(len(relevance)), indices).astype(int)],
-        k=5
-    )
-    return precision, float(ndcg)
-
-# load the same model + warmup + precalculate the description vector
-from bert_model import model as semantic_model 
-
-# warmup (no timing)
-_ = semantic_model.encode(descriptions[:32])
-_ = semantic_model.encode(["warmup query"])
-
-# calculate the description vector once (reuse, ensure fairness)
-desc_embeddings = semantic_model.encode(descriptions)
-
-# three methods (fair timing within a single script)
-def run_keyword(query: str, relevance: np.ndarray):
-    start = time.perf_counter()
-    mask = [query.lower() in d.lower() for d in descriptions]
-    idx = np.nonzero(mask)[0][:5]
-    cost = time.perf_counter() - start
-    p, n = eval_top5(idx, relevance)
-    return cost, p, n
-
-def run_semantic(query: str, relevance: np.ndarray):
-    start = time.perf_counter()
-    q_emb = semantic_model.encode([query])
-    scores = cosine_similarity(q_emb, desc_embeddings)[0]
-    idx = np.argsort(scores)[-5:][::-1]
-    cost = time.perf_counter() - start
-    p, n = eval_top5(idx, relevance)
-    return cost, p, n
-
-def run_hybrid(query: str, relevance: np.ndarray):
-    start = time.perf_counter()
-    q_emb = semantic_model.encode([query])
-    scores = cosine_similarity(q_emb, desc_embeddings)[0]
-    fused = 0.7 * scores + 0.3 * positive_rate
-    idx = np.argsort(fused)[-5:][::-1]
-    cost = time.perf_counter() - start
-    p, n = eval_top5(idx, relevance)
-    return cost, p, n
-
-# randomization execution order + result record
-rng = np.random.default_rng(20250809) 
-methods = [
-    ("Keyword Match", run_keyword),
-    ("Semantic Match", run_semantic),
-    ("Hybrid Recommendation", run_hybrid),
-]
-
-results = []
-time_records = {name: [] for name, _ in methods}
-
-for query, keywords in queries.items():
-    relevance = np.array([is_relevant(desc, keywords) for desc in descriptions], dtype=int)
-
-    # Each query randomizes the execution order of the three methods to avoid the preheating bias caused by the order
-    order = np.array(methods, dtype=object)
-    rng.shuffle(order)
-
-    for name, fn in order:
-        cost, p, n = fn(query, relevance)
-        time_records[name].append(cost)
-        results.append({
-            "Query": query,
-            "Method": name,
-            "Precision@5": round(p, 2),
-            "NDCG@5": round(n, 2)
-        })
-
-result_df = pd.DataFrame(results)
-avg_times = {method: float(np.mean(times)) for method, times in time_records.items()}
-
-print("\n📊 Evaluation Results for Three Recommendation Methods:\n")
-print(result_df.to_markdown(index=False))
-
-print("\n⏱ Average Computing Time (seconds):")
-for method, avg_time in avg_times.items():
-    print(f"{method}: {avg_time:.6f} s")
-
-
-result_df.to_csv("recommendation_evaluation_result.csv", index=False)
-pd.DataFrame([avg_times]).to_csv("recommendation_avg_time.csv", index=False)
+# blend weights evaluated in one pass (similarity weight; the positive_rate weight is 1 - w)
+SWEEP_WEIGHTS = tuple(np.round(np.linspace(0.0, 1.0, 11), 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline evaluation of the recommendation methods")
+    parser.add_argument("--data", default="fragrance_with_positive.csv")
+    parser.add_argument("--ks", nargs="+", type=int, default=list(DEFAULT_KS))
+    parser.add_argument("--processes", type=int, default=1, help="processes for the blend-weight sweep")
+    args = parser.parse_args()
+    ks = tuple(sorted(set(args.ks)))
+    depth = max(ks)
+
+    # load the public data
+    df = pd.read_csv(args.data)
+    df["description"] = df["description"].fillna("")
+    df["positive_rate"] = df["positive_rate"].fillna(0.0)
+    descriptions = df["description"].tolist()
+    positive_rate = df["positive_rate"].to_numpy()
 
+    # relevance labels of every query, built once for the whole catalog
+    query_texts = list(queries)
+    relevance = relevance_matrix(descriptions, list(queries.values()))
 
+    # load the same model + warmup + precalculate the description vector
+    from bert_model import get_model
+    semantic_model = get_model()
 
+    # warmup (no timing)
+    _ = semantic_model.encode(descriptions[:32])
+    _ = semantic_model.encode(["warmup query"])
+
+    # description vectors are encoded once and cached on disk (reuse, ensure fairness)
+    desc_embeddings = cached_description_embeddings(descriptions)
+
+    # vector index over the description vectors (exact by default, PERFUME_VECTOR_INDEX=ivf for approximate)
+    semantic_index = build_vector_index(np.arange(len(descriptions)), desc_embeddings, VECTOR_INDEX_KIND)
+
+    # BM25 inverted index over name + description (built once, like the description vectors)
+    bm25_index = build_bm25_index(
+        (i, name, None, desc) for i, (name, desc) in enumerate(zip(df["product_title"].fillna(""), descriptions))
+    )
 
+    def encode_query(query):
+        return semantic_model.encode([query], normalize_embeddings=True)[0]
+
+    # recommendation methods (fair timing within a single script); each returns ranked catalog indices
+    def run_keyword(query):
+        mask = [query.lower() in d.lower() for d in descriptions]
+        return np.nonzero(mask)[0][:depth]
+
+    def run_semantic(query):
+        idx, _ = semantic_index.search(encode_query(query), k=depth)
+        return idx
+
+    def run_hybrid(query):
+        scores = desc_embeddings @ encode_query(query)
+        idx, _ = rank_products(scores, positive_rate, depth)
+        return idx
+
+    def run_bm25(query):
+        idx, _ = bm25_index.search(query, k=depth)
+        return idx
+
+    def run_hybrid_rrf(query):
+        scores = desc_embeddings @ encode_query(query)
+        semantic_order, _ = rank_products(scores, positive_rate, 100)
+        lexical_order, _ = bm25_index.search(query, k=100)
+        idx, _ = reciprocal_rank_fusion([semantic_order, lexical_order], k=depth)
+        return idx
+
+    # randomization execution order + result record
+    rng = np.random.default_rng(20250809)
+    methods = [
+        ("Keyword Match", run_keyword),
+        ("Semantic Match", run_semantic),
+        ("Hybrid Recommendation", run_hybrid),
+        ("BM25 Keyword", run_bm25),
+        ("Hybrid BM25 + BERT (RRF)", run_hybrid_rrf),
+    ]
+
+    time_records = {name: [] for name, _ in methods}
+    rankings = {name: [] for name, _ in methods}
+
+    for query in query_texts:
+        # Each query randomizes the execution order of the methods to avoid the preheating bias caused by the order
+        order = np.array(methods, dtype=object)
+        rng.shuffle(order)
+
+        for name, fn in order:
+            start = time.perf_counter()
+            idx = fn(query)
+            time_records[name].append(time.perf_counter() - start)
+            rankings[name].append(idx)
+
+    # metrics of all queries of a method at every k in one vectorized pass
+    frames = [
+        metrics_frame(ranking_metrics(pad_rankings(rankings[name], depth), relevance, ks), query_texts, Method=name)
+        for name, _ in methods
+    ]
+    long_df = pd.concat(frames, ignore_index=True)
+    result_df = long_df.pivot_table(index=["query", "Method"], columns="k",
+                                    values=["precision", "recall", "ndcg"], sort=False)
+    result_df.columns = [f"{metric.capitalize() if metric != 'ndcg' else 'NDCG'}@{k}"
+                         for metric, k in result_df.columns]
+    ordered = [f"{m}@{k}" for k in ks for m in ("Precision", "Recall", "NDCG")]
+    result_df = result_df[ordered].round(2).reset_index().rename(columns={"query": "Query"})
+    avg_times = {method: float(np.mean(times)) for method, times in time_records.items()}
+
+    print("\n📊 Evaluation Results for the Recommendation Methods:\n")
+    print(result_df.to_markdown(index=False))
+
+    print("\n📈 Mean over queries:\n")
+    print(summarize(long_df, by=("Method", "k")).pivot(index="Method", columns="k", values="ndcg")
+          .add_prefix("NDCG@").round(3).to_markdown())
+
+    print("\n⏱ Average Computing Time (seconds):")
+    for method, avg_time in avg_times.items():
+        print(f"{method}: {avg_time:.6f} s")
+
+    # blend-weight sweep: all queries x all documents in one batched pass per weight
+    query_embeddings = semantic_model.encode(query_texts, normalize_embeddings=True)
+    sweep = evaluate_blend(query_embeddings, desc_embeddings, positive_rate, relevance,
+                           ks=ks, weights=SWEEP_WEIGHTS, query_names=query_texts, processes=args.processes)
+    sweep_summary = summarize(sweep)
+    print("\n⚖️ similarity_weight sweep (final = w * cosine + (1 - w) * positive_rate), mean NDCG:\n")
+    print(sweep_summary.pivot(index="similarity_weight", columns="k", values="ndcg")
+          .add_prefix("NDCG@").round(3).to_markdown())
+
+    result_df.to_csv("recommendation_evaluation_result.csv", index=False)
+    pd.DataFrame([avg_times]).to_csv("recommendation_avg_time.csv", index=False)
+    sweep_summary.to_csv("recommendation_weight_sweep.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
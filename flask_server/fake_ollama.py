@@ -0,0 +1,99 @@
+# Local stand-in for the Ollama HTTP API, used by benchmarks and scripts when no real model is available.
+# Answers /api/generate with a JSON parse produced by the rule-based parser after a configurable delay.
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rule_parser import parse_with_rules
+
+USER_INPUT_PATTERN = re.compile(r'the user\'s input is:\s*"(.*?)"\s*\n', re.S)
+
+
+def fake_generation(prompt):
+    """Build an Ollama-style answer for a parsing prompt"""
+    match = USER_INPUT_PATTERN.search(prompt)
+    user_query = match.group(1) if match else prompt
+    parsed, _, _ = parse_with_rules(user_query)
+    answer = {k: v for k, v in parsed.items() if v is not None}
+    return json.dumps(answer, indent=2)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        with server.stats_lock:
+            server.request_count += 1
+
+        start = time.perf_counter_ns()
+        time.sleep(server.delay)
+        text = fake_generation(payload.get("prompt", ""))
+        duration = time.perf_counter_ns() - start
+
+        if payload.get("stream", True):
+            # NDJSON stream: one chunk per few characters, then a final "done" record
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for i in range(0, len(text), 8):
+                chunk = {"model": payload.get("model"), "response": text[i:i + 8], "done": False}
+                self.wfile.write((json.dumps(chunk) + "\n").encode("utf-8"))
+            final = {"model": payload.get("model"), "response": "", "done": True,
+                     "eval_count": len(text.split()), "eval_duration": duration}
+            self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+            return
+
+        body = json.dumps({
+            "model": payload.get("model"),
+            "response": text,
+            "done": True,
+            "eval_count": len(text.split()),
+            "eval_duration": duration,
+            "total_duration": duration
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    # Connections are not kept alive (HTTP/1.0): a deep accept queue, so bursts of concurrent
+    # requests are not delayed by SYN retries (a real Ollama server accepts them right away)
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_fake_ollama(host="127.0.0.1", port=0, delay=0.0):
+    """Start the fake server in a background thread; returns (server, base_url)"""
+    server = FakeOllamaServer((host, port), FakeOllamaHandler)
+    server.delay = delay
+    server.request_count = 0
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama server for local testing")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds per generation")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(("127.0.0.1", args.port), FakeOllamaHandler)
+    server.delay = args.delay
+    server.request_count = 0
+    server.stats_lock = threading.Lock()
+    print(f"Fake Ollama listening on http://127.0.0.1:{args.port} (delay {args.delay}s)")
+    server.serve_forever()
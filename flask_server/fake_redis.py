@@ -0,0 +1,43 @@
+# Local stand-in for the few Redis commands used by the shared response cache (GET, SET with EX/PX/NX,
+# DELETE, SCAN). Several ResponseCache instances sharing one FakeRedis behave like workers sharing a
+# Redis server, so the shared backend can be exercised without one.
+import fnmatch
+import threading
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self._data = {}  # key -> (expires_at or None, bytes)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live_entry(key)
+            return entry[1] if entry else None
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        ttl = ex if ex is not None else (px / 1000 if px is not None else None)
+        with self._lock:
+            if nx and self._live_entry(key) is not None:
+                return None
+            self._data[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            keys = [key for key in self._data if fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def _live_entry(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
@@ -0,0 +1,35 @@
+# Gunicorn settings for production serving: gunicorn -c gunicorn.conf.py server:app
+import multiprocessing
+import os
+
+bind = os.environ.get("PERFUME_BIND", "127.0.0.1:8900")
+workers = int(os.environ.get("PERFUME_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("PERFUME_THREADS", "4"))
+timeout = 120
+
+# Each worker imports the app and runs the eager warmup after the fork (torch thread pools and pooled
+# DB connections do not survive fork). PERFUME_PRELOAD=1 imports the app once in the master instead,
+# so embeddings and indexes are shared copy-on-write; the model is still loaded in each worker.
+preload_app = os.environ.get("PERFUME_PRELOAD", "0") == "1"
+os.environ.setdefault("PERFUME_WARMUP", "eager")
+if preload_app:
+    os.environ["PERFUME_WARMUP_DEFER_MODEL"] = "1"
+
+
+def post_fork(server, worker):
+    # Background threads are recreated lazily. Connections the master may have opened stay open for it:
+    # the worker drops them from its pool without closing the shared sockets.
+    from server_config import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    # torch should not oversubscribe cores when several workers share a node
+    try:
+        import torch
+        torch.set_num_threads(max(1, multiprocessing.cpu_count() // max(workers, 1)))
+    except ImportError:
+        pass
+
+    if preload_app:
+        from lifecycle import warm_model
+        warm_model()
@@ -0,0 +1,18 @@
+from flask import Blueprint, jsonify
+from lifecycle import readiness
+
+# Liveness / readiness probes
+health_bp = Blueprint("health", __name__)
+
+@health_bp.route("/healthz", methods=["GET"])
+def healthz():
+    """The process is up and serving HTTP"""
+    return jsonify({"status": "ok"})
+
+@health_bp.route("/ready", methods=["GET"])
+def ready():
+    """200 once the model and indexes are warm, 503 while they are still loading"""
+    is_ready, details = readiness()
+    failed = any("error" in c for c in details.get("components", {}).values())
+    details["status"] = "ready" if is_ready else ("failed" if failed else "warming_up")
+    return jsonify(details), (200 if is_ready else 503)
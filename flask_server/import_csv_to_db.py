@@ -1,39 +1,61 @@
+import argparse
+import os
+import time
 import pandas as pd
 from server_config import db, app
-from sqlalchemy import Table, Column, Integer, String, Float, MetaData
-
-# Read two CSV files
-df_info = pd.read_csv("fragrance_info_with_description.csv")
-df_rate = pd.read_csv("product_positive_rate.csv")
-
-# Merge the two files by product_title
-df_merged = pd.merge(
-    df_info,
-    df_rate,
-    how="left",
-    on="product_title"
+from sqlalchemy import (
+    Table, Column, Integer, String, Float, MetaData, Index, PrimaryKeyConstraint, inspect, text, bindparam
 )
+from embedding_store import EmbeddingStoreBuilder
+from catalog_version import bump_catalog_version, ensure_catalog_meta, get_catalog_version
+from attribute_index import LIST_ATTRIBUTES, split_values
+from query_vocab import VALUE_ALIASES
 
-# Fill unmatched positive_rate entries with default value 0.5 
-df_merged["positive_rate"] = df_merged["positive_rate"].fillna(0.5)
+INFO_CSV = "fragrance_info_with_description.csv"
+RATE_CSV = "product_positive_rate.csv"
 
-# Rename columns to match database table schema
-df_merged = df_merged.rename(columns={
-    "product_title": "name"
-})
+# Fill unmatched positive_rate entries with default value 0.5
+DEFAULT_POSITIVE_RATE = 0.5
 
-# Select only the required fields
-final_df = df_merged[[
+PRODUCT_COLUMNS = [
     "name", "url", "main_accords", "longevity", "sillage",
     "gender", "suitable_season", "suitable_time", "description", "positive_rate"
-]]
+]
 
-# Define the table schema
-with app.app_context():
-    metadata = MetaData()
+# Secondary indexes of the products table: name suffix -> columns
+# (incremental imports look products up by (name, url); the SQL filter path compares the scalar attributes)
+PRODUCT_INDEXES = {
+    "name_url": ("name", "url"),
+    "attributes": ("gender", "longevity", "sillage"),
+}
+
+# Attribute columns normalized into the attribute_values lookup table and the
+# product_attributes junction table (one row per product and value), which the SQL filter joins
+ATTRIBUTE_FIELDS = ("main_accords", "gender", "suitable_season", "suitable_time", "longevity", "sillage")
+
+# Secondary indexes of the other tables. product_attributes' primary key (attribute_id, product_id)
+# serves "products with this value"; the product index serves deletes and per-product reads.
+TABLE_INDEXES = {
+    "products": PRODUCT_INDEXES,
+    "attribute_values": {"field_value": ("field", "value")},
+    "product_attributes": {"product": ("product_id", "attribute_id")},
+}
+
+# Tables rebuilt by a full import, swapped in together
+CATALOG_TABLES = ("products", "attribute_values", "product_attributes")
 
-    products_table = Table(
-        'products', metadata,
+# MySQL only: FULLTEXT indexes (name suffix -> columns) for the keyword search fallback.
+# Built on the staging table after the rows are loaded, which is faster than maintaining them per insert.
+FULLTEXT_INDEXES = {
+    "description": ("description",),
+}
+TABLE_FULLTEXT_INDEXES = {"products": FULLTEXT_INDEXES}
+
+
+def define_products_table(metadata, table_name="products"):
+    """Schema of the products table (also used for the staging table)"""
+    return Table(
+        table_name, metadata,
         Column('id', Integer, primary_key=True, autoincrement=True),
         Column('name', String(255)),
         Column('url', String(500)),
@@ -44,14 +66,333 @@ with app.app_context():
         Column('suitable_season', String(100)),
         Column('suitable_time', String(100)),
         Column('description', String(2000)),
-        Column('positive_rate', Float)
+        Column('positive_rate', Float),
+        *[Index(f"ix_{table_name}_{suffix}", *columns) for suffix, columns in PRODUCT_INDEXES.items()]
     )
 
-    # Drop the table if it already exists, then recreate (to ensure consistent schema)
-    products_table.drop(db.engine, checkfirst=True)
+
+def define_attribute_tables(metadata, suffix=""):
+    """Schemas of the attribute_values lookup table and the product_attributes junction table"""
+    values_name, junction_name = f"attribute_values{suffix}", f"product_attributes{suffix}"
+    attribute_values = Table(
+        values_name, metadata,
+        Column('id', Integer, primary_key=True, autoincrement=False),
+        Column('field', String(50), nullable=False),
+        Column('value', String(100), nullable=False),
+        # Products carrying the value; lets the SQL filter start from its most selective field
+        Column('product_count', Integer, nullable=False, default=0),
+        *[Index(f"ix_{values_name}_{name}", *columns)
+          for name, columns in TABLE_INDEXES["attribute_values"].items()]
+    )
+    product_attributes = Table(
+        junction_name, metadata,
+        Column('attribute_id', Integer, nullable=False),
+        Column('product_id', Integer, nullable=False),
+        PrimaryKeyConstraint('attribute_id', 'product_id'),
+        *[Index(f"ix_{junction_name}_{name}", *columns)
+          for name, columns in TABLE_INDEXES["product_attributes"].items()]
+    )
+    return attribute_values, product_attributes
+
+
+def canonical_values(field, raw):
+    """Values of one attribute cell: split if it is a list column, lowercased, aliases resolved"""
+    if field in LIST_ATTRIBUTES:
+        values = split_values(raw)
+    elif raw is not None and str(raw).strip():
+        values = [str(raw).strip().lower()]
+    else:
+        values = []
+    aliases = VALUE_ALIASES.get(field, {})
+    canonical = []
+    for value in values:
+        value = aliases.get(value, value)
+        if value not in canonical:
+            canonical.append(value)
+    return canonical
+
+
+def canonicalize_row(row):
+    """Rewrite the attribute columns of a row dict in canonical form; returns {field: [values]}"""
+    values = {}
+    for field in ATTRIBUTE_FIELDS:
+        values[field] = canonical_values(field, row.get(field))
+        row[field] = ", ".join(values[field]) or None
+    return values
+
+
+class AttributeLookup:
+    """(field, value) -> attribute id, handing out new ids for values not seen before"""
+
+    def __init__(self, rows=()):
+        self.ids = {(field, value): attribute_id for attribute_id, field, value in rows}
+        self.next_id = max(self.ids.values(), default=0) + 1
+        self.new_rows = []
+
+    def junction_rows(self, product_id, values):
+        """product_attributes rows of one product from its {field: [values]}"""
+        rows = []
+        for field, field_values in values.items():
+            for value in field_values:
+                attribute_id = self.ids.get((field, value))
+                if attribute_id is None:
+                    attribute_id = self.ids[(field, value)] = self.next_id
+                    self.next_id += 1
+                    self.new_rows.append({"id": attribute_id, "field": field, "value": value, "product_count": 0})
+                rows.append({"attribute_id": attribute_id, "product_id": product_id})
+        return rows
+
+    def take_new_rows(self):
+        rows, self.new_rows = self.new_rows, []
+        return rows
+
+
+class ProductIds:
+    """(name, url) -> products.id: known products keep their id, new ones get the next free id"""
+
+    def __init__(self, rows=()):
+        self.ids = {(name, url): product_id for product_id, name, url in rows}
+        self.next_id = max(self.ids.values(), default=0) + 1
+
+    def assign(self, row):
+        key = (row["name"], row["url"])
+        product_id = self.ids.get(key)
+        if product_id is None:
+            product_id = self.ids[key] = self.next_id
+            self.next_id += 1
+        return product_id
+
+
+def dedupe_batch(rows):
+    """One row per (name, url) key of a batch: the last one wins, at the position of the first"""
+    latest = {}
+    for row in rows:
+        latest[(row["name"], row["url"])] = row
+    return list(latest.values())
+
+
+def update_product_counts(conn, values_table="attribute_values", junction_table="product_attributes"):
+    """Recount attribute_values.product_count (an index-only count per value)"""
+    conn.execute(text(
+        f"UPDATE {values_table} SET product_count = "
+        f"(SELECT COUNT(*) FROM {junction_table} pa WHERE pa.attribute_id = {values_table}.id)"
+    ))
+
+
+def insert_batched(conn, table, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        conn.execute(table.insert(), rows[start:start + batch_size])
+
+
+def load_positive_rates(path=RATE_CSV, chunksize=50000):
+    """product_title -> positive_rate hash lookup, read in chunks"""
+    rates = {}
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk = chunk.dropna(subset=["product_title"])
+        rates.update(zip(chunk["product_title"], chunk["positive_rate"]))
+    return rates
+
+
+def iter_product_batches(path=INFO_CSV, rates=None, chunksize=5000):
+    """Stream the product CSV as lists of row dicts with positive_rate merged in"""
+    rates = rates or {}
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        # Rename columns to match database table schema
+        chunk = chunk.rename(columns={"product_title": "name"})
+        chunk["positive_rate"] = [
+            rate if pd.notna(rate) else DEFAULT_POSITIVE_RATE
+            for rate in (rates.get(name) for name in chunk["name"])
+        ]
+        chunk = chunk[PRODUCT_COLUMNS].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        # Attribute columns are canonicalized by the import, which needs the split values anyway
+        yield chunk.to_dict("records")
+
+
+def create_missing_indexes(conn, table_name="products", indexes=PRODUCT_INDEXES,
+                           fulltext_indexes=FULLTEXT_INDEXES):
+    """
+    Add the indexes (and on MySQL the FULLTEXT indexes) a table does not have yet,
+    e.g. a products table created before an index was introduced.
+    """
+    existing = {index["name"] for index in inspect(conn).get_indexes(table_name)}
+    for suffix, columns in indexes.items():
+        name = f"ix_{table_name}_{suffix}"
+        if name not in existing:
+            conn.execute(text(f"CREATE INDEX {name} ON {table_name} ({', '.join(columns)})"))
+    if conn.dialect.name == "mysql":
+        for suffix, columns in fulltext_indexes.items():
+            name = f"ft_{table_name}_{suffix}"
+            if name not in existing:
+                conn.execute(text(f"CREATE FULLTEXT INDEX {name} ON {table_name} ({', '.join(columns)})"))
+
+
+def swap_in_staging(conn, staging_name, table_name="products", indexes=PRODUCT_INDEXES,
+                    fulltext_indexes=FULLTEXT_INDEXES):
+    """Atomically replace the live table with the fully loaded staging table"""
+    old_name = f"{table_name}_old"
+    conn.execute(text(f"DROP TABLE IF EXISTS {old_name}"))
+    exists = inspect(conn).has_table(table_name)
+    if conn.dialect.name == "mysql":
+        if exists:
+            conn.execute(text(f"RENAME TABLE {table_name} TO {old_name}, {staging_name} TO {table_name}"))
+        else:
+            conn.execute(text(f"RENAME TABLE {staging_name} TO {table_name}"))
+    else:
+        # SQLite / PostgreSQL: DDL is transactional, so the renames commit together
+        if exists:
+            conn.execute(text(f"ALTER TABLE {table_name} RENAME TO {old_name}"))
+        conn.execute(text(f"ALTER TABLE {staging_name} RENAME TO {table_name}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {old_name}"))
+
+    # Indexes keep their staging names after the rename; give them the live names back
+    for suffix, columns in indexes.items():
+        staging_index = f"ix_{staging_name}_{suffix}"
+        live_index = f"ix_{table_name}_{suffix}"
+        if conn.dialect.name == "mysql":
+            conn.execute(text(f"ALTER TABLE {table_name} RENAME INDEX {staging_index} TO {live_index}"))
+        else:
+            # Index names are global in SQLite / PostgreSQL and cannot be renamed in SQLite
+            conn.execute(text(f"DROP INDEX IF EXISTS {staging_index}"))
+            conn.execute(text(f"CREATE INDEX {live_index} ON {table_name} ({', '.join(columns)})"))
+    if conn.dialect.name == "mysql":
+        for suffix in fulltext_indexes:
+            staging_index = f"ft_{staging_name}_{suffix}"
+            conn.execute(text(f"ALTER TABLE {table_name} RENAME INDEX {staging_index} TO ft_{table_name}_{suffix}"))
+
+
+def upsert_batch(conn, tables, rows, product_ids, loaded, lookup, builder, batch_size):
+    """
+    Write one batch into (products, attribute_values, product_attributes): rows whose id is in `loaded`
+    are updated and get their attribute rows rewritten, the others are inserted. Returns the rows written.
+    """
+    products, attribute_values, product_attributes = tables
+    rows = dedupe_batch(rows)
+    inserts, updates, junction = [], [], []
+    for row in rows:
+        # Explicit ids, so the embeddings can be keyed without reading the rows back
+        row["id"] = product_ids.assign(row)
+        (updates if row["id"] in loaded else inserts).append(row)
+        loaded.add(row["id"])
+        junction += lookup.junction_rows(row["id"], canonicalize_row(row))
+
+    insert_batched(conn, products, inserts, batch_size)
+    if updates:
+        update_sql = text(f"UPDATE {products.name} SET "
+                          + ", ".join(f"{c} = :{c}" for c in PRODUCT_COLUMNS) + " WHERE id = :id")
+        delete_attributes_sql = text(f"DELETE FROM {product_attributes.name} WHERE product_id IN :ids")
+        delete_attributes_sql = delete_attributes_sql.bindparams(bindparam("ids", expanding=True))
+        for start in range(0, len(updates), batch_size):
+            conn.execute(update_sql, updates[start:start + batch_size])
+            conn.execute(delete_attributes_sql, {"ids": [r["id"] for r in updates[start:start + batch_size]]})
+    insert_batched(conn, attribute_values, lookup.take_new_rows(), batch_size)
+    insert_batched(conn, product_attributes, junction, batch_size)
+    if builder is not None:
+        builder.add([r["id"] for r in rows], [r["description"] for r in rows])
+    return rows
+
+
+def full_import(batches, builder, batch_size):
+    """
+    Load every row (and its attribute junction rows) into staging tables, then swap them in together;
+    readers keep the old tables meanwhile. Products already in the live table keep their ids, and the
+    embedding store is finished (stamped with the next catalog version) before the swap bumps it.
+    """
+    metadata = MetaData()
+    staging = define_products_table(metadata, "products_staging")
+    staging_values, staging_junction = define_attribute_tables(metadata, "_staging")
+    metadata.drop_all(db.engine, checkfirst=True)
     metadata.create_all(db.engine)
 
-    # Insert the final DataFrame into the database
-    final_df.to_sql('products', db.engine, if_exists='append', index=False)
+    product_ids = ProductIds()
+    if inspect(db.engine).has_table("products"):
+        with db.engine.connect() as conn:
+            product_ids = ProductIds(conn.execute(text("SELECT id, name, url FROM products")))
+
+    lookup = AttributeLookup()
+    loaded = set()
+    total = 0
+    with db.engine.begin() as conn:
+        for rows in batches:
+            total += len(upsert_batch(conn, (staging, staging_values, staging_junction), rows,
+                                      product_ids, loaded, lookup, builder, batch_size))
+        update_product_counts(conn, "attribute_values_staging", "product_attributes_staging")
+
+    if builder is not None:
+        with db.engine.begin() as conn:
+            ensure_catalog_meta(conn)
+            builder.finish(get_catalog_version(conn) + 1)
+
+    with db.engine.begin() as conn:
+        create_missing_indexes(conn, "products_staging")
+        for table_name in CATALOG_TABLES:
+            swap_in_staging(conn, f"{table_name}_staging", table_name, TABLE_INDEXES[table_name],
+                            TABLE_FULLTEXT_INDEXES.get(table_name, {}))
+        bump_catalog_version(conn)
+    return total
+
+
+def incremental_import(batches, builder, batch_size):
+    """
+    Upsert rows keyed on (name, url): update existing products, insert new ones.
+    The embedding store is finished before the catalog version is bumped.
+    """
+    metadata = MetaData()
+    tables = define_products_table(metadata), *define_attribute_tables(metadata)
+    metadata.create_all(db.engine)
+
+    with db.engine.begin() as conn:
+        for table_name in CATALOG_TABLES:
+            create_missing_indexes(conn, table_name, TABLE_INDEXES[table_name],
+                                   TABLE_FULLTEXT_INDEXES.get(table_name, {}))
+        product_ids = ProductIds(conn.execute(text("SELECT id, name, url FROM products")))
+        loaded = set(product_ids.ids.values())
+        lookup = AttributeLookup(conn.execute(text("SELECT id, field, value FROM attribute_values")))
+
+        total = 0
+        for rows in batches:
+            total += len(upsert_batch(conn, tables, rows, product_ids, loaded, lookup, builder, batch_size))
+
+        update_product_counts(conn)
+        if builder is not None:
+            ensure_catalog_meta(conn)
+            builder.finish(get_catalog_version(conn) + 1)
+        bump_catalog_version(conn)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the fragrance CSVs into the products table")
+    parser.add_argument("--info", default=INFO_CSV)
+    parser.add_argument("--rates", default=RATE_CSV)
+    parser.add_argument("--chunksize", type=int, default=5000, help="CSV rows read per chunk")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per executemany")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert by (name, url) instead of rebuilding the table")
+    parser.add_argument("--encode-workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to encode descriptions (default: one per CPU)")
+    parser.add_argument("--skip-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rates = load_positive_rates(args.rates)
+    batches = iter_product_batches(args.info, rates, args.chunksize)
+    builder = None
+    if not args.skip_embeddings:
+        builder = EmbeddingStoreBuilder(keep_existing=args.incremental, encode_workers=args.encode_workers)
+
+    # The description embeddings keyed by the product ids are written before the new rows go live
+    with app.app_context():
+        if args.incremental:
+            total = incremental_import(batches, builder, args.batch_size)
+        else:
+            total = full_import(batches, builder, args.batch_size)
+    seconds = time.perf_counter() - start
+
+    embeddings = "" if builder is None else f" with embeddings ({builder.encoded} encoded, {builder.reused} reused)"
+    print(f"Import successful! {total} products written{embeddings} in {seconds:.2f} s "
+          f"({total / max(seconds, 1e-9):.0f} rows/s).")
+
 
-    print("Import successful! Combined fragrance_info and positive_rate have been inserted into the products table.")
+if __name__ == "__main__":
+    main()
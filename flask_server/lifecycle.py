@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from bert_model import get_model, is_model_loaded, ENCODER_BACKEND
+from logging_setup import get_logger
+
+log = get_logger(__name__)
+
+# When heavy resources are loaded:
+#   "lazy"       - on first use by a request (fastest startup, slow first request)
+#   "background" - warmup thread started at server start; /ready reports 503 until it finishes
+#   "eager"      - warmup() runs before the server accepts traffic
+#                  (with gunicorn, in each worker; with PERFUME_PRELOAD=1 in the master, except the model)
+WARMUP_MODE = os.environ.get("PERFUME_WARMUP", "background")
+# Leave the model out of warmup(); set by gunicorn.conf.py when the app is preloaded in the master,
+# whose workers then call warm_model() after the fork (torch does not survive fork)
+DEFER_MODEL = os.environ.get("PERFUME_WARMUP_DEFER_MODEL", "0") == "1"
+
+_components = {}  # component -> {"ready": bool, "seconds": float, "error": str}
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+
+
+def _warm(name, fn):
+    start = time.perf_counter()
+    try:
+        fn()
+        _components[name] = {"ready": True, "seconds": round(time.perf_counter() - start, 3)}
+        log.info("Warmed up %s in %.2f s", name, _components[name]["seconds"])
+    except Exception as e:
+        _components[name] = {"ready": False, "error": str(e)}
+        log.error("Warmup of %s failed: %s", name, e)
+
+
+def warm_model():
+    _warm("model", lambda: get_model().encode(["warmup query"]))
+
+
+def warmup(app, include_model=not DEFER_MODEL):
+    """Load the model, embedding store and in-memory indexes once"""
+    # Imported here so that importing this module stays cheap
+    from embedding_store import get_product_store, get_vector_index
+    from attribute_index import get_attribute_index
+    from bm25_index import get_bm25_index
+    from vector_index import VECTOR_INDEX_KIND
+    from server_config import db
+
+    with _warmup_lock:
+        if include_model:
+            warm_model()
+        _warm("embedding_store", get_product_store)
+        if VECTOR_INDEX_KIND != "exact":
+            _warm("vector_index", get_vector_index)
+
+        def load_attribute_index():
+            with app.app_context():
+                get_attribute_index(db)
+        _warm("attribute_index", load_attribute_index)
+
+        def load_bm25_index():
+            with app.app_context():
+                get_bm25_index(db)
+        _warm("bm25_index", load_bm25_index)
+
+
+def start_warmup(app, mode=WARMUP_MODE):
+    """Apply the configured warmup mode; call once per process that serves requests"""
+    global _warmup_thread
+    if mode == "eager":
+        warmup(app)
+    elif mode == "background" and _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=warmup, args=(app,), name="warmup", daemon=True)
+        _warmup_thread.start()
+
+
+def readiness():
+    """(ready, details) for the /ready endpoint"""
+    if WARMUP_MODE == "lazy" and not _components:
+        # Nothing is preloaded in lazy mode: the process is ready, first requests pay the load
+        return True, {"mode": WARMUP_MODE, "encoder_backend": ENCODER_BACKEND, "model_loaded": is_model_loaded()}
+
+    expected = {"model", "embedding_store", "attribute_index", "bm25_index"}
+    ready = expected <= set(_components) and all(c["ready"] for c in _components.values())
+    return ready, {"mode": WARMUP_MODE, "encoder_backend": ENCODER_BACKEND, "model_loaded": is_model_loaded(),
+                   "components": dict(_components)}
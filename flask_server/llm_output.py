@@ -0,0 +1,251 @@
+import difflib
+import json
+import re
+from preprocess_query import preprocess_query
+from query_vocab import (
+    DEFAULT_QUERY, LIST_FIELDS, GENDER_VALUES, LONGEVITY_VALUES, SILLAGE_VALUES, SEASON_VALUES, TIME_VALUES
+)
+from rule_parser import PHRASE_TABLE
+
+# Closed vocabulary of every field the LLM is asked to fill
+FIELD_VALUES = {
+    "gender": GENDER_VALUES,
+    "longevity": LONGEVITY_VALUES,
+    "sillage": SILLAGE_VALUES,
+    "suitable_season": SEASON_VALUES,
+    "suitable_time": TIME_VALUES,
+}
+
+# Free-text fields passed through as lowercased lists (the rule parser fills them too)
+FREE_LIST_FIELDS = ("main_accords",)
+
+# Minimum difflib similarity for a near-miss ("femal", "long-lasting ") to be mapped onto the vocabulary
+CLOSE_MATCH_CUTOFF = 0.8
+
+# Separators of list values given as one string
+LIST_SEPARATOR = re.compile(r"\s*(?:,|/|\band\b|\bor\b)\s*")
+
+# Answers that mean "no value"
+EMPTY_VALUES = {"", "none", "null", "undefined", "unknown", "n/a", "any", "not specified"}
+
+# JSON schema for Ollama's structured-output mode (format=<schema>)
+PARSED_QUERY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "category": {"type": "string", "enum": ["perfume"]},
+        "gender": {"type": "string", "enum": GENDER_VALUES},
+        "longevity": {"type": "string", "enum": LONGEVITY_VALUES},
+        "sillage": {"type": "string", "enum": SILLAGE_VALUES},
+        "suitable_season": {"type": "array", "items": {"type": "string", "enum": SEASON_VALUES}, "maxItems": 2},
+        "suitable_time": {"type": "array", "items": {"type": "string", "enum": TIME_VALUES}},
+    },
+    "required": ["category"],
+}
+
+
+class JsonObjectScanner:
+    """
+    Incremental scanner for the first {...} object in streamed text.
+    feed() returns True as soon as the object's closing brace has arrived, so a streamed
+    generation can be cut off there. Quotes (single or double) and escapes are tracked,
+    so braces inside strings do not count.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self.start = -1
+        self.depth = 0
+        self.quote = None
+        self.escaped = False
+        self.done = False
+        self._length = 0
+        self._end = None
+
+    def feed(self, chunk):
+        if self.done or not chunk:
+            return self.done
+        offset = self._length
+        self._parts.append(chunk)
+        self._length += len(chunk)
+
+        for i, ch in enumerate(chunk):
+            if self.start < 0:
+                if ch == "{":
+                    self.start = offset + i
+                    self.depth = 1
+                continue
+            if self.quote:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == self.quote:
+                    self.quote = None
+            elif ch in "\"'":
+                self.quote = ch
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    self._end = offset + i + 1
+                    return True
+        return False
+
+    @property
+    def text(self):
+        """The object text so far (complete once done); empty if no object has started"""
+        if self.start < 0:
+            return ""
+        full = "".join(self._parts)
+        return full[self.start:self._end] if self.done else full[self.start:]
+
+
+# Tokens of near-JSON: double-quoted string (body, closing quote), single-quoted string (body, closing quote),
+# punctuation, bare word. Unclosed strings (a cut-off answer) match up to the end of the text.
+_TOKEN = re.compile(
+    r"""\s*(?:"((?:[^"\\]|\\.)*)(")?|'((?:[^'\\]|\\.)*)(')?|([{}\[\]:,])|([^\s{}\[\]:,"']+))""", re.S
+)
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?$")
+_BARE_WORDS = {"true": "true", "false": "false", "null": "null", "none": "null"}
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+def _repair(text):
+    """
+    Rewrite near-JSON as JSON: single-quoted strings, Python/bare literals (True, None, female),
+    missing commas between values, trailing commas, and unclosed strings/brackets of a cut-off object.
+    """
+    out = []
+    closers = []
+    previous = None  # kind of the last emitted token: "value", "open", ":", ","
+    for match in _TOKEN.finditer(text.translate(_SMART_QUOTES)):
+        double, _, single, _, punct, word = match.groups()
+        if punct in ("}", "]"):
+            if previous == ",":
+                out.pop()
+            if closers:
+                out.append(closers.pop())
+            previous = "value"
+            continue
+        if punct in (":", ","):
+            if punct == "," and previous in (",", "open", None):
+                continue
+            out.append(punct)
+            previous = punct
+            continue
+
+        if previous == "value":
+            out.append(",")  # two values in a row: the model forgot a comma
+        if punct in ("{", "["):
+            out.append(punct)
+            closers.append("}" if punct == "{" else "]")
+            previous = "open"
+            continue
+        if double is not None:
+            token = f'"{double}"'
+        elif single is not None:
+            token = json.dumps(single.replace("\\'", "'"))
+        elif word.lower() in _BARE_WORDS:
+            token = _BARE_WORDS[word.lower()]
+        elif _NUMBER.match(word):
+            token = word
+        else:
+            token = json.dumps(word)
+        out.append(token)
+        previous = "value"
+
+    if previous == ",":
+        out.pop()
+    out.extend(reversed(closers))
+    return "".join(out)
+
+
+def loads_tolerant(text):
+    """json.loads, falling back to a repaired version of near-JSON text. Raises ValueError."""
+    try:
+        return json.loads(text, strict=False)
+    except ValueError:
+        return json.loads(_repair(text), strict=False)
+
+
+def extract_json_object(text):
+    """First JSON object in a model answer (surrounding text ignored), or None"""
+    scanner = JsonObjectScanner()
+    scanner.feed(text or "")
+    if not scanner.text:
+        return None
+    try:
+        parsed = loads_tolerant(scanner.text)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+# Strings a near-miss is compared with: the vocabulary and the rule parser's synonyms of each field
+_CLOSE_MATCH_CANDIDATES = {
+    field: list(values) + [phrase for phrase, (f, _) in PHRASE_TABLE.items() if f == field]
+    for field, values in FIELD_VALUES.items()
+}
+
+
+def _normalize_value(field, value):
+    """Map one answer value onto the field's vocabulary; returns a list of values (maybe empty)"""
+    raw = str(value).strip().lower()
+    if raw in EMPTY_VALUES:
+        return []
+    vocabulary = FIELD_VALUES[field]
+    if raw in vocabulary:
+        return [raw]
+
+    key = preprocess_query(raw)
+    entry = PHRASE_TABLE.get(key)
+    if entry is not None and entry[0] == field:
+        return list(entry[1])
+    if field == "suitable_time" and key in ("both", "all", "any time", "anytime"):
+        return list(TIME_VALUES)
+    if field == "suitable_season" and key in ("all", "every season", "all seasons"):
+        return list(SEASON_VALUES)
+
+    close = difflib.get_close_matches(key, _CLOSE_MATCH_CANDIDATES[field], n=1, cutoff=CLOSE_MATCH_CUTOFF)
+    if not close:
+        return []
+    return [close[0]] if close[0] in vocabulary else list(PHRASE_TABLE[close[0]][1])
+
+
+def normalize_parsed_query(parsed):
+    """
+    Validate a parsed object against the closed vocabularies: every field of DEFAULT_QUERY is present,
+    near-misses are mapped to the closest allowed value, anything unrecognised becomes None.
+    """
+    result = dict(DEFAULT_QUERY)
+    for field in FIELD_VALUES:
+        value = parsed.get(field)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            items = value
+        elif field in LIST_FIELDS:
+            items = LIST_SEPARATOR.split(str(value))  # "spring, summer" / "day and night"
+        else:
+            items = [value]
+        values = []
+        for item in items:
+            if isinstance(item, (str, int, float)) and not isinstance(item, bool):
+                values.extend(v for v in _normalize_value(field, item) if v not in values)
+        if field in LIST_FIELDS:
+            # Keep vocabulary order, so equal answers compare (and cache) equal
+            result[field] = [v for v in FIELD_VALUES[field] if v in values] or None
+        else:
+            result[field] = values[0] if values else None
+
+    for field in FREE_LIST_FIELDS:
+        value = parsed.get(field)
+        if isinstance(value, str):
+            value = value.split(",")
+        if isinstance(value, list):
+            items = [str(v).strip().lower() for v in value if isinstance(v, str) and v.strip()]
+            if items:
+                result[field] = items
+    return result
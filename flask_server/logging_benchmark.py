@@ -0,0 +1,109 @@
+# Per-request cost of the request-path logging: the old print() calls vs the queued logger
+# at different levels / DEBUG sampling rates. Uses a stand-in route that logs what /search_by_bert logs.
+import argparse
+import contextlib
+import logging
+import time
+import numpy as np
+import pandas as pd
+from flask import Flask, jsonify
+from logging_setup import get_logger, setup_logging, stop_logging, set_log_level, init_request_logging
+
+log = get_logger("benchmark")
+
+PARSED = {"main_accords": ["vanilla", "sweet"], "gender": "female", "suitable_season": ["winter"],
+          "suitable_time": ["night"], "longevity": "long lasting", "sillage": "undefined"}
+SQL = "SELECT id, name, description, positive_rate FROM products WHERE 1=1 AND (main_accords LIKE :accord_0)"
+
+
+def make_app(style, matched, k):
+    app = Flask(__name__)
+    names = [f"Perfume {i} Eau de Parfum Spray for Women, 1.7 Ounce" for i in range(matched)]
+    results = [{"name": names[i], "final_score": 0.9 - i * 0.01} for i in range(k)]
+
+    if style == "print":
+        @app.route("/search")
+        def search():
+            # What search_by_bert printed before the logging layer
+            print("🧪 Raw user query:", "sweet vanilla perfume for winter nights")
+            print("🧠 Parsed structured query:", PARSED)
+            print("Constructed SQL:", SQL)
+            print("SQL parameters:", {"accord_0": "%vanilla%"})
+            print(f"🎯 Number of matched products: {matched}")
+            for name in names:
+                print("➡️ Product:", name)
+            print(f"🔍 Top {k} similarity-based recommendations:")
+            for r in results:
+                print(f"{r['name']} - Score: {r['final_score']:.3f}")
+            return jsonify(results)
+    else:
+        init_request_logging(app)
+
+        @app.route("/search")
+        def search():
+            # What search_by_bert logs now
+            log.debug("Raw user query: %s", "sweet vanilla perfume for winter nights")
+            log.debug("Parsed structured query: %s", PARSED)
+            log.debug("Constructed SQL: %s with parameters %s", SQL, {"accord_0": "%vanilla%"})
+            log.debug("Number of matched products: %d", matched)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Results %d-%d: %s", 1, len(results),
+                          ", ".join(f"{r['name']} ({r['final_score']:.3f})" for r in results))
+            return jsonify(results)
+    return app
+
+
+def run(app, requests):
+    client = app.test_client()
+    for _ in range(50):
+        client.get("/search")
+    times = np.empty(requests)
+    for i in range(requests):
+        start = time.perf_counter()
+        client.get("/search")
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request-path logging overhead benchmark")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--matched", type=int, default=200, help="products matched by the filter")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--sink", default="logging_benchmark.out",
+                        help="file receiving stdout / log output (line buffered like a console)")
+    args = parser.parse_args()
+
+    configs = [
+        ("print() (before)", "print", None, None),
+        ("logging off (WARNING)", "log", "WARNING", 0.0),
+        ("INFO, access line only", "log", "INFO", 0.0),
+        ("INFO + DEBUG for 1% of requests", "log", "INFO", 0.01),
+        ("INFO + DEBUG for 10% of requests", "log", "INFO", 0.10),
+        ("DEBUG for every request", "log", "DEBUG", 0.0),
+    ]
+
+    rows = []
+    with open(args.sink, "w", buffering=1) as sink:
+        for label, style, level, sample in configs:
+            app = make_app(style, args.matched, args.k)
+            if style == "print":
+                with contextlib.redirect_stdout(sink):
+                    times = run(app, args.requests)
+            else:
+                setup_logging(stream=sink)
+                set_log_level(level, sample)
+                times = run(app, args.requests)
+                stop_logging()
+            rows.append({"config": label, "mean_us": times.mean() * 1e6,
+                         "p50_us": np.percentile(times, 50) * 1e6, "p99_us": np.percentile(times, 99) * 1e6})
+
+    df = pd.DataFrame(rows)
+    baseline = df.loc[df["config"] == "logging off (WARNING)", "mean_us"].iloc[0]
+    df["overhead_us"] = df["mean_us"] - baseline
+    print(f"\n📊 {args.requests} requests, {args.matched} matched products, k={args.k}, sink={args.sink}\n")
+    print(df.to_markdown(index=False, floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_request_context, request
+
+# Logging settings (override through environment variables)
+LOG_LEVEL = os.environ.get("PERFUME_LOG_LEVEL", "INFO").upper()
+# Fraction of requests that log at DEBUG level regardless of LOG_LEVEL (0 = none, 1 = all)
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("PERFUME_LOG_DEBUG_SAMPLE", "0"))
+LOG_FORMAT = os.environ.get("PERFUME_LOG_FORMAT", "text")  # "text" or "json"
+
+REQUEST_ID_HEADER = "X-Request-ID"
+ROOT_LOGGER = "perfume"
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"
+
+_listener = None
+_setup_args = None
+
+# Request id of work done outside the Flask request context (the async server's parse on the event loop)
+_request_id = ContextVar("perfume_request_id", default="-")
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the id of the current request ("-" outside requests)"""
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id", "-") if has_request_context() else _request_id.get()
+        return True
+
+
+def new_request_id(headers_value=None):
+    """The client's X-Request-ID if it sent one, otherwise a new id"""
+    return headers_value or uuid.uuid4().hex[:16]
+
+
+@contextmanager
+def request_id_context(request_id):
+    """Stamp the records logged in this block (and the tasks it starts) with request_id"""
+    token = _request_id.set(request_id)
+    try:
+        yield
+    finally:
+        _request_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _request_sampled():
+    return has_request_context() and g.get("log_sampled", False)
+
+
+class RequestLogger(logging.LoggerAdapter):
+    """
+    Logger adapter whose DEBUG level is switched on per request: debug() calls are dropped
+    before any formatting unless LOG_LEVEL is DEBUG or the current request was sampled.
+    """
+
+    def isEnabledFor(self, level):
+        if level >= _level:
+            return True
+        return level >= logging.DEBUG and _request_sampled()
+
+
+def _numeric_level(level):
+    value = logging.getLevelName(str(level).upper()) if not isinstance(level, int) else level
+    return value if isinstance(value, int) else logging.INFO
+
+
+_level = _numeric_level(LOG_LEVEL)
+
+
+def get_logger(name):
+    """Logger for a module of the server, e.g. get_logger(__name__)"""
+    logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+    return RequestLogger(logger, {})
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """
+    Route the server's log records through a queue to a background listener thread,
+    so request threads never block on console or file I/O. Safe to call more than once.
+    """
+    global _listener, _setup_args
+    root = logging.getLogger(ROOT_LOGGER)
+    if _listener is not None:
+        return root
+    _setup_args = (level, fmt, stream)
+
+    if level is not None:
+        set_log_level(level)
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if (fmt or LOG_FORMAT) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filters run in the thread that logs, where the flask request context is still available
+    queue_handler.addFilter(RequestContextFilter())
+
+    # Level filtering happens in RequestLogger; the logger itself passes everything on
+    root.setLevel(logging.DEBUG)
+    root.handlers[:] = [queue_handler]
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_logging)
+    return root
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_in_child():
+    # The listener thread does not survive fork (gunicorn preload_app); start a new one in the worker
+    global _listener
+    if _listener is not None:
+        _listener = None
+        setup_logging(*_setup_args)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
+
+
+def set_log_level(level=None, debug_sample_rate=None):
+    """Change the level / DEBUG sampling rate at runtime"""
+    global _level, LOG_DEBUG_SAMPLE_RATE
+    if level is not None:
+        _level = _numeric_level(level)
+    if debug_sample_rate is not None:
+        LOG_DEBUG_SAMPLE_RATE = float(debug_sample_rate)
+
+
+_request_log = get_logger("request")
+
+
+def init_request_logging(app):
+    """Assign every request an id (X-Request-ID, generated if absent) and decide whether it is sampled"""
+
+    @app.before_request
+    def _start_request():
+        g.request_id = new_request_id(request.headers.get(REQUEST_ID_HEADER))
+        g.log_sampled = LOG_DEBUG_SAMPLE_RATE > 0 and random.random() < LOG_DEBUG_SAMPLE_RATE
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_request(response):
+        response.headers[REQUEST_ID_HEADER] = g.get("request_id", "-")
+        if "request_start" in g:
+            _request_log.info("%s %s %s %.1f ms", request.method, request.path, response.status_code,
+                              (time.perf_counter() - g.request_start) * 1000)
+        return response
@@ -0,0 +1,231 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import Blueprint, Response, current_app, g, has_request_context, request, jsonify
+
+# Histogram bucket upper bounds in seconds (50 us .. 30 s)
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three additions under a lock"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot: above the largest bucket
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[slot] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+    def quantile(self, q, snapshot=None):
+        """Estimate from the buckets, interpolating linearly inside the bucket holding the quantile"""
+        counts, _, count = snapshot or self.snapshot()
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Latency histograms and counters keyed by (name, labels)"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+                self._help.setdefault(name, help_text)
+        return histogram
+
+    def inc(self, name, amount=1, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, help_text)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    @staticmethod
+    def _labels(pairs, extra=()):
+        pairs = list(pairs) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (histograms, counters and p50/p95/p99 gauges)"""
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if self._help.get(name):
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        quantile_lines = []
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            declare(name, "histogram")
+            snapshot = histogram.snapshot()
+            counts, total, count = snapshot
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {count}")
+            for q in QUANTILES:
+                quantile_lines.append((f"{name}_quantile", labels, q, histogram.quantile(q, snapshot)))
+
+        for name, labels, q, value in quantile_lines:
+            declare(name, "gauge")
+            lines.append(f"{name}{self._labels(labels, [('quantile', q)])} {value:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """{name: [{labels, count, mean, p50, p95, p99}]} for humans and benchmarks"""
+        result = {}
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            snapshot = histogram.snapshot()
+            _, total, count = snapshot
+            entry = {"labels": dict(labels), "count": count, "mean_ms": total / count * 1000 if count else 0.0}
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}_ms"] = histogram.quantile(q, snapshot) * 1000
+            result.setdefault(name, []).append(entry)
+        result["counters"] = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(self._counters.items())
+        ]
+        return result
+
+
+# Registry shared by the whole process
+registry = MetricsRegistry()
+
+STAGE_METRIC = "perfume_stage_seconds"
+REQUEST_METRIC = "perfume_request_seconds"
+
+# WSGI environ entry with the [(stage, seconds)] measured before the request reached Flask
+# (the async server's parse on the event loop); they are added to the Server-Timing header
+STAGE_TIMINGS_ENVIRON_KEY = "perfume.stage_timings"
+
+# Stages timed outside a Flask request context, while collect_stages() is active
+_collected_stages = ContextVar("perfume_collected_stages", default=None)
+
+
+def record_stage(stage, seconds):
+    """Add one measured duration of a pipeline stage (for stages timed by hand, e.g. across a loop)"""
+    registry.histogram(STAGE_METRIC, "Time spent in each search pipeline stage", stage=stage).observe(seconds)
+    if has_request_context():
+        timings = g.get("server_timing")
+    else:
+        timings = _collected_stages.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def collect_stages():
+    """Collect the stages timed in this block outside Flask (e.g. on the event loop) into the yielded list"""
+    timings = []
+    token = _collected_stages.set(timings)
+    try:
+        yield timings
+    finally:
+        _collected_stages.reset(token)
+
+
+@contextmanager
+def span(stage):
+    """
+    Time one stage of the search pipeline into the perfume_stage_seconds{stage=...} histogram
+    and, when Server-Timing is on for this request, into the response header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def init_request_metrics(app):
+    """Count and time every request; add a Server-Timing header when SERVER_TIMING_ENABLED is set"""
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        if current_app.config.get("SERVER_TIMING_ENABLED", False):
+            g.server_timing = list(request.environ.get(STAGE_TIMINGS_ENVIRON_KEY, ()))
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get("metrics_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        registry.histogram(REQUEST_METRIC, "Request latency by route", route=route).observe(elapsed)
+        registry.inc("perfume_requests_total", help_text="Requests by route and status",
+                     route=route, status=response.status_code)
+
+        timings = g.get("server_timing")
+        if timings is not None:
+            # Stages measured up to here; streamed bodies are still being written
+            totals = {}
+            for stage, seconds in timings:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+            entries = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+            entries.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(entries)
+        return response
+
+
+# Prometheus scrape endpoint
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text format; ?format=json returns p50/p95/p99 per stage in milliseconds"""
+    if request.args.get("format") == "json":
+        return jsonify(registry.summary())
+    return Response(registry.render_prometheus(), mimetype="text/plain; version=0.0.4")
@@ -1,8 +1,22 @@
-
+# Compare Ollama models on the production parsing prompt: field accuracy against gold labels,
+# latency percentiles and generation speed per model.
+# Generations run concurrently (--workers) and completed results are cached in a JSONL file keyed by
+# (model, prompt hash, query), so a rerun only generates what is new (another model, a changed prompt).
+#
+#   python model_comparison.py                       # against OLLAMA_BASE_URL
+#   python model_comparison.py --fake --fake-delay 0.2   # against the local fake Ollama server
+import argparse
+import hashlib
+import json
+import os
+import threading
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-import json
+from ollama_client import OllamaClient, OllamaError, OLLAMA_BASE_URL
+from ollama_parser import build_prompt, parse_model_output, generation_options
+from rule_parser_benchmark import FIELDS, normalize_field
 
 
 test_queries = [
@@ -13,7 +27,7 @@ test_queries = [
     "I need a perfume with good sillage",
     "Unisex fragrance for spring mornings",
     "Something sexy and musky for date night",
-    "A perfume that projects strongly and lasts forever"
+    "A perfume that projects strongly and lasts forever",
     "Gender-neutral office-safe scent for daily wear.",
     "All-year-round clean perfume, from day to night.",
     "Not too heavy, lasts a while; good for spring classes.",
@@ -36,104 +50,189 @@ test_queries = [
 
 model_names = ["mistral", "llama2", "gemma", "tinyllama"]
 
+GOLD_FILE = "model_comparison_gold.json"
+CACHE_FILE = "model_comparison_cache.jsonl"
+RESULTS_FILE = "model_comparison_results.csv"
+SUMMARY_FILE = "model_comparison_summary.csv"
 
-# Format the prompt for structured extraction
-
-def build_prompt(user_query):
-    return f"""
-You are an intelligent assistant for a perfume recommendation system.
-Your task is to extract structured JSON data from the user's natural language query.
-
-You must identify and return the following fields:
-- "category": set as "perfume"
-- "gender": one of ["male", "female", "unisex"], based on user preference
-- "longevity": one of ["moderate", "long lasting", "eternal", "weak", "very weak"]
-- "sillage": one of ["intimate", "moderate", "strong", "very strong", "enormous"]
-- "suitable_season": list of up to 2 values from ["spring", "summer", "autumn", "winter"]
-- "suitable_time": list containing "day", "night", or both
-
-Instructions:
-- Use fuzzy matching to recognize synonyms (e.g., "last all day" → "long lasting", "powerful scent trail" → "strong" sillage).
-- "last long", "lasts long", "stays long", "lasts all day" → "long lasting"
-- "not very long", "soft"→ "weak" "lightly lasts" → "very weak"
-- For season and time, identify implicit expressions like “sunny” → “summer”, “evening” → “night”.
-- Only return values when confident. Omit uncertain fields.
-- Output JSON only, no extra commentary.
-
-Examples:
-
-User input: "Looking for a long-lasting floral perfume with strong projection, best for winter nights"
-Response:
-{{
-  "category": "perfume",
-  "longevity": "long lasting",
-  "sillage": "strong",
-  "suitable_season": ["winter"],
-  "suitable_time": ["night"]
-}}
-
-User input: "A soft and fresh scent for spring and summer days, preferably for women"
-Response:
-{{
-  "category": "perfume",
-  "gender": "female",
-  "longevity": "moderate",
-  "suitable_season": ["spring", "summer"],
-  "suitable_time": ["day"]
-}}
-
-Now, the user's input is:
-"{user_query}"
-
-Please return only the JSON format, without any additional text:
-"""
-
-
-# Function to query Ollama model and measure response time
-
-def query_model(model, user_query):
-    prompt = build_prompt(user_query)
-    payload = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False
-    }
 
-    start_time = time.perf_counter()
-    response = requests.post("http://localhost:11434/api/generate", json=payload)
-    end_time = time.perf_counter()
+def prompt_hash(prompt, options):
+    """Hash of everything sent besides the model: the prompt and the generation options"""
+    key = prompt + json.dumps(options, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
 
-    duration = round(end_time - start_time, 3)
-    try:
-        raw_output = response.json().get("response", "").strip()
-        structured = json.loads(raw_output)
-    except Exception as e:
-        structured = None
 
-    return raw_output, duration, structured
+class ResultCache:
+    """Completed generations, appended to a JSONL file as they finish (an interrupted run keeps its progress)"""
 
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[self.key(entry["model"], entry["prompt_hash"], entry["query"])] = entry
 
-# Run comparison and store results
+    @staticmethod
+    def key(model, p_hash, query):
+        return model, p_hash, query
 
-records = []
+    def get(self, model, p_hash, query):
+        return self._entries.get(self.key(model, p_hash, query))
 
-for model in model_names:
-    print(f"\n🔍 Testing model: {model}")
-    for query in test_queries:
-        print(f"🧪 Query: {query}")
-        output_text, duration, parsed = query_model(model, query)
+    def add(self, entry):
+        with self._lock:
+            self._entries[self.key(entry["model"], entry["prompt_hash"], entry["query"])] = entry
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-        records.append({
-            "model": model,
-            "query": query,
-            "response": output_text,
-            "parsed_json": parsed,
-            "time_sec": duration
-        })
 
+def generate(client, model, query, prompt, p_hash):
+    """One generation; returns a cache entry (time_sec without the wait for a slot), or raises OllamaError"""
+    result, seconds = client.timed_generate(model, prompt, **generation_options())
+    return {
+        "model": model,
+        "prompt_hash": p_hash,
+        "query": query,
+        "response": result.get("response", "").strip(),
+        "time_sec": round(seconds, 3),
+        "eval_count": result.get("eval_count"),
+        "eval_duration": result.get("eval_duration"),
+    }
+
+
+def run_comparison(client, models, queries, cache, workers):
+    """Generate every (model, query) pair missing from the cache; returns the entries of all pairs"""
+    jobs = []
+    entries = {}
+    for model in models:
+        for query in queries:
+            prompt = build_prompt(query)
+            p_hash = prompt_hash(prompt, generation_options())
+            cached = cache.get(model, p_hash, query)
+            if cached is not None:
+                entries[(model, query)] = dict(cached, cached=True)
+            else:
+                jobs.append((model, query, prompt, p_hash))
+
+    print(f"🔍 {len(models)} models x {len(queries)} queries: {len(entries)} cached, "
+          f"{len(jobs)} to generate with {workers} workers")
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(generate, client, *job): job for job in jobs}
+        for future in as_completed(futures):
+            model, query, _, _ = futures[future]
+            try:
+                entry = future.result()
+            except OllamaError as e:
+                print(f"❌ {model} / {query}: {e}")
+                continue
+            cache.add(entry)
+            entries[(model, query)] = dict(entry, cached=False)
+    if jobs:
+        print(f"⏱ Generation finished in {time.perf_counter() - start_time:.1f} s")
+
+    return [entries[(m, q)] for m in models for q in queries if (m, q) in entries]
+
+
+def score_fields(parsed, gold):
+    """{field: correct} against the gold labels (fields missing from the labels must be empty)"""
+    return {
+        field: normalize_field((parsed or {}).get(field)) == normalize_field(gold.get(field))
+        for field in FIELDS
+    }
 
-# Save result to CSV
 
-df = pd.DataFrame(records)
-df.to_csv("model_comparison_results.csv", index=False)
-print("✅ Comparison completed. Results saved to 'model_comparison_results.csv'")
+def build_records(entries, gold_labels):
+    records = []
+    for entry in entries:
+        parsed = parse_model_output(entry["response"]) if entry["response"] else None
+        gold = gold_labels.get(entry["query"])
+        record = {
+            "model": entry["model"],
+            "query": entry["query"],
+            "response": entry["response"],
+            "parsed_json": parsed,
+            "time_sec": entry["time_sec"],
+            "eval_count": entry.get("eval_count"),
+            "eval_duration": entry.get("eval_duration"),
+            "cached": entry["cached"],
+        }
+        if gold is not None:
+            correct = score_fields(parsed, gold)
+            record.update({f"{field}_correct": ok for field, ok in correct.items()})
+            record["all_fields_correct"] = all(correct.values())
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def summarize(df):
+    rows = []
+    correct_columns = [f"{field}_correct" for field in FIELDS if f"{field}_correct" in df]
+    for model, group in df.groupby("model", sort=False):
+        times = group["time_sec"].to_numpy()
+        tokens = group["eval_count"].fillna(0).sum()
+        eval_seconds = group["eval_duration"].fillna(0).sum() / 1e9
+        labelled = group.dropna(subset=["all_fields_correct"]) if "all_fields_correct" in group else group.iloc[:0]
+        rows.append({
+            "model": model,
+            "queries": len(group),
+            "generated": int((~group["cached"]).sum()),
+            "parse_rate": group["parsed_json"].notna().mean(),
+            "field_accuracy": labelled[correct_columns].to_numpy(dtype=float).mean() if len(labelled) else np.nan,
+            "exact_match": labelled["all_fields_correct"].astype(float).mean() if len(labelled) else np.nan,
+            "p50_sec": np.percentile(times, 50),
+            "p95_sec": np.percentile(times, 95),
+            "p99_sec": np.percentile(times, 99),
+            "tokens_per_sec": tokens / eval_seconds if eval_seconds > 0 else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Ollama models on the query parsing prompt")
+    parser.add_argument("--models", nargs="+", default=model_names)
+    parser.add_argument("--workers", type=int, default=4, help="concurrent generations")
+    parser.add_argument("--base-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--gold", default=GOLD_FILE)
+    parser.add_argument("--cache", default=CACHE_FILE)
+    parser.add_argument("--no-cache", action="store_true", help="generate everything again")
+    parser.add_argument("--output", default=RESULTS_FILE)
+    parser.add_argument("--summary", default=SUMMARY_FILE)
+    parser.add_argument("--fake", action="store_true", help="run against a local fake Ollama server")
+    parser.add_argument("--fake-delay", type=float, default=0.1, help="seconds per fake generation")
+    args = parser.parse_args()
+
+    base_url = args.base_url
+    if args.fake:
+        from fake_ollama import start_fake_ollama
+        fake_server, base_url = start_fake_ollama(delay=args.fake_delay)
+        print(f"🧪 Fake Ollama at {base_url}")
+
+    with open(args.gold, "r", encoding="utf-8") as f:
+        gold_labels = json.load(f)
+
+    client = OllamaClient(base_url=base_url, max_concurrency=args.workers)
+    cache = ResultCache(None if args.no_cache else args.cache)
+    entries = run_comparison(client, args.models, test_queries, cache, args.workers)
+    client.close()
+    if args.fake:
+        fake_server.shutdown()
+
+    df = build_records(entries, gold_labels)
+    summary = summarize(df)
+    print("\n📊 Per-model results:\n")
+    print(summary.to_markdown(index=False, floatfmt=".3f"))
+
+    df.to_csv(args.output, index=False)
+    summary.to_csv(args.summary, index=False)
+    print(f"✅ Comparison completed. Results saved to '{args.output}' and '{args.summary}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # only needed by the async server (async_server.py)
+    httpx = None
+
+# Ollama server settings (override through environment variables)
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "60"))
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "2"))
+# Bound on one generation including the wait for a slot, retries and backoff: every attempt only gets
+# the time left, so retries cannot multiply the read timeout
+OLLAMA_DEADLINE = float(os.environ.get("OLLAMA_DEADLINE", "90"))
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "4"))
+
+# Answers retried (with backoff) like connection errors. A read timeout is not retried: the
+# generation was running, and sending it again would only queue a second one behind it.
+RETRY_STATUSES = (429, 502, 503, 504)
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+class OllamaError(Exception):
+    """Raised when Ollama cannot be reached or answers with an error"""
+
+
+def backoff_seconds(attempt):
+    """Wait before retry number `attempt` (1, 2, ...)"""
+    return RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+
+
+class OllamaClient:
+    """
+    Shared Ollama client: pooled keep-alive HTTP session, timeouts, retries within a total deadline,
+    a cap on concurrent generations, and de-duplication of identical in-flight requests
+    (simultaneous callers with the same model/prompt/options share one generation).
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, retries=OLLAMA_RETRIES, deadline=OLLAMA_DEADLINE,
+                 max_concurrency=OLLAMA_MAX_CONCURRENCY):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.deadline = deadline
+        self.max_concurrency = max_concurrency
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_concurrency, 1))
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+
+    @property
+    def generate_endpoint(self):
+        return f"{self.base_url}/api/generate"
+
+    @staticmethod
+    def _request_key(payload):
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def generate(self, model, prompt, **options):
+        """
+        Non-streaming /api/generate call; returns Ollama's JSON body
+        (with "response", "eval_count", "eval_duration", ...). Raises OllamaError.
+        """
+        return self.timed_generate(model, prompt, **options)[0]
+
+    def timed_generate(self, model, prompt, **options):
+        """
+        generate() returning (JSON body, seconds): the time of the HTTP request(s) alone, without the
+        wait for a free slot. A caller sharing another's generation gets that generation's time.
+        """
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        payload.update(options)
+        key = self._request_key(payload)
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._post(payload)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _post(self, payload):
+        """(JSON body, request seconds) of one generation"""
+        deadline = time.monotonic() + self.deadline
+        with self._slot(deadline):
+            start = time.perf_counter()
+            response = self._send(payload, deadline)
+            seconds = time.perf_counter() - start
+
+        if response.status_code != 200:
+            raise OllamaError(f"Ollama API error {response.status_code}: {response.text}")
+        try:
+            return response.json(), seconds
+        except ValueError as e:
+            raise OllamaError(f"Ollama returned invalid JSON: {response.text[:200]}") from e
+
+    @contextmanager
+    def _slot(self, deadline):
+        """Hold a concurrency slot, waited for until the deadline"""
+        if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise OllamaError("Ollama request timed out waiting for a free slot")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def _send(self, payload, deadline, stream=False):
+        """
+        POST the payload, retrying connection errors and RETRY_STATUSES with backoff while the deadline
+        allows; each attempt's timeouts are capped by the time left. Returns the last response.
+        """
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(backoff_seconds(attempt), max(deadline - time.monotonic(), 0)))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            try:
+                response = self.session.post(self.generate_endpoint, json=payload, timeout=timeout, stream=stream)
+            except requests.ConnectionError as e:  # includes connect timeouts, not read timeouts
+                error = OllamaError(f"Ollama request failed: {e}")
+                continue
+            except requests.RequestException as e:
+                raise OllamaError(f"Ollama request failed: {e}") from e
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            error = OllamaError(f"Ollama API error {response.status_code}: {response.text}")
+            response.close()
+        else:
+            raise error
+        raise OllamaError(f"Ollama request exceeded its {self.deadline:g} s deadline")
+
+    def generate_stream(self, model, prompt, **options):
+        """
+        Streaming /api/generate call: yields Ollama's chunks ({"response": ..., "done": ...}) as they arrive.
+        Closing the generator early closes the connection, which makes Ollama stop generating.
+        Streams are not shared between callers like generate(). Raises OllamaError.
+        """
+        payload = {"model": model, "prompt": prompt, "stream": True}
+        payload.update(options)
+        # The deadline bounds getting the answer started; chunks then arrive within the read timeout each
+        deadline = time.monotonic() + self.deadline
+        with self._slot(deadline):
+            response = self._send(payload, deadline, stream=True)
+            try:
+                if response.status_code != 200:
+                    raise OllamaError(f"Ollama API error {response.status_code}: {response.text}")
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError as e:
+                        raise OllamaError(f"Ollama returned invalid JSON: {line[:200]!r}") from e
+                    if chunk.get("error"):
+                        raise OllamaError(f"Ollama API error: {chunk['error']}")
+                    yield chunk
+                    if chunk.get("done"):
+                        return
+            except requests.RequestException as e:
+                raise OllamaError(f"Ollama stream failed: {e}") from e
+            finally:
+                response.close()
+
+    def generate_many(self, jobs, max_workers=None):
+        """
+        Run many (model, prompt) jobs concurrently, bounded by max_concurrency.
+        Returns one (result, error, seconds) triple per job, in order; seconds is the request time
+        (see timed_generate), None on errors.
+        """
+        def run(job):
+            model, prompt = job
+            try:
+                (result, seconds), error = self.timed_generate(model, prompt), None
+            except OllamaError as e:
+                result, seconds, error = None, None, e
+            return result, error, seconds
+
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_concurrency) as pool:
+            return list(pool.map(run, jobs))
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncOllamaClient:
+    """
+    asyncio counterpart of OllamaClient.generate() for the async server: a generation is awaited
+    without holding a thread. Same timeouts, retries, cap on concurrent generations and sharing of
+    identical in-flight requests. The httpx client, the slots and the in-flight requests belong to an
+    event loop, so they are created on first use in each loop that calls generate(); close() releases
+    the current loop's. `transport` replaces the network transport (e.g. httpx.MockTransport in tests).
+    """
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, retries=OLLAMA_RETRIES, deadline=OLLAMA_DEADLINE,
+                 max_concurrency=OLLAMA_MAX_CONCURRENCY, transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.deadline = deadline
+        self.max_concurrency = max(max_concurrency, 1)
+        self.transport = transport
+        self._loops = weakref.WeakKeyDictionary()  # event loop -> _LoopResources
+        self.coalesced = 0
+
+    @property
+    def generate_endpoint(self):
+        return f"{self.base_url}/api/generate"
+
+    def _resources(self):
+        """Client, slots and in-flight requests of the running event loop"""
+        loop = asyncio.get_running_loop()
+        resources = self._loops.get(loop)
+        if resources is None:
+            if httpx is None:
+                raise OllamaError("The async Ollama client needs httpx (pip install httpx)")
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                transport=self.transport
+            )
+            resources = self._loops[loop] = _LoopResources(client, asyncio.Semaphore(self.max_concurrency))
+        return resources
+
+    async def generate(self, model, prompt, **options):
+        """Non-streaming /api/generate call, like OllamaClient.generate(). Raises OllamaError."""
+        payload = {"model": model, "prompt": prompt, "stream": False}
+        payload.update(options)
+        key = OllamaClient._request_key(payload)
+        resources = self._resources()
+        inflight = resources.inflight
+
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._post(resources, payload))
+            inflight[key] = task
+
+            def finished(task):
+                if inflight.get(key) is task:
+                    del inflight[key]
+                # Every waiter may have been cancelled; retrieve the error so it is not reported as lost
+                if not task.cancelled():
+                    task.exception()
+            task.add_done_callback(finished)
+        else:
+            self.coalesced += 1
+        # A caller that goes away (client disconnect) does not cancel the generation the others wait for
+        return await asyncio.shield(task)
+
+    async def _post(self, resources, payload):
+        client, slots = resources.client, resources.slots
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(min(backoff_seconds(attempt), max(deadline - loop.time(), 0)))
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise OllamaError(f"Ollama request exceeded its {self.deadline:g} s deadline")
+            try:
+                await asyncio.wait_for(slots.acquire(), remaining)
+            except asyncio.TimeoutError:
+                raise OllamaError("Ollama request timed out waiting for a free slot") from None
+            try:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise OllamaError(f"Ollama request exceeded its {self.deadline:g} s deadline")
+                timeout = httpx.Timeout(min(self.read_timeout, remaining),
+                                        connect=min(self.connect_timeout, remaining))
+                response = await client.post(self.generate_endpoint, json=payload, timeout=timeout)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                error = OllamaError(f"Ollama request failed: {e}")
+                continue
+            except httpx.TransportError as e:  # read timeouts are not retried, like OllamaClient
+                raise OllamaError(f"Ollama request failed: {e}") from e
+            finally:
+                slots.release()
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                break
+            error = OllamaError(f"Ollama API error {response.status_code}: {response.text}")
+        else:
+            raise error
+
+        if response.status_code != 200:
+            raise OllamaError(f"Ollama API error {response.status_code}: {response.text}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise OllamaError(f"Ollama returned invalid JSON: {response.text[:200]}") from e
+
+    async def close(self):
+        """Close the running event loop's client; the next generate() in this loop opens a new one"""
+        resources = self._loops.pop(asyncio.get_running_loop(), None)
+        if resources is not None:
+            await resources.client.aclose()
+
+
+class _LoopResources:
+    """What AsyncOllamaClient keeps per event loop"""
+
+    def __init__(self, client, slots):
+        self.client = client
+        self.slots = slots
+        self.inflight = {}  # request key -> task of the generation
+
+
+# Clients shared by the request handlers and scripts
+ollama_client = OllamaClient()
+async_ollama_client = AsyncOllamaClient()
@@ -1,15 +1,49 @@
-import requests
+import asyncio
+import os
 from preprocess_query import preprocess_query
-
-# Define local Ollama API endpoint 
-OLLAMA_LOCAL_ENDPOINT = "http://localhost:11434/api/generate"
-
-def parse_user_query(user_query):
-    """Use Ollama to parse the user's query and return structured JSON"""
-    user_query = preprocess_query(user_query)
-
-    # ✅ Prompt to extract all relevant perfume fields
-    prompt = f"""
+from ollama_client import ollama_client, async_ollama_client, OllamaError
+from llm_output import JsonObjectScanner, extract_json_object, normalize_parsed_query, PARSED_QUERY_SCHEMA
+from query_cache import parsed_query_cache
+from rule_parser import parse_preprocessed, CONFIDENCE_THRESHOLD
+from logging_setup import get_logger
+from metrics import span, registry
+
+log = get_logger(__name__)
+
+# Ollama endpoint, timeouts and concurrency are configured in ollama_client (OLLAMA_BASE_URL, ...)
+OLLAMA_MODEL = "mistral"
+
+# Parse modes selectable per request:
+#   "rules"          - rule-based parser only (microseconds, never calls the LLM)
+#   "rules_then_llm" - rule-based parser, falling through to Ollama when it is not confident
+#   "llm"            - always Ollama (the original behaviour)
+PARSE_MODES = ("rules", "rules_then_llm", "llm")
+DEFAULT_PARSE_MODE = "llm"
+
+# Bump whenever the prompt or the answer parsing changes, so cached parses from the old version are not reused
+PROMPT_VERSION = 2
+
+# Output constraint sent to Ollama: "json" (JSON mode), "schema" (structured output against
+# PARSED_QUERY_SCHEMA, Ollama >= 0.5) or "none" (free text)
+OLLAMA_OUTPUT_FORMAT = os.environ.get("OLLAMA_OUTPUT_FORMAT", "json")
+
+# Stream the answer and stop the generation as soon as the JSON object is complete.
+# Mostly useful with OLLAMA_OUTPUT_FORMAT=none, where models tend to keep talking after the object;
+# streamed calls are not coalesced with identical in-flight requests.
+OLLAMA_STREAM = os.environ.get("OLLAMA_STREAM", "0") == "1"
+
+
+def generation_options(output_format=OLLAMA_OUTPUT_FORMAT):
+    """Extra /api/generate fields for the configured output constraint"""
+    if output_format == "schema":
+        return {"format": PARSED_QUERY_SCHEMA}
+    if output_format == "json":
+        return {"format": "json"}
+    return {}
+
+def build_prompt(user_query):
+    """Prompt to extract all relevant perfume fields"""
+    return f"""
 You are an intelligent assistant for a perfume recommendation system.
 Your task is to extract structured JSON data from the user's natural language query.
 
@@ -57,50 +91,116 @@ Now, the user's input is:
 Please return only the JSON format, without any additional text:
 """
 
-    payload = {
-        "model": "mistral",
-        "prompt": prompt,
-        "stream": False
-    }
-
-    # Send POST request to Ollama
-    response = requests.post(OLLAMA_LOCAL_ENDPOINT, json=payload)
-
-    if response.status_code == 200:
-        try:
-            raw_text = response.json()["response"]
-            print("🔹 Ollama response:", raw_text)
-
-            # Extract JSON portion
-            json_start = raw_text.find("{")
-            json_end = raw_text.rfind("}") + 1
-            cleaned_json = raw_text[json_start:json_end].replace("null", "None")
-
-            parsed = eval(cleaned_json)
-
-            # Set defaults for missing fields
-            DEFAULT_QUERY = {
-                "category": "perfume",
-                "gender": None,
-                "longevity": None,
-                "sillage": None,
-                "suitable_season": None,
-                "suitable_time": None
-            }
-
-            for k in DEFAULT_QUERY:
-                parsed.setdefault(k, DEFAULT_QUERY[k])
-
-            print("✅ Parsed JSON:", parsed)
-            return parsed
-
-        except Exception as e:
-            print("❌ JSON parsing failed:", str(e))
-            return None
-    else:
-        print("❌ Ollama API error:", response.text)
+def parse_user_query(user_query, mode=DEFAULT_PARSE_MODE):
+    """Parse the user's query into structured JSON with the rule-based parser and/or Ollama"""
+    user_query, parsed, cache_key = parse_without_llm(user_query, mode)
+    if cache_key is None:
+        return parsed
+
+    with span("ollama"):
+        parsed = call_ollama_parser(user_query)
+    if parsed is not None:
+        parsed_query_cache.set(cache_key, parsed)
+    return parsed
+
+async def parse_user_query_async(user_query, mode=DEFAULT_PARSE_MODE):
+    """parse_user_query() for the async server: the Ollama generation is awaited instead of blocking a thread"""
+    user_query, parsed, cache_key = parse_without_llm(user_query, mode)
+    if cache_key is None:
+        return parsed
+
+    with span("ollama"):
+        parsed = await call_ollama_parser_async(user_query)
+    if parsed is not None:
+        parsed_query_cache.set(cache_key, parsed)
+    return parsed
+
+def parse_without_llm(user_query, mode):
+    """
+    Steps of parse_user_query before Ollama: returns (preprocessed query, parsed, cache key).
+    The cache key is None when `parsed` is the answer (rule parser confident, or cached parse);
+    otherwise Ollama has to be asked and its parse stored under that key.
+    """
+    if mode not in PARSE_MODES:
+        raise ValueError(f"Unknown parse mode: {mode}")
+
+    with span("preprocess"):
+        user_query = preprocess_query(user_query)
+
+    if mode != "llm":
+        with span("rule_parse"):
+            parsed, confidence, ambiguous = parse_preprocessed(user_query)
+        if mode == "rules" or confidence >= CONFIDENCE_THRESHOLD:
+            return user_query, parsed, None
+        log.info("Rule parser not confident (%.2f, ambiguous: %s), asking Ollama", confidence, ambiguous)
+
+    # Repeated (or near-identical, after preprocessing) queries are served from the cache
+    cache_key = parsed_query_cache.make_key(user_query, OLLAMA_MODEL, PROMPT_VERSION)
+    with span("parse_cache"):
+        cached = parsed_query_cache.get(cache_key)
+    if cached is not None:
+        return user_query, cached, None
+    return user_query, None, cache_key
+
+def call_ollama_parser(user_query):
+    """Send the (preprocessed) query to Ollama and parse the structured JSON it returns"""
+    prompt = build_prompt(user_query)
+
+    # Send the request through the shared pooled client (identical in-flight non-streamed prompts share one generation)
+    try:
+        if OLLAMA_STREAM:
+            raw_text = read_streamed_object(ollama_client.generate_stream(OLLAMA_MODEL, prompt, **generation_options()))
+        else:
+            raw_text = ollama_client.generate(OLLAMA_MODEL, prompt, **generation_options()).get("response", "")
+    except OllamaError as e:
+        log.error("Ollama API error: %s", e)
+        return None
+
+    log.debug("Ollama response: %s", raw_text)
+    return parse_model_output(raw_text)
+
+async def call_ollama_parser_async(user_query):
+    """call_ollama_parser() with the async client; streamed generations still go through the sync client, in a thread"""
+    if OLLAMA_STREAM:
+        return await asyncio.to_thread(call_ollama_parser, user_query)
+
+    prompt = build_prompt(user_query)
+    try:
+        raw_text = (await async_ollama_client.generate(OLLAMA_MODEL, prompt, **generation_options())).get("response", "")
+    except OllamaError as e:
+        log.error("Ollama API error: %s", e)
+        return None
+
+    log.debug("Ollama response: %s", raw_text)
+    return parse_model_output(raw_text)
+
+def read_streamed_object(chunks):
+    """Text of a streamed answer up to the end of its first JSON object; the rest is never generated"""
+    scanner = JsonObjectScanner()
+    try:
+        for chunk in chunks:
+            if scanner.feed(chunk.get("response", "")):
+                break
+    finally:
+        chunks.close()
+    return scanner.text
+
+def parse_model_output(raw_text):
+    """
+    Structured query from a model answer: the first JSON object (near-JSON such as single quotes,
+    Python literals or a missing comma is repaired), validated against the closed vocabularies.
+    Returns None when no object can be read.
+    """
+    parsed = extract_json_object(raw_text)
+    if parsed is None:
+        registry.inc("perfume_llm_parse_total", help_text="LLM answers by parse outcome", outcome="failed")
+        log.warning("JSON parsing failed: %r", (raw_text or "")[:200])
         return None
 
+    registry.inc("perfume_llm_parse_total", help_text="LLM answers by parse outcome", outcome="ok")
+    parsed = normalize_parsed_query(parsed)
+    log.debug("Parsed JSON: %s", parsed)
+    return parsed
 
 if __name__ == "__main__":
     # Example test cases
@@ -0,0 +1,97 @@
+import base64
+import json
+from flask import Response, jsonify, stream_with_context
+
+# Ranked routes compute the top offset + k results, so deep pages are capped
+MAX_OFFSET = 1000
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(state):
+    """Opaque cursor token for a dict such as {"offset": 20} or {"after_id": 1234}"""
+    raw = json.dumps(state, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+    except (TypeError, ValueError):
+        raise ValueError("invalid cursor")
+    if not isinstance(state, dict):
+        raise ValueError("invalid cursor")
+    return state
+
+
+def parse_page_options(data):
+    """
+    Read the page position from a request body: either "cursor" (returned by the previous page)
+    or a plain "offset". Returns {"offset": int, "after_id": int or None}.
+    Raises ValueError with a readable message on invalid values.
+    """
+    state = {}
+    if data.get("cursor"):
+        state = decode_cursor(str(data["cursor"]))
+    elif data.get("offset") is not None:
+        state = {"offset": data["offset"]}
+
+    try:
+        offset = int(state.get("offset", 0))
+        after_id = int(state["after_id"]) if state.get("after_id") is not None else None
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("offset must be an integer")
+    if not 0 <= offset <= MAX_OFFSET:
+        raise ValueError(f"offset must be between 0 and {MAX_OFFSET}")
+
+    return {"offset": offset, "after_id": after_id}
+
+
+# Accepted spellings of the "stream" flag besides JSON booleans
+STREAM_VALUES = {"true": True, "1": True, "false": False, "0": False}
+
+
+def parse_stream_option(data):
+    """
+    The "stream" flag of a request body: True, False, or None when absent. Accepts JSON booleans,
+    0/1 and the strings "true"/"false"/"1"/"0"; raises ValueError on anything else.
+    """
+    value = data.get("stream")
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, str)) and str(value).strip().lower() in STREAM_VALUES:
+        return STREAM_VALUES[str(value).strip().lower()]
+    raise ValueError('stream must be true or false')
+
+
+def wants_stream(data, request):
+    """
+    NDJSON when the body has "stream": true or the client accepts only application/x-ndjson.
+    Raises ValueError when "stream" is not a boolean (see parse_stream_option).
+    """
+    stream = parse_stream_option(data)
+    if stream is not None:
+        return stream
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def page_response(items, next_cursor=None, stream=False):
+    """
+    JSON array (unchanged response shape) or NDJSON with one result per line.
+    The cursor of the next page, if any, is sent in the X-Next-Cursor header.
+    items may be a generator; in stream mode it is consumed while the response is written.
+    """
+    if stream:
+        def generate():
+            for item in items:
+                yield json.dumps(item) + "\n"
+        response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    else:
+        response = jsonify(list(items))
+
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+        response.headers["Access-Control-Expose-Headers"] = NEXT_CURSOR_HEADER
+    return response
@@ -0,0 +1,370 @@
+# End-to-end latency / throughput benchmark of the recommendation routes.
+#
+# Each catalog size runs in its own process (so peak RSS is measured per size) against local stand-ins:
+# a SQLite database filled with a synthetic catalog, the fake Ollama server and, unless --model real,
+# a synthetic bag-of-words encoder instead of MiniLM. /search_by_bert and /search_products are driven
+# through the Flask test client, first sequentially (cold then warm caches), then by a concurrent
+# load generator. These phases run with the response cache off, so they time the pipeline itself;
+# response cache misses and hits are timed separately afterwards.
+# Results are written as JSON; --compare flags regressions against a previous run.
+#
+#   python pipeline_benchmark.py --scales 1000 10000 100000 --output bench.json
+#   python pipeline_benchmark.py --scales 1000 10000 100000 --compare bench.json
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SCENARIOS = {
+    # name: (route, extra body fields)
+    "bert_rules_semantic": ("/search_by_bert", {"parse_mode": "rules"}),
+    "bert_rules_hybrid": ("/search_by_bert", {"parse_mode": "rules", "retrieval": "hybrid"}),
+    "bert_llm_semantic": ("/search_by_bert", {"parse_mode": "llm"}),
+    "products_bm25": ("/search_products", {}),
+}
+
+ACCORDS = ["woody", "floral", "citrus", "vanilla", "sweet", "fresh", "musky", "amber", "spicy", "fruity",
+           "powdery", "aromatic", "green", "aquatic", "leather", "oud", "rose", "white floral", "warm spicy",
+           "earthy", "smoky", "tobacco", "honey", "coconut", "lavender", "patchouli", "cinnamon", "almond"]
+GENDERS = ["female", "male", "unisex"]
+SEASONS = ["spring", "summer", "autumn", "winter"]
+TIMES = ["day", "night"]
+LONGEVITY = ["weak", "moderate", "long lasting", "eternal"]
+SILLAGE = ["intimate", "moderate", "strong", "enormous"]
+BRANDS = ["Maison", "Atelier", "Parfums", "Studio", "House", "Essence", "Nocturne", "Lumiere"]
+
+QUERY_TEMPLATES = [
+    "{a} {b} perfume for {g} in {s}",
+    "a {a} scent for {t} that lasts long",
+    "{a} and {b} fragrance for {g}",
+    "something {a} for {s} {t}s",
+    "{a} perfume",
+]
+GENDER_WORDS = {"female": "women", "male": "men", "unisex": "anyone"}
+
+
+class SyntheticEncoder:
+    """
+    Stand-in for the SentenceTransformer: the embedding of a text is the normalized sum of
+    fixed random vectors of its words, so texts sharing words are similar (like the real model).
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._word_vectors = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _word(self, word):
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in str(text).lower().replace(",", " ").split():
+                out[i] += self._word(word)
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms == 0, 1.0, norms)
+        return out[0] if single else out
+
+
+def synthetic_products(n, seed, batch=20000):
+    """Batches of product row dicts with the columns of the products table"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, batch):
+        rows = []
+        for i in range(start, min(n, start + batch)):
+            accords = list(rng.choice(ACCORDS, size=rng.integers(3, 8), replace=False))
+            seasons = list(rng.choice(SEASONS, size=rng.integers(1, 3), replace=False))
+            times = list(rng.choice(TIMES, size=rng.integers(1, 3), replace=False))
+            gender, longevity, sillage = rng.choice(GENDERS), rng.choice(LONGEVITY), rng.choice(SILLAGE)
+            name = f"{rng.choice(BRANDS)} {accords[0].title()} No. {i}"
+            rows.append({
+                "name": name,
+                "url": f"https://example.com/p/{i}",
+                "main_accords": ", ".join(accords),
+                "longevity": longevity,
+                "sillage": sillage,
+                "gender": gender,
+                "suitable_season": ", ".join(seasons),
+                "suitable_time": ", ".join(times),
+                "description": f"{name}, {', '.join(accords)}, {longevity}, {sillage}, {gender}",
+                "positive_rate": float(rng.uniform(0.3, 1.0)),
+            })
+        yield rows
+
+
+def synthetic_queries(n, seed):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(n):
+        a, b = rng.choice(ACCORDS, size=2, replace=False)
+        queries.append(str(rng.choice(QUERY_TEMPLATES)).format(
+            a=a, b=b, g=GENDER_WORDS[str(rng.choice(GENDERS))], s=rng.choice(SEASONS), t=rng.choice(TIMES)
+        ))
+    return queries
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(seconds):
+    seconds = np.asarray(seconds)
+    if len(seconds) == 0:
+        return {}
+    return {
+        "count": int(len(seconds)),
+        "mean_ms": float(seconds.mean() * 1000),
+        "p50_ms": float(np.percentile(seconds, 50) * 1000),
+        "p95_ms": float(np.percentile(seconds, 95) * 1000),
+        "p99_ms": float(np.percentile(seconds, 99) * 1000),
+    }
+
+
+def body_for(route, query, extra, k):
+    if route == "/search_products":
+        return {"category": query.split()[0], "k": k, **extra}
+    return {"query": query, "k": k, **extra}
+
+
+def run_worker(args):
+    """Benchmark one catalog size in this process; prints the result as JSON on the last line"""
+    workdir = tempfile.mkdtemp(prefix=f"perfume_bench_{args.n}_")
+    os.environ["PERFUME_DATABASE_URI"] = f"sqlite:///{os.path.join(workdir, 'catalog.db')}"
+    os.environ["PERFUME_EMBEDDING_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ["PERFUME_WARMUP"] = "lazy"
+    os.environ.setdefault("PERFUME_LOG_LEVEL", "WARNING")
+
+    from fake_ollama import start_fake_ollama
+    fake_server, base_url = start_fake_ollama(delay=args.ollama_delay)
+    os.environ["OLLAMA_BASE_URL"] = base_url
+
+    import bert_model
+    if args.model == "synthetic":
+        bert_model._model = SyntheticEncoder(bert_model.MODEL_DIM)
+
+    result = {"n": args.n, "stages": {}, "scenarios": {}}
+    start = time.perf_counter()
+    import server
+    from server_config import app
+    result["stages"]["import"] = {"seconds": time.perf_counter() - start, "rss_mb": current_rss_mb()}
+
+    # Catalog: synthetic rows -> SQLite products table + embedding store, through the import pipeline
+    from import_csv_to_db import full_import
+    from embedding_store import EmbeddingStoreBuilder
+    start = time.perf_counter()
+    builder = EmbeddingStoreBuilder(os.environ["PERFUME_EMBEDDING_DIR"])
+    with app.app_context():
+        full_import(synthetic_products(args.n, args.seed), builder, batch_size=5000)
+    result["stages"]["catalog_build"] = {"seconds": time.perf_counter() - start, "rss_mb": current_rss_mb()}
+
+    from lifecycle import warmup
+    start = time.perf_counter()
+    warmup(app)
+    result["stages"]["warmup"] = {"seconds": time.perf_counter() - start, "rss_mb": current_rss_mb(),
+                                  "peak_rss_mb": peak_rss_mb()}
+
+    from metrics import registry
+    from query_cache import parsed_query_cache
+    from query_encoder import query_encoder
+    from response_cache import response_cache
+    queries = synthetic_queries(args.queries, args.seed + 1)
+    client = server.app.test_client()
+    response_cache_enabled = app.config.get("RESPONSE_CACHE_ENABLED", True)
+
+    for name in args.scenarios:
+        route, extra = SCENARIOS[name]
+        parsed_query_cache.clear()
+        query_encoder.clear()
+        response_cache.clear()
+        registry.clear()
+        ollama_calls = fake_server.request_count
+        app.config["RESPONSE_CACHE_ENABLED"] = False
+
+        def timed(c, query):
+            t = time.perf_counter()
+            response = c.post(route, json=body_for(route, query, extra, args.k))
+            if response.status_code != 200:
+                raise RuntimeError(f"{route} returned {response.status_code}: {response.get_data(as_text=True)}")
+            return time.perf_counter() - t
+
+        # Sequential: first pass with empty caches, second pass with everything cached
+        cold = [timed(client, q) for q in queries]
+        warm = [timed(client, q) for q in queries]
+
+        # Concurrent load: every thread uses its own client and cycles through the queries
+        latencies = []
+        latency_lock = threading.Lock()
+
+        def load_worker(worker_id):
+            c = server.app.test_client()
+            mine = []
+            for i in range(args.requests // args.concurrency):
+                mine.append(timed(c, queries[(worker_id + i) % len(queries)]))
+            with latency_lock:
+                latencies.extend(mine)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(load_worker, range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        summary = registry.summary()
+
+        # Response cache: a pass of misses (pipeline + store), then a pass of hits
+        cache_phases = {}
+        if route == "/search_by_bert" and response_cache_enabled:
+            app.config["RESPONSE_CACHE_ENABLED"] = True
+            cache_phases["cache_miss"] = percentiles([timed(client, q) for q in queries])
+            cache_phases["cache_hit"] = percentiles([timed(client, q) for q in queries])
+
+        result["scenarios"][name] = {
+            "cold": percentiles(cold),
+            "warm": percentiles(warm),
+            "load": {**percentiles(latencies), "concurrency": args.concurrency,
+                     "throughput_rps": len(latencies) / elapsed},
+            **cache_phases,
+            "stages": {e["labels"]["stage"]: {k: v for k, v in e.items() if k != "labels"}
+                       for e in summary.get("perfume_stage_seconds", [])},
+            "ollama_calls": fake_server.request_count - ollama_calls,
+            "rss_mb": current_rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    app.config["RESPONSE_CACHE_ENABLED"] = response_cache_enabled
+    fake_server.shutdown()
+    print(json.dumps(result))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Regressions: p95 latency up or throughput down by more than tolerance (fraction)"""
+    regressions = []
+    old_runs = {run["n"]: run for run in baseline["runs"]}
+    for run in results["runs"]:
+        old = old_runs.get(run["n"])
+        if old is None:
+            continue
+        for name, scenario in run["scenarios"].items():
+            before = old["scenarios"].get(name)
+            if before is None:
+                continue
+            for phase in ("cold", "warm", "load", "cache_miss", "cache_hit"):
+                if phase not in scenario or phase not in before:
+                    continue
+                new_p95, old_p95 = scenario[phase].get("p95_ms"), before[phase].get("p95_ms")
+                if new_p95 and old_p95 and new_p95 > old_p95 * (1 + tolerance):
+                    regressions.append(f"n={run['n']} {name} {phase} p95 {old_p95:.2f} -> {new_p95:.2f} ms")
+            new_rps, old_rps = scenario["load"]["throughput_rps"], before["load"]["throughput_rps"]
+            if new_rps < old_rps * (1 - tolerance):
+                regressions.append(f"n={run['n']} {name} throughput {old_rps:.1f} -> {new_rps:.1f} req/s")
+    return regressions
+
+
+def print_report(results):
+    for run in results["runs"]:
+        stages = ", ".join(f"{k} {v['seconds']:.1f}s" for k, v in run["stages"].items())
+        print(f"\n📦 n={run['n']}  ({stages}, peak RSS {run['stages']['warmup']['peak_rss_mb']:.0f} MB)")
+        print(f"{'scenario':24} {'cold p50':>9} {'warm p50':>9} {'load p50':>9} {'load p95':>9} "
+              f"{'load p99':>9} {'req/s':>8} {'miss p50':>9} {'hit p50':>9} {'peak MB':>8}")
+        for name, s in run["scenarios"].items():
+            miss = s.get("cache_miss", {}).get("p50_ms", float("nan"))
+            hit = s.get("cache_hit", {}).get("p50_ms", float("nan"))
+            print(f"{name:24} {s['cold']['p50_ms']:9.2f} {s['warm']['p50_ms']:9.2f} {s['load']['p50_ms']:9.2f} "
+                  f"{s['load']['p95_ms']:9.2f} {s['load']['p99_ms']:9.2f} {s['load']['throughput_rps']:8.1f} "
+                  f"{miss:9.2f} {hit:9.2f} {s['peak_rss_mb']:8.0f}")
+            slowest = sorted(s["stages"].items(), key=lambda kv: -kv[1]["mean_ms"] * kv[1]["count"])[:4]
+            print("    " + ", ".join(f"{stage} p95 {v['p95_ms']:.2f} ms" for stage, v in slowest))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end recommendation pipeline benchmark")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1000, 10000, 100000],
+                        help="catalog sizes (add 1000000 for the 1M run)")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--queries", type=int, default=50, help="distinct queries per scenario")
+    parser.add_argument("--requests", type=int, default=400, help="requests in the concurrent phase")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--ollama-delay", type=float, default=0.05, help="fake Ollama seconds per generation")
+    parser.add_argument("--model", choices=["synthetic", "real"], default="synthetic")
+    parser.add_argument("--seed", type=int, default=20250809)
+    parser.add_argument("--output", default="pipeline_benchmark.json")
+    parser.add_argument("--compare", help="previous results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--n", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("worker", "n", "compare", "output")},
+        "runs": [],
+    }
+    for n in args.scales:
+        print(f"⏱ Benchmarking catalog of {n} products...", flush=True)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--n", str(n)] + sys.argv[1:]
+        out = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if out.returncode != 0:
+            print(out.stderr, file=sys.stderr)
+            sys.exit(f"❌ Worker for n={n} failed")
+        results["runs"].append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nCompared with {args.compare} (commit {baseline.get('commit')}):")
+        for line in regressions:
+            print("  ❌ " + line)
+        if not regressions:
+            print("  ✅ no regression beyond tolerance")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+    if args.compare and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
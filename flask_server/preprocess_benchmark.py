@@ -0,0 +1,108 @@
+# Per-call cost of preprocess_query: the original six-pass implementation (one regex compile per
+# spelling fix per call) vs the precompiled single-tokenization pipeline, and the batch API.
+# Both implementations are first checked for identical output on a generated query corpus,
+# with the perfume dictionary and with the original laptop/phone dictionary.
+import argparse
+import random
+import re
+import time
+import pandas as pd
+from model_comparison import test_queries
+from preprocess_query import (
+    QueryPreprocessor, SPELL_FIX_DICT, EN_STOPWORDS, CN_STOPWORDS, PUNCT_TRANSLATION, preprocess_queries
+)
+
+# The dictionary shipped before the perfume one
+LEGACY_SPELL_FIX_DICT = {
+    "iphon": "iphone",
+    "lapptop": "laptop",
+    "celphone": "cellphone",
+    "moblie": "mobile",
+    "notbook": "notebook",
+    "phne": "phone"
+}
+
+CHINESE_QUERIES = ["我想要一个适合夏天的香水", "需要一台notbook和iphon", "的 了 是 vanila 香草"]
+
+
+def legacy_preprocess_query(query, spell_fixes):
+    """preprocess_query as it was, with the spelling dictionary as a parameter"""
+    query = re.sub(r"<[^>]*>", "", query)
+    query = query.translate(PUNCT_TRANSLATION)
+    query = query.lower()
+    for typo, correct in spell_fixes.items():
+        query = re.sub(rf"\b{typo}\b", correct, query)
+    query = re.sub(r"\s+", " ", query).strip()
+    words = re.findall(r"\b\w+\b|[\u4e00-\u9fff]", query)
+    return " ".join(w for w in words if w not in EN_STOPWORDS and w not in CN_STOPWORDS)
+
+
+def build_corpus(spell_fixes, size, seed):
+    """Evaluation queries with typos, HTML, full-width punctuation, casing and Chinese mixed in"""
+    rng = random.Random(seed)
+    typos = list(spell_fixes) + list(LEGACY_SPELL_FIX_DICT)
+    corpus = list(test_queries) + CHINESE_QUERIES + ["", "   ", "<b></b>", "THE A AN"]
+    while len(corpus) < size:
+        words = rng.choice(test_queries).split()
+        for _ in range(rng.randint(0, 3)):
+            words.insert(rng.randint(0, len(words)), rng.choice(typos))
+        if rng.random() < 0.3:
+            words = [w.upper() if rng.random() < 0.3 else w for w in words]
+        text = " ".join(words)
+        if rng.random() < 0.3:
+            text = f"<p>{text}</p><br/>"
+        if rng.random() < 0.3:
+            text = text.replace(",", "，").replace(".", "。").replace("!", "！") + "（１２％）"
+        if rng.random() < 0.2:
+            text += " " + rng.choice(CHINESE_QUERIES)
+        if rng.random() < 0.2:
+            text = text.replace(" ", rng.choice(["  ", "\t", "\n "]))
+        corpus.append(text)
+    return corpus
+
+
+def per_call_us(fn, corpus, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in corpus:
+            fn(query)
+    return (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="preprocess_query microbenchmark")
+    parser.add_argument("--queries", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rows = []
+    for name, fixes in (("perfume", SPELL_FIX_DICT), ("legacy", LEGACY_SPELL_FIX_DICT)):
+        corpus = build_corpus(fixes, args.queries, args.seed)
+        compiled = QueryPreprocessor(fixes)
+        mismatches = [q for q in corpus if compiled(q) != legacy_preprocess_query(q, fixes)]
+        if mismatches:
+            raise SystemExit(f"❌ {len(mismatches)} outputs differ ({name} dictionary), e.g. {mismatches[0]!r}")
+        print(f"✅ Identical output on {len(corpus)} queries ({name} dictionary, {len(fixes)} fixes)")
+
+        legacy_us = per_call_us(lambda q: legacy_preprocess_query(q, fixes), corpus, args.repeat)
+        compiled_us = per_call_us(compiled, corpus, args.repeat)
+        rows.append({"dictionary": name, "implementation": "legacy", "us_per_query": legacy_us, "speedup": 1.0})
+        rows.append({"dictionary": name, "implementation": "compiled", "us_per_query": compiled_us,
+                     "speedup": legacy_us / compiled_us})
+
+    corpus = build_corpus(SPELL_FIX_DICT, args.queries, args.seed)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        preprocess_queries(corpus)
+    batch_us = (time.perf_counter() - start) / (args.repeat * len(corpus)) * 1e6
+    legacy_us = rows[0]["us_per_query"]
+    rows.append({"dictionary": "perfume", "implementation": "batch", "us_per_query": batch_us,
+                 "speedup": legacy_us / batch_us})
+
+    print(f"\n⏱ Per-query cost ({args.queries} queries x {args.repeat})\n")
+    print(pd.DataFrame(rows).to_markdown(index=False, floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import re
-import string
 
 # Basic English and Chinese stopwords
 EN_STOPWORDS = set([
@@ -9,25 +8,125 @@ CN_STOPWORDS = set([
     "的", "了", "是", "我", "想要", "买", "需要", "在", "一台", "一个"
 ])
 
-# Simple spelling correction rules
-SPELL_FIX_DICT = {
-    "iphon": "iphone",
-    "lapptop": "laptop",
-    "celphone": "cellphone",
-    "moblie": "mobile",
-    "notbook": "notebook",
-    "phne": "phone"
+# Simple spelling correction rules (typo -> correction, single lowercase words)
+# Perfume domain: accords, notes, product words and brand names
+PERFUME_SPELL_FIXES = {
+    "perfum": "perfume",
+    "perfumme": "perfume",
+    "parfume": "perfume",
+    "fragance": "fragrance",
+    "fragrence": "fragrance",
+    "frangrance": "fragrance",
+    "colonge": "cologne",
+    "cologn": "cologne",
+    "vanila": "vanilla",
+    "vanilia": "vanilla",
+    "vanillia": "vanilla",
+    "citris": "citrus",
+    "citurs": "citrus",
+    "lavendar": "lavender",
+    "lavander": "lavender",
+    "sandlewood": "sandalwood",
+    "sandelwood": "sandalwood",
+    "patchuli": "patchouli",
+    "pachouli": "patchouli",
+    "bergamont": "bergamot",
+    "insence": "incense",
+    "cinammon": "cinnamon",
+    "cinnamom": "cinnamon",
+    "cocunut": "coconut",
+    "florial": "floral",
+    "flroal": "floral",
+    "acquatic": "aquatic",
+    "powdry": "powdery",
+    "muskey": "musky",
+    "tobbaco": "tobacco",
+    "tabacco": "tobacco",
+    "jasmen": "jasmine",
+    "silage": "sillage",
+    "sillag": "sillage",
+    "longevitiy": "longevity",
+    "givenchi": "givenchy",
+    "versache": "versace",
+    "guerlan": "guerlain",
+    "lancom": "lancome",
+    "tomford": "tom ford",
+    "jomalone": "jo malone",
 }
 
+# Additional domain dictionaries can be passed to QueryPreprocessor (spell_fixes=...)
+SPELL_FIX_DICT = PERFUME_SPELL_FIXES
+
 # Mapping of full-width to half-width punctuation
 PUNCT_TRANSLATION = str.maketrans(
     "，。！？【】（）％＃＠＆１２３４５６７８９０",
     ",.!?[]()%#@&1234567890"
 )
 
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+TOKEN_PATTERN = re.compile(r"\b\w+\b|[\u4e00-\u9fff]")
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class QueryPreprocessor:
+    """
+    Precompiled preprocessing pipeline. After HTML removal, punctuation mapping and lowercasing,
+    the text is tokenized once; each token is spell-fixed by a dict lookup and dropped if it is
+    a stopword. Gives the same output as the step-by-step functions below.
+    """
+
+    def __init__(self, spell_fixes=SPELL_FIX_DICT, stopwords=None):
+        for typo in spell_fixes:
+            if not WORD_PATTERN.fullmatch(typo) or typo != typo.lower():
+                raise ValueError(f"spelling fixes must be single lowercase words: {typo!r}")
+        self.spell_fixes = dict(spell_fixes)
+        self.stopwords = frozenset(stopwords if stopwords is not None else EN_STOPWORDS | CN_STOPWORDS)
+        self._spell_pattern = (
+            re.compile(r"\b(?:" + "|".join(map(re.escape, self.spell_fixes)) + r")\b")
+            if self.spell_fixes else None
+        )
+
+        # Token -> output tokens. Corrections are applied in dict order, so a correction can itself
+        # be corrected by a later entry; resolve that once here instead of on every call.
+        typos = list(self.spell_fixes)
+        self._token_fixes = {}
+        for i, typo in enumerate(typos):
+            text = self.spell_fixes[typo]
+            for later in typos[i + 1:]:
+                text = re.sub(rf"\b{re.escape(later)}\b", self.spell_fixes[later], text)
+            self._token_fixes[typo] = [t for t in TOKEN_PATTERN.findall(text) if t not in self.stopwords]
+
+    def correct_spelling(self, text):
+        if self._spell_pattern is None:
+            return text
+        return self._spell_pattern.sub(lambda m: self.spell_fixes[m.group(0)], text)
+
+    def __call__(self, query):
+        text = HTML_TAG_PATTERN.sub("", query).translate(PUNCT_TRANSLATION).lower()
+        stopwords = self.stopwords
+        fixes = self._token_fixes
+        out = []
+        for token in TOKEN_PATTERN.findall(text):
+            fixed = fixes.get(token)
+            if fixed is not None:
+                out.extend(fixed)
+            elif token not in stopwords:
+                out.append(token)
+        return " ".join(out)
+
+    def batch(self, queries):
+        """Preprocess many queries; repeated queries are processed once"""
+        done = {}
+        return [done[q] if q in done else done.setdefault(q, self(q)) for q in queries]
+
+
+_default = QueryPreprocessor()
+
+
 def remove_html(text: str) -> str:
     """Remove HTML tags"""
-    return re.sub(r"<[^>]*>", "", text)
+    return HTML_TAG_PATTERN.sub("", text)
 
 def normalize_punctuation(text: str) -> str:
     """Convert full-width punctuation to half-width"""
@@ -39,26 +138,22 @@ def lowercase_text(text: str) -> str:
 
 def correct_spelling(text: str) -> str:
     """Apply simple rule-based spelling correction"""
-    for typo, correct in SPELL_FIX_DICT.items():
-        text = re.sub(rf"\b{typo}\b", correct, text)
-    return text
+    return _default.correct_spelling(text)
 
 def remove_stopwords(text: str) -> str:
     """Remove predefined English and Chinese stopwords"""
-    words = re.findall(r"\b\w+\b|[\u4e00-\u9fff]", text)
-    filtered = [word for word in words if word not in EN_STOPWORDS and word not in CN_STOPWORDS]
+    words = TOKEN_PATTERN.findall(text)
+    filtered = [word for word in words if word not in _default.stopwords]
     return " ".join(filtered)
 
 def clean_whitespace(text: str) -> str:
     """Remove redundant spaces"""
-    return re.sub(r"\s+", " ", text).strip()
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
 
 def preprocess_query(query: str) -> str:
     """Main function to clean and normalize the user query"""
-    query = remove_html(query)
-    query = normalize_punctuation(query)
-    query = lowercase_text(query)
-    query = correct_spelling(query)
-    query = clean_whitespace(query)
-    query = remove_stopwords(query)
-    return query
+    return _default(query)
+
+def preprocess_queries(queries):
+    """Batch version of preprocess_query for offline jobs"""
+    return _default.batch(queries)
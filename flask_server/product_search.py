@@ -1,48 +1,127 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import text
+import math
+import numpy as np
+from flask import Blueprint, request, jsonify, current_app
 from server_config import db
+from product_store import find_products_by_keyword, find_products_by_ids, range_conditions
+from bm25_index import get_bm25_index, tokenize
+from ranking import MAX_TOP_K
+from logging_setup import get_logger
+from metrics import span
+from pagination import parse_page_options, wants_stream, page_response, encode_cursor, MAX_OFFSET
+
+log = get_logger(__name__)
 
 # Define the Blueprint
 product_search_bp = Blueprint("product_search", __name__)
 
-# Function to query products from the database
-def search_products_in_db(category, max_price):
-    """Query products from the database based on category and price"""
-    sql = "SELECT * FROM products WHERE description LIKE :category"
-    params = {"category": f"%{category}%"}
+# Number of keyword matches returned when the request does not give k
+DEFAULT_KEYWORD_K = 20
 
-    if max_price is not None:
-        sql += " AND price <= :max_price"
-        params["max_price"] = max_price
+# With a price filter, the BM25 ranking is read this many times deeper until the page is full
+BM25_DEPTH_GROWTH = 4
 
+# Function to query products from the database
+def search_products_in_db(category, max_price, k=DEFAULT_KEYWORD_K, after_id=None):
+    """
+    Query products from the database based on category (and price, if the schema has one).
+    Keyset pagination: at most k + 1 rows with id > after_id, in id order.
+    """
+    # FULLTEXT matches nothing for a category without words, where LIKE '%%' matches every product
+    use_fulltext = current_app.config.get("FULLTEXT_SEARCH_ENABLED", False) and bool(tokenize(category))
     try:
-        result = db.session.execute(text(sql), params)
-        products = [
-            {
-                "id": row[0],
-                "name": row[1],
-                "description": row[2],
-                "price": row[3] if len(row) > 3 else None
-            }
-            for row in result
-        ]
-        return products
+        return find_products_by_keyword(
+            db.session.connection(), category, {"max_price": max_price}, limit=k + 1, after_id=after_id,
+            use_fulltext=use_fulltext
+        )
     except Exception as e:
-        print("Database query failed:", str(e))
+        log.exception("Database query failed")
         return []
 
+def search_products_bm25(category, max_price, k=DEFAULT_KEYWORD_K, offset=0):
+    """
+    Rank products with the BM25 index, then read the requested page of rows by primary key.
+    A price filter is applied to the ranking before the page is cut, reading deeper into it
+    until the page is full. Returns (page of products, whether more matches follow).
+    """
+    filters = {"max_price": max_price}
+    wanted = offset + k + 1
+    depth = wanted
+    try:
+        connection = db.session.connection()
+        filtered = bool(range_conditions(connection, filters)[0])
+        while True:
+            with span("bm25"):
+                ids, scores = get_bm25_index(db).search(category, depth)
+            exhausted = len(ids) < depth
+            if filtered:
+                allowed = find_products_by_ids(connection, ids, filters, columns=("id",))
+                keep = np.array([product_id in allowed for product_id in ids.tolist()], dtype=bool)
+                ids, scores = ids[keep], scores[keep]
+            if len(ids) >= wanted or exhausted:
+                break
+            depth *= BM25_DEPTH_GROWTH
+
+        has_more = len(ids) > offset + k
+        ids, scores = ids[offset:offset + k], scores[offset:offset + k]
+        if len(ids) == 0:
+            return [], False
+        rows = find_products_by_ids(connection, ids, filters)
+    except Exception as e:
+        log.exception("Database query failed")
+        return [], False
+
+    products = [
+        {**rows[product_id], "score": float(score)}
+        for product_id, score in zip(ids.tolist(), scores)
+        if product_id in rows
+    ]
+    return products, has_more
+
 # Define API route
 @product_search_bp.route("/search_products", methods=["POST"])
 def search_products():
     """
-    Example frontend POST request: {"category": "sweet", "max_price": 200}
-    Returns a list of matched products
+    Example frontend POST request: {"category": "sweet", "max_price": 200, "k": 20}
+    Returns one page of matched products (best BM25 match first). Pass the X-Next-Cursor
+    response header back as "cursor" for the next page; "stream": true returns NDJSON lines.
     """
     data = request.json
     category = data.get("category", "")
     max_price = data.get("max_price")
 
-    products = search_products_in_db(category, max_price)
-    return jsonify(products)
+    if max_price is not None:
+        try:
+            if isinstance(max_price, bool):
+                raise TypeError
+            max_price = float(max_price)
+        except (TypeError, ValueError):
+            return jsonify({"error": "max_price must be a number"}), 400
+        if not math.isfinite(max_price):
+            return jsonify({"error": "max_price must be a number"}), 400
+
+    try:
+        k = int(data.get("k", DEFAULT_KEYWORD_K))
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "k must be an integer"}), 400
+    if not 1 <= k <= MAX_TOP_K:
+        return jsonify({"error": f"k must be between 1 and {MAX_TOP_K}"}), 400
+    try:
+        page = parse_page_options(data)
+        stream = wants_stream(data, request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    # Tokenized BM25 ranking; the LIKE scan (keyset-paginated by id) is kept for BM25_ENABLED = False
+    # and for categories BM25 has no terms for: a blank one lists every product, as LIKE '%%' does
+    terms = tokenize(category)
+    if not terms:
+        category = str(category or "").strip()
+    if not current_app.config.get("BM25_ENABLED", True) or not terms:
+        products = search_products_in_db(category, max_price, k, page["after_id"])
+        next_cursor = encode_cursor({"after_id": products[k - 1]["id"]}) if len(products) > k else None
+        return page_response(products[:k], next_cursor, stream)
 
+    products, has_more = search_products_bm25(category, max_price, k, page["offset"])
+    next_offset = page["offset"] + k
+    next_cursor = encode_cursor({"offset": next_offset}) if has_more and next_offset <= MAX_OFFSET else None
+    return page_response(products, next_cursor, stream)
@@ -0,0 +1,136 @@
+import threading
+import time
+from sqlalchemy import text, bindparam, inspect
+from catalog_version import get_catalog_version
+from logging_setup import get_logger
+from metrics import span
+
+log = get_logger(__name__)
+
+# Columns read by each caller; nothing selects * (descriptions are the bulk of a row)
+SUMMARY_COLUMNS = ("id", "name", "description")
+RANKING_COLUMNS = ("id", "name", "description", "positive_rate")
+
+# Optional filters of the keyword search: request field -> (column, operator).
+# A filter whose column the products table does not have is ignored instead of failing the query.
+RANGE_FILTERS = {
+    "max_price": ("price", "<="),
+}
+
+# How often (seconds) the cached table columns are checked against the catalog version
+REFRESH_INTERVAL = 5.0
+
+# (engine, table) -> (last check, catalog version, column names)
+_columns = {}
+_columns_lock = threading.Lock()
+
+# engine -> (last check, catalog version, attribute values)
+_attribute_values = {}
+
+
+def table_columns(connection, table_name="products"):
+    """Column names of a table, re-read when the catalog version changes (the import may alter the schema)"""
+    key = (connection.engine, table_name)
+    now = time.monotonic()
+    cached = _columns.get(key)
+    if cached is not None and now - cached[0] < REFRESH_INTERVAL:
+        return cached[2]
+
+    version = get_catalog_version(connection)
+    if cached is not None and cached[1] == version:
+        columns = cached[2]
+    else:
+        columns = frozenset(c["name"] for c in inspect(connection).get_columns(table_name))
+    with _columns_lock:
+        _columns[key] = (now, version, columns)
+    return columns
+
+
+def attribute_values(connection):
+    """
+    {field: [(value, attribute id, product count)]} of the attribute_values lookup table,
+    re-read when the catalog version changes
+    """
+    key = connection.engine
+    now = time.monotonic()
+    cached = _attribute_values.get(key)
+    if cached is not None and now - cached[0] < REFRESH_INTERVAL:
+        return cached[2]
+
+    version = get_catalog_version(connection)
+    if cached is not None and cached[1] == version:
+        values = cached[2]
+    else:
+        values = {}
+        rows = connection.execute(text("SELECT id, field, value, product_count FROM attribute_values ORDER BY id"))
+        for row in rows:
+            values.setdefault(row.field, []).append((row.value, row.id, row.product_count))
+    with _columns_lock:
+        _attribute_values[key] = (now, version, values)
+    return values
+
+
+def range_conditions(connection, filters):
+    """SQL conditions and parameters for the RANGE_FILTERS given in `filters` that the schema supports"""
+    columns = table_columns(connection)
+    conditions, params = [], {}
+    for field, (column, operator) in RANGE_FILTERS.items():
+        value = filters.get(field)
+        if value is None:
+            continue
+        if column not in columns:
+            log.debug("Ignoring %s: products has no %s column", field, column)
+            continue
+        conditions.append(f"{column} {operator} :{field}")
+        params[field] = value
+    return conditions, params
+
+
+def keyword_condition(connection, use_fulltext):
+    """
+    Description match of the keyword search: the MySQL FULLTEXT index (whole words, natural
+    language mode) when enabled, otherwise a substring LIKE scan.
+    """
+    if use_fulltext and connection.dialect.name == "mysql":
+        return "MATCH(description) AGAINST (:keyword IN NATURAL LANGUAGE MODE)", lambda keyword: keyword
+    return "description LIKE :keyword", lambda keyword: f"%{keyword}%"
+
+
+def find_products_by_keyword(connection, keyword, filters=None, limit=20, after_id=None, use_fulltext=False,
+                             columns=SUMMARY_COLUMNS):
+    """
+    Products whose description matches the keyword, as dicts keyed by column name.
+    Keyset pagination: at most `limit` rows with id > after_id, in id order.
+    """
+    condition, keyword_param = keyword_condition(connection, use_fulltext)
+    conditions = [condition]
+    params = {"keyword": keyword_param(keyword), "limit": limit}
+    extra, extra_params = range_conditions(connection, filters or {})
+    conditions += extra
+    params.update(extra_params)
+    if after_id is not None:
+        conditions.append("id > :after_id")
+        params["after_id"] = after_id
+
+    sql = f"SELECT {', '.join(columns)} FROM products WHERE {' AND '.join(conditions)} ORDER BY id LIMIT :limit"
+    with span("sql"):
+        result = connection.execute(text(sql), params)
+        return [dict(row._mapping) for row in result]
+
+
+def find_products_by_ids(connection, product_ids, filters=None, columns=SUMMARY_COLUMNS):
+    """{id: row dict} of the given products (missing or filtered-out ids are absent)"""
+    if len(product_ids) == 0:
+        return {}
+    conditions = ["id IN :ids"]
+    params = {"ids": [int(i) for i in product_ids]}
+    extra, extra_params = range_conditions(connection, filters or {})
+    conditions += extra
+    params.update(extra_params)
+
+    if "id" not in columns:
+        columns = ("id",) + tuple(columns)
+    sql = text(f"SELECT {', '.join(columns)} FROM products WHERE {' AND '.join(conditions)}")
+    with span("sql"):
+        result = connection.execute(sql.bindparams(bindparam("ids", expanding=True)), params)
+        return {row.id: dict(row._mapping) for row in result}
@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Cache settings (override through environment variables)
+CACHE_MAX_ENTRIES = int(os.environ.get("PERFUME_PARSE_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("PERFUME_PARSE_CACHE_TTL", str(7 * 24 * 3600)))
+# Optional SQLite file so parsed queries survive restarts; empty = memory only
+CACHE_DB_PATH = os.environ.get("PERFUME_PARSE_CACHE_DB", "")
+# Rows kept in the SQLite file; the oldest written (and all expired) rows are pruned beyond it
+CACHE_DB_MAX_ROWS = int(os.environ.get("PERFUME_PARSE_CACHE_DB_SIZE", "100000"))
+# The file is pruned every this many inserts, so the cost of the DELETE is spread over them
+CACHE_DB_PRUNE_EVERY = 100
+
+
+class ParsedQueryCache:
+    """
+    Bounded LRU + TTL cache of parsed queries, optionally backed by SQLite.
+    Values are stored as JSON, so callers always receive a fresh dict.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, db_path=CACHE_DB_PATH,
+                 db_max_rows=CACHE_DB_MAX_ROWS, db_prune_every=CACHE_DB_PRUNE_EVERY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_max_rows = db_max_rows
+        self.db_prune_every = db_prune_every
+        self._entries = OrderedDict()  # key -> (expires_at, json string)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.db_pruned = 0
+        self._inserts = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS parsed_queries ("
+                "cache_key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS parsed_queries_expires_at ON parsed_queries (expires_at)")
+            self._prune_disk()
+
+    @staticmethod
+    def make_key(normalized_query, model_name, prompt_version):
+        return f"{model_name}\x1f{prompt_version}\x1f{normalized_query}"
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._load_from_disk(key)
+                if entry is not None:
+                    self._store_in_memory(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < now:
+                self.expirations += 1
+                self.misses += 1
+                self._delete(key)
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return json.loads(value)
+
+    def set(self, key, parsed):
+        entry = (time.time() + self.ttl, json.dumps(parsed))
+        with self._lock:
+            self._store_in_memory(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO parsed_queries (cache_key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, entry[0], entry[1])
+                )
+                self._inserts += 1
+                if self._inserts % self.db_prune_every == 0:
+                    self._prune_disk()
+                else:
+                    self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM parsed_queries")
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "db_pruned": self.db_pruned,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    # Internal helpers, called with the lock held
+
+    def _store_in_memory(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_from_disk(self, key):
+        row = self._db.execute(
+            "SELECT expires_at, value FROM parsed_queries WHERE cache_key = ?", (key,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _prune_disk(self):
+        """Delete the expired rows, then the oldest written ones beyond db_max_rows"""
+        pruned = self._db.execute("DELETE FROM parsed_queries WHERE expires_at < ?", (time.time(),)).rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM parsed_queries").fetchone()[0] - self.db_max_rows
+        if excess > 0:
+            # Every row gets the same TTL, so the earliest expiry is the oldest write
+            pruned += self._db.execute(
+                "DELETE FROM parsed_queries WHERE cache_key IN "
+                "(SELECT cache_key FROM parsed_queries ORDER BY expires_at LIMIT ?)", (excess,)
+            ).rowcount
+        self._db.commit()
+        self.db_pruned += pruned
+
+    def _delete(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM parsed_queries WHERE cache_key = ?", (key,))
+            self._db.commit()
+
+
+# Cache shared by parse_user_query
+parsed_query_cache = ParsedQueryCache()
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+from bert_model import get_model
+
+# Micro-batching settings (override through environment variables)
+ENCODER_MAX_BATCH = int(os.environ.get("PERFUME_ENCODER_MAX_BATCH", "64"))
+ENCODER_MAX_WAIT_MS = float(os.environ.get("PERFUME_ENCODER_MAX_WAIT_MS", "3"))
+QUERY_CACHE_SIZE = int(os.environ.get("PERFUME_QUERY_EMBEDDING_CACHE", "10000"))
+
+
+def normalize_query_text(text):
+    """Cache key / model input: the MiniLM tokenizer is uncased, so case and spacing do not matter"""
+    return " ".join((text or "").lower().split())
+
+
+class QueryEncoder:
+    """
+    Query embedding service: an LRU cache of normalized query -> vector in front of a
+    micro-batcher that collects concurrent requests for up to max_wait_ms and encodes
+    them as one batch. encode_async() returns a Future per request.
+    """
+
+    def __init__(self, max_batch=ENCODER_MAX_BATCH, max_wait_ms=ENCODER_MAX_WAIT_MS,
+                 cache_size=QUERY_CACHE_SIZE):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}  # text -> Future already queued (identical concurrent queries share it)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_texts = 0
+
+    def encode(self, text):
+        """Blocking helper: L2-normalized float32 embedding of one query"""
+        return self.encode_async(text).result()
+
+    def encode_async(self, text):
+        key = normalize_query_text(text)
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(vector)
+                return future
+
+            self.misses += 1
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._pending[key] = future
+
+        self._ensure_worker()
+        self._queue.put(key)
+        return future
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._worker_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="query-encoder", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, texts):
+        try:
+            vectors = get_model().encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                         normalize_embeddings=True).astype(np.float32)
+        except Exception as e:
+            with self._cache_lock:
+                futures = [self._pending.pop(t) for t in texts]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.batched_texts += len(texts)
+        with self._cache_lock:
+            futures = []
+            for text, vector in zip(texts, vectors):
+                vector.setflags(write=False)  # shared between requests
+                self._cache[text] = vector
+                futures.append(self._pending.pop(text))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
+
+    def clear(self):
+        """Drop the cached query embeddings (e.g. to measure cold-cache latency)"""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_entries": len(self._cache),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0
+        }
+
+
+# Encoder shared by the request handlers
+query_encoder = QueryEncoder()
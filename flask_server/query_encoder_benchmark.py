@@ -0,0 +1,57 @@
+# Throughput of one-at-a-time query encoding vs the micro-batching QueryEncoder under concurrent load
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bert_model import get_model
+from query_encoder import QueryEncoder
+
+TEMPLATES = [
+    "sweet vanilla perfume for {} nights",
+    "fresh citrus scent for {} mornings",
+    "long lasting woody fragrance for {}",
+    "light floral perfume for {} in spring",
+]
+WORDS = ["date", "office", "summer", "winter", "campus", "party", "gym", "beach", "dinner", "travel"]
+
+
+def make_queries(n, distinct):
+    texts = [t.format(f"{w} {i}") for i in range(distinct // 40 + 1) for t in TEMPLATES for w in WORDS]
+    return [texts[i % distinct] for i in range(n)]
+
+
+def run(encode, queries, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(encode, queries))
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query encoder throughput benchmark")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=400, help="distinct queries in the workload")
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    queries = make_queries(args.requests, args.distinct)
+    model = get_model()
+    model.encode(["warmup query"])
+
+    single = run(lambda q: model.encode([q], normalize_embeddings=True), queries, args.concurrency)
+
+    batched_encoder = QueryEncoder(cache_size=0)
+    batched = run(batched_encoder.encode, queries, args.concurrency)
+
+    cached_encoder = QueryEncoder()
+    cached = run(cached_encoder.encode, queries, args.concurrency)
+
+    print(f"\n📊 {args.requests} requests, {args.distinct} distinct queries, {args.concurrency} concurrent clients\n")
+    print(f"One-at-a-time encode:      {single:8.1f} req/s")
+    print(f"Micro-batched (no cache):  {batched:8.1f} req/s  "
+          f"(avg batch {batched_encoder.stats()['avg_batch_size']:.1f})")
+    print(f"Micro-batched + LRU cache: {cached:8.1f} req/s  "
+          f"(hit rate {cached_encoder.stats()['cache_hit_rate']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
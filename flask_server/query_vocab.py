@@ -0,0 +1,99 @@
+# Closed vocabularies of the structured query (same values as the Ollama prompt)
+GENDER_VALUES = ["male", "female", "unisex"]
+LONGEVITY_VALUES = ["moderate", "long lasting", "eternal", "weak", "very weak"]
+SILLAGE_VALUES = ["intimate", "moderate", "strong", "very strong", "enormous"]
+SEASON_VALUES = ["spring", "summer", "autumn", "winter"]
+TIME_VALUES = ["day", "night"]
+
+# Catalog values spelled differently from the vocabulary above, canonicalized by the import
+VALUE_ALIASES = {
+    "suitable_season": {"fall": "autumn"},
+    "gender": {"more male": "male"},
+    "main_accords": {"feuity": "fruity"},
+}
+
+# Fields of a parsed query and their default values
+DEFAULT_QUERY = {
+    "category": "perfume",
+    "gender": None,
+    "longevity": None,
+    "sillage": None,
+    "suitable_season": None,
+    "suitable_time": None
+}
+
+# Fields that hold a list of values
+LIST_FIELDS = ("suitable_season", "suitable_time")
+
+# Phrase -> value synonyms used by the rule-based parser: the prompt's examples and common fragrance
+# wording. Phrases are written naturally; they go through preprocess_query before matching.
+# Wording taken from the gold queries (model_comparison_gold.json) does not belong here: it would
+# make the parser's measured precision on them meaningless.
+GENDER_PHRASES = {
+    "female": ["female", "woman", "women", "girl", "girls", "girly", "feminine", "her",
+               "lady", "ladies", "femme"],
+    "male": ["male", "man", "men", "masculine", "him", "boy", "boys", "guy", "guys",
+             "gentleman", "gentlemen", "homme"],
+    "unisex": ["unisex", "gender neutral", "androgynous", "both sexes"],
+}
+
+LONGEVITY_PHRASES = {
+    "eternal": ["eternal", "forever", "all day and night"],
+    "long lasting": ["long lasting", "long-lasting", "longlasting", "lasts long", "last long",
+                     "stays long", "lasts all day", "last all day", "all day", "long wear",
+                     "lasts a long time"],
+    "moderate": ["moderate longevity", "lasts a few hours"],
+    "weak": ["weak", "not very long", "soft", "short lasting", "doesn't last long"],
+    "very weak": ["very weak", "lightly lasts", "fades quickly", "fades fast", "fleeting"],
+}
+
+SILLAGE_PHRASES = {
+    "intimate": ["intimate", "skin scent", "close to skin", "subtle", "discreet"],
+    "moderate": ["moderate sillage", "moderate projection"],
+    "strong": ["strong", "strong projection", "powerful", "powerful scent trail", "loud", "noticeable"],
+    "very strong": ["very strong", "room filling"],
+    "enormous": ["enormous", "huge sillage", "nuclear"],
+}
+
+SEASON_PHRASES = {
+    "spring": ["spring", "springtime"],
+    "summer": ["summer", "summers", "summertime", "sunny", "hot weather", "tropical"],
+    "autumn": ["autumn", "fall"],
+    "winter": ["winter", "winters", "cold weather", "snowy", "christmas", "chilly"],
+}
+
+TIME_PHRASES = {
+    "day": ["day", "days", "daytime", "morning", "mornings", "afternoon", "office", "work",
+            "daily", "school"],
+    "night": ["night", "nights", "evening", "evenings", "date", "date night", "dinner",
+              "club", "party", "parties", "nightlife"],
+}
+
+# Phrases that select several list values at once
+SEASON_MULTI_PHRASES = {
+    "year round": SEASON_VALUES,
+    "all year": SEASON_VALUES,
+    "all seasons": SEASON_VALUES,
+}
+
+TIME_MULTI_PHRASES = {
+    "day and night": TIME_VALUES,
+    "day or night": TIME_VALUES,
+}
+
+# Words that hint a field is mentioned even though no phrase matched (-> ambiguous)
+FIELD_CUE_WORDS = {
+    "longevity": {"last", "lasts", "lasting", "longevity", "hours", "fade", "fades"},
+    "sillage": {"sillage", "projection", "project", "projects", "trail", "heavy", "loud"},
+}
+
+NEGATION_WORDS = {"no", "not", "never", "without", "non", "t"}
+
+# Words that carry no attribute (request phrasing, product nouns); other words left over by the
+# rule parser (accords, notes, unknown wording) lower its confidence
+FILLER_WORDS = {
+    "i", "me", "my", "you", "it", "want", "need", "like", "would", "could", "can", "should", "must",
+    "looking", "look", "recommend", "suggest", "please", "make", "keep", "something", "some", "any",
+    "one", "if", "possible", "only", "but", "from", "be", "just", "very", "too", "really", "good",
+    "perfume", "perfumes", "fragrance", "fragrances", "scent", "scents", "cologne", "wear",
+}
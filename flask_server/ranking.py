@@ -0,0 +1,175 @@
+import json
+import math
+import os
+import numpy as np
+from logging_setup import get_logger
+
+log = get_logger(__name__)
+
+# Default ranking parameters (final_score = 0.7 * similarity + 0.3 * positive_rate ** 1.0)
+DEFAULT_TOP_K = 5
+DEFAULT_SIMILARITY_WEIGHT = 0.7
+DEFAULT_POSITIVE_WEIGHT = 0.3
+DEFAULT_POSITIVE_RATE_POWER = 1.0
+MAX_TOP_K = 100
+
+# Parsed attributes used to filter candidates at each strictness level
+FILTER_STRICTNESS = {
+    "strict": ("main_accords", "gender", "suitable_season", "suitable_time", "longevity", "sillage"),
+    "relaxed": ("main_accords", "gender"),
+    "off": (),
+}
+DEFAULT_FILTER_STRICTNESS = "strict"
+
+# Blend parameters tuned offline by ranking_sweep.py replace the defaults above when this file exists
+RANKING_CONFIG_PATH = os.environ.get(
+    "PERFUME_RANKING_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ranking_config.json")
+)
+
+# Reciprocal rank fusion constant: a result at rank r contributes 1 / (RRF_K + r)
+RRF_K = 60
+
+
+def positive_rate_term(positive_rates, positive_rate_power=DEFAULT_POSITIVE_RATE_POWER):
+    """
+    Positive rates as used in the blend: missing rates count as 0, and positive_rate_power > 1
+    separates the best-rated products more while < 1 flattens the differences.
+    """
+    positive_rates = np.nan_to_num(np.asarray(positive_rates, dtype=np.float32), nan=0.0)
+    if positive_rate_power != 1.0:
+        positive_rates = np.power(np.clip(positive_rates, 0.0, None), np.float32(positive_rate_power))
+    return positive_rates
+
+
+def blend_scores(similarities, positive_rates,
+                 similarity_weight=DEFAULT_SIMILARITY_WEIGHT,
+                 positive_weight=DEFAULT_POSITIVE_WEIGHT,
+                 positive_rate_power=DEFAULT_POSITIVE_RATE_POWER):
+    """Weighted sum of semantic similarity and (transformed) positive review rate"""
+    similarities = np.asarray(similarities, dtype=np.float32)
+    return similarity_weight * similarities + positive_weight * positive_rate_term(positive_rates, positive_rate_power)
+
+
+def top_k_indices(scores, k=DEFAULT_TOP_K):
+    """Indices of the k highest scores, best first, without sorting the whole array"""
+    scores = np.asarray(scores)
+    k = min(int(k), len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx.sort()  # keep catalog order among equal scores
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def rank_products(similarities, positive_rates, k=DEFAULT_TOP_K,
+                  similarity_weight=DEFAULT_SIMILARITY_WEIGHT,
+                  positive_weight=DEFAULT_POSITIVE_WEIGHT,
+                  positive_rate_power=DEFAULT_POSITIVE_RATE_POWER):
+    """
+    Blend the scores and select the top k.
+    Returns (winner indices best first, final scores of the winners).
+    """
+    final_scores = blend_scores(similarities, positive_rates, similarity_weight, positive_weight,
+                                positive_rate_power)
+    winners = top_k_indices(final_scores, k)
+    return winners, final_scores[winners]
+
+
+def reciprocal_rank_fusion(rankings, k=DEFAULT_TOP_K, rrf_k=RRF_K, weights=None):
+    """
+    Fuse several rankings (arrays of candidate indices, best first) by reciprocal rank.
+    Returns (fused indices best first, fused scores).
+    """
+    weights = weights or [1.0] * len(rankings)
+    rankings = [np.asarray(r, dtype=np.int64) for r in rankings]
+    candidates = np.concatenate(rankings) if rankings else np.empty(0, dtype=np.int64)
+    contributions = np.concatenate([
+        w / (rrf_k + 1.0 + np.arange(len(r))) for r, w in zip(rankings, weights)
+    ]) if rankings else np.empty(0)
+
+    unique, inverse = np.unique(candidates, return_inverse=True)
+    fused = np.bincount(inverse, weights=contributions, minlength=len(unique))
+    order = top_k_indices(fused, k)
+    return unique[order], fused[order]
+
+
+def load_ranking_config(path=RANKING_CONFIG_PATH):
+    """
+    Default blend parameters, overridden by the JSON file written by ranking_sweep.py if present.
+    An invalid file is ignored (with a warning) rather than stopping the server.
+    """
+    config = {
+        "similarity_weight": DEFAULT_SIMILARITY_WEIGHT,
+        "positive_weight": DEFAULT_POSITIVE_WEIGHT,
+        "positive_rate_power": DEFAULT_POSITIVE_RATE_POWER,
+        "filter_strictness": DEFAULT_FILTER_STRICTNESS,
+    }
+    if not path or not os.path.exists(path):
+        return config
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ValueError("expected a JSON object")
+        tuned = {key: loaded[key] for key in config if key in loaded}
+        validate_ranking_parameters(tuned)
+    except (OSError, ValueError) as e:
+        log.warning("Ignoring ranking config %s: %s", path, e)
+        return config
+
+    config.update(tuned)
+    log.info("Ranking parameters from %s: %s", path, config)
+    return config
+
+
+def validate_ranking_parameters(params):
+    """Raise ValueError with a readable message if a blend parameter is out of range"""
+    for key in ("similarity_weight", "positive_weight", "positive_rate_power"):
+        if key in params:
+            try:
+                params[key] = float(params[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a number")
+            if not math.isfinite(params[key]):
+                raise ValueError(f"{key} must be a finite number")
+            if params[key] < 0:
+                raise ValueError(f"{key} must be non-negative")
+    if "filter_strictness" in params and params["filter_strictness"] not in FILTER_STRICTNESS:
+        raise ValueError(f"filter_strictness must be one of {list(FILTER_STRICTNESS)}")
+
+
+# Blend parameters of the running server
+ranking_config = load_ranking_config()
+
+
+def apply_filter_strictness(parsed_query, strictness=DEFAULT_FILTER_STRICTNESS):
+    """The parsed query reduced to the attributes that filter candidates at this strictness"""
+    if strictness == DEFAULT_FILTER_STRICTNESS:
+        return parsed_query
+    fields = FILTER_STRICTNESS[strictness]
+    return {key: value for key, value in parsed_query.items() if key in fields}
+
+
+def parse_ranking_options(data):
+    """
+    Read k / similarity_weight / positive_weight / positive_rate_power / filter_strictness
+    from a request body; missing values come from ranking_config.
+    Raises ValueError with a readable message on invalid values.
+    """
+    params = {key: data.get(key, default) for key, default in ranking_config.items()}
+    try:
+        k = int(data.get("k", DEFAULT_TOP_K))
+    except (TypeError, ValueError, OverflowError):  # int(inf) raises OverflowError
+        raise ValueError("k must be an integer")
+    validate_ranking_parameters(params)
+
+    if not 1 <= k <= MAX_TOP_K:
+        raise ValueError(f"k must be between 1 and {MAX_TOP_K}")
+
+    return {"k": k, **params}
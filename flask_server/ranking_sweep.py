@@ -0,0 +1,184 @@
+# Offline tuning of the ranking blend: final = w * cosine + (1 - w) * positive_rate ** power,
+# over the candidates left by the attribute filter at a given strictness.
+# The query x product similarity matrix and the filter masks are computed once; every configuration
+# is then evaluated in NumPy against the keyword-labelled evaluation queries of experiment_evaluation.py.
+# --write-config saves the best configuration to ranking_config.json, which the server loads at startup.
+#
+#   python ranking_sweep.py                         # grid search, ranked table
+#   python ranking_sweep.py --search random --trials 500 --write-config
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+import pandas as pd
+from attribute_index import AttributeIndex
+from evaluation import relevance_matrix, cached_description_embeddings, top_k_masked, ranking_metrics
+from experiment_evaluation import queries as EVALUATION_QUERIES
+from import_csv_to_db import INFO_CSV, RATE_CSV, load_positive_rates, iter_product_batches, canonicalize_row
+from ranking import positive_rate_term, FILTER_STRICTNESS, RANKING_CONFIG_PATH, apply_filter_strictness, ranking_config
+from rule_parser import parse_with_rules
+
+GRID_SIMILARITY_WEIGHTS = tuple(np.round(np.linspace(0.0, 1.0, 21), 2))
+GRID_POSITIVE_RATE_POWERS = (0.5, 1.0, 2.0, 4.0)
+
+# Random search draws the power log-uniformly from this range
+POWER_RANGE = (0.25, 8.0)
+
+
+def load_catalog(info_csv=INFO_CSV, rate_csv=RATE_CSV):
+    """Product rows exactly as import_csv_to_db would insert them, ids numbered from 1"""
+    rows = [row for batch in iter_product_batches(info_csv, load_positive_rates(rate_csv)) for row in batch]
+    for product_id, row in enumerate(rows, start=1):
+        row["id"] = product_id
+        canonicalize_row(row)
+    return rows
+
+
+def build_attribute_index(rows):
+    return AttributeIndex([
+        (r["id"], r["name"], r["description"], r["positive_rate"], r["gender"], r["main_accords"],
+         r["suitable_season"], r["suitable_time"], r["longevity"], r["sillage"])
+        for r in rows
+    ])
+
+
+def filter_masks(index, query_texts):
+    """{strictness: (query x product) boolean mask of the candidates left by the attribute filter}"""
+    parsed = [parse_with_rules(q)[0] for q in query_texts]
+    masks = {}
+    for strictness in FILTER_STRICTNESS:
+        mask = np.zeros((len(query_texts), len(index)), dtype=bool)
+        for row, parsed_query in enumerate(parsed):
+            mask[row, index.filter(apply_filter_strictness(parsed_query, strictness))] = True
+        masks[strictness] = mask
+    return masks
+
+
+class SweepEvaluator:
+    """Evaluate blend configurations on a fixed similarity matrix; rate powers are computed once each"""
+
+    def __init__(self, similarities, positive_rates, masks, relevance, k):
+        self.similarities = similarities
+        self.positive_rates = positive_rates
+        self.masks = masks
+        self.relevance = relevance
+        self.k = k
+        self._powered = {}
+
+    def _rates(self, power):
+        rates = self._powered.get(power)
+        if rates is None:
+            rates = self._powered[power] = positive_rate_term(self.positive_rates, power)
+        return rates
+
+    def evaluate(self, similarity_weight, positive_rate_power, filter_strictness):
+        scores = similarity_weight * self.similarities + (1.0 - similarity_weight) * self._rates(positive_rate_power)
+        ranked = top_k_masked(scores, self.k, self.masks[filter_strictness])
+        metrics = ranking_metrics(ranked, self.relevance, (self.k,))[self.k]
+        return {
+            "similarity_weight": float(similarity_weight),
+            "positive_weight": round(1.0 - float(similarity_weight), 6),
+            "positive_rate_power": float(positive_rate_power),
+            "filter_strictness": filter_strictness,
+            **{f"{name}@{self.k}": float(values.mean()) for name, values in metrics.items()},
+        }
+
+
+def grid_configs():
+    return itertools.product(GRID_SIMILARITY_WEIGHTS, GRID_POSITIVE_RATE_POWERS, FILTER_STRICTNESS)
+
+
+def random_configs(trials, seed):
+    rng = np.random.default_rng(seed)
+    low, high = np.log(POWER_RANGE[0]), np.log(POWER_RANGE[1])
+    strictness = list(FILTER_STRICTNESS)
+    for _ in range(trials):
+        yield (round(float(rng.uniform(0.0, 1.0)), 3), round(float(np.exp(rng.uniform(low, high))), 3),
+               strictness[rng.integers(len(strictness))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranking blend parameter sweep")
+    parser.add_argument("--info-csv", default=INFO_CSV)
+    parser.add_argument("--rate-csv", default=RATE_CSV)
+    parser.add_argument("--queries", help="JSON file {query: [keywords]} (default: experiment_evaluation queries)")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=300, help="configurations tried by random search")
+    parser.add_argument("--seed", type=int, default=20250809)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--metric", choices=["ndcg", "precision", "recall"], default="ndcg")
+    parser.add_argument("--top", type=int, default=15, help="rows of the ranked table to print")
+    parser.add_argument("--output", default="ranking_sweep_results.csv")
+    parser.add_argument("--write-config", action="store_true", help="save the best configuration for the server")
+    parser.add_argument("--config", default=RANKING_CONFIG_PATH)
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            evaluation_queries = json.load(f)
+    else:
+        evaluation_queries = EVALUATION_QUERIES
+    query_texts = list(evaluation_queries)
+
+    rows = load_catalog(args.info_csv, args.rate_csv)
+    index = build_attribute_index(rows)
+    relevance = relevance_matrix(index.descriptions, list(evaluation_queries.values()))
+
+    # Everything that does not depend on the blend parameters is computed once
+    start = time.perf_counter()
+    from bert_model import get_model
+    desc_embeddings = cached_description_embeddings(list(index.descriptions))
+    query_embeddings = get_model().encode(query_texts, normalize_embeddings=True).astype(np.float32)
+    similarities = query_embeddings @ desc_embeddings.T
+    masks = filter_masks(index, query_texts)
+    setup = time.perf_counter() - start
+
+    evaluator = SweepEvaluator(similarities, index.positive_rates, masks, relevance, args.k)
+    configs = grid_configs() if args.search == "grid" else random_configs(args.trials, args.seed)
+    start = time.perf_counter()
+    results = [evaluator.evaluate(*config) for config in configs]
+    sweep = time.perf_counter() - start
+
+    objective = f"{args.metric}@{args.k}"
+    tie_breakers = [m for m in (f"ndcg@{args.k}", f"precision@{args.k}", f"recall@{args.k}") if m != objective]
+    table = pd.DataFrame(results).sort_values([objective] + tie_breakers, ascending=False, kind="stable")
+    table = table.reset_index(drop=True)
+    # Only the ratio of the two server weights matters for the ranking
+    weight_sum = ranking_config["similarity_weight"] + ranking_config["positive_weight"]
+    current_weight = ranking_config["similarity_weight"] / weight_sum if weight_sum else 1.0
+    current = evaluator.evaluate(current_weight, ranking_config["positive_rate_power"],
+                                 ranking_config["filter_strictness"])
+
+    print(f"\n⚖️ {len(table)} configurations, {len(query_texts)} queries x {len(index)} products "
+          f"(setup {setup:.2f} s, sweep {sweep:.3f} s)\n")
+    print(table.head(args.top).to_markdown(floatfmt=".3f"))
+    print(f"\nCurrent server configuration: {objective} = {current[objective]:.3f} "
+          f"(w={current['similarity_weight']:.2f}, power={current['positive_rate_power']}, "
+          f"filter={current['filter_strictness']})")
+    table.to_csv(args.output, index=False)
+
+    if args.write_config:
+        best = table.iloc[0]
+        config = {
+            "similarity_weight": float(best["similarity_weight"]),
+            "positive_weight": float(best["positive_weight"]),
+            "positive_rate_power": float(best["positive_rate_power"]),
+            "filter_strictness": str(best["filter_strictness"]),
+            "tuned": {
+                "metric": objective,
+                "value": float(best[objective]),
+                "baseline": float(current[objective]),
+                "queries": len(query_texts),
+                "products": len(index),
+                "search": args.search,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+        }
+        with open(args.config, "w", encoding="utf-8") as f:
+            json.dump(config, f, indent=2)
+        print(f"✅ Best configuration saved to {args.config} (restart the server to load it)")
+
+
+if __name__ == "__main__":
+    main()
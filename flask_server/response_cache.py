@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from query_encoder import normalize_query_text
+from logging_setup import get_logger
+from metrics import registry
+
+try:
+    import redis
+except ImportError:  # only needed for the shared backend
+    redis = None
+
+log = get_logger(__name__)
+
+# Cache settings (override through environment variables)
+CACHE_MAX_ENTRIES = int(os.environ.get("PERFUME_RESPONSE_CACHE_SIZE", "5000"))
+# Entries are invalidated by the catalog version; the TTL only bounds how long unused entries are kept
+CACHE_TTL_SECONDS = float(os.environ.get("PERFUME_RESPONSE_CACHE_TTL", str(24 * 3600)))
+# redis://host:port/db to share responses between workers and hosts; empty = in-process LRU per worker
+CACHE_URL = os.environ.get("PERFUME_RESPONSE_CACHE_URL", "")
+# How long a worker may hold the compute lock of a shared key before others compute it themselves
+LOCK_TIMEOUT_SECONDS = float(os.environ.get("PERFUME_RESPONSE_CACHE_LOCK_TIMEOUT", "10"))
+
+class MemoryBackend:
+    """Bounded LRU + TTL of JSON strings, private to the process"""
+
+    shared = False
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, json string)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Concurrent computations of a key are already coalesced within the process
+    def acquire(self, key, timeout):
+        return True
+
+    def release(self, key):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"backend": "memory", "entries": len(self._entries), "evictions": self.evictions}
+
+
+class RedisBackend:
+    """
+    Responses shared by every worker through Redis (or any client with the same GET/SET/DELETE/SCAN
+    interface, e.g. fake_redis.FakeRedis). A SET NX lock per key lets one worker compute a cold key
+    while the others wait for its result.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix="perfume:response:"):
+        self.client = client
+        self.prefix = prefix
+        self._token = uuid.uuid4().hex  # lock owner, so a worker only releases its own locks
+
+    @classmethod
+    def from_url(cls, url):
+        if redis is None:
+            raise RuntimeError(f"PERFUME_RESPONSE_CACHE_URL={url} needs the redis package (pip install redis)")
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=max(1, int(ttl)))
+
+    def acquire(self, key, timeout):
+        return bool(self.client.set(self._lock_key(key), self._token, px=int(timeout * 1000), nx=True))
+
+    def release(self, key):
+        lock_key = self._lock_key(key)
+        owner = self.client.get(lock_key)
+        if owner is not None and owner.decode("utf-8") == self._token:
+            self.client.delete(lock_key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {"backend": "redis"}
+
+    def _lock_key(self, key):
+        return f"{self.prefix}lock:{key}"
+
+
+def default_backend(url=CACHE_URL):
+    return RedisBackend.from_url(url) if url else MemoryBackend()
+
+
+class ResponseCache:
+    """
+    Cache of complete /search_by_bert pages keyed by (normalized query, parsed filter, ranking options,
+    retrieval, offset) and stamped with the catalog version of the data snapshot the page was computed
+    from, so a data reload invalidates every entry.
+    A cold key is computed once: concurrent requests in the process wait for the first one, and with a
+    shared backend, workers in other processes wait for the worker holding the key's lock.
+    Values are stored as JSON, so callers always receive fresh objects.
+    """
+
+    def __init__(self, backend=None, ttl=CACHE_TTL_SECONDS, lock_timeout=LOCK_TIMEOUT_SECONDS,
+                 poll_interval=0.02):
+        self.backend = backend if backend is not None else default_backend()
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._pending = {}  # key -> Future of the JSON value, for computations in progress
+        self._lock = threading.Lock()
+        self._version = None  # latest catalog version looked up
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.peer_waits = 0
+
+    @staticmethod
+    def request_key(user_query, filters, options, retrieval, offset):
+        payload = json.dumps([normalize_query_text(user_query), filters, options, retrieval, offset],
+                             sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(catalog_version, request_key):
+        return f"{catalog_version}:{request_key}"
+
+    def get_or_compute(self, catalog_version, request_key, compute):
+        """
+        Cached value of `request_key` at `catalog_version` (the version of the snapshot the caller would
+        compute from), or the value of `compute()`. compute returns (JSON-serializable value, catalog version
+        it was computed from); the value is stored under that version, and not stored when it is None.
+        """
+        self._observe_version(catalog_version)
+        key = self.make_key(catalog_version, request_key)
+        value = self.backend.get(key)
+        if value is not None:
+            self._count("hit")
+            return json.loads(value)
+
+        with self._lock:
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = self._pending[key] = Future()
+        if not leader:
+            self._count("coalesced")
+            return json.loads(future.result())  # re-raises the first request's error
+
+        try:
+            value = self._compute_once(key, request_key, compute)
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+        return json.loads(value)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced + self.peer_waits
+        return {
+            **self.backend.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "peer_waits": self.peer_waits,
+            "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0
+        }
+
+    def _observe_version(self, catalog_version):
+        if self._version is not None and catalog_version != self._version:
+            log.info("Catalog version %s -> %s, response cache invalidated", self._version, catalog_version)
+            if not self.backend.shared:
+                self.backend.clear()  # old entries are unreachable; free them right away
+        self._version = catalog_version
+
+    def _compute_once(self, key, request_key, compute):
+        acquired = self.backend.acquire(key, self.lock_timeout)
+        if not acquired:
+            # Another worker is computing this key: wait for its result, up to the lock timeout
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = self.backend.get(key)
+                if value is not None:
+                    self._count("peer_wait")
+                    return value
+            log.warning("Response cache lock wait timed out, computing %s", key)
+
+        try:
+            # Stored between our lookup and taking the lock
+            value = self.backend.get(key)
+            if value is not None:
+                self._count("hit")
+                return value
+            self._count("miss")
+            result, computed_version = compute()
+            value = json.dumps(result)
+            if computed_version is not None:
+                self.backend.set(self.make_key(computed_version, request_key), value, self.ttl)
+            return value
+        finally:
+            if acquired:
+                self.backend.release(key)
+
+    def _count(self, outcome):
+        if outcome == "hit":
+            self.hits += 1
+        elif outcome == "miss":
+            self.misses += 1
+        elif outcome == "coalesced":
+            self.coalesced += 1
+        else:
+            self.peer_waits += 1
+        registry.inc("perfume_response_cache_total", help_text="Response cache lookups by outcome",
+                     outcome=outcome)
+
+
+# Cache shared by the /search_by_bert handlers
+response_cache = ResponseCache()
@@ -0,0 +1,142 @@
+# Compare the rule-based parser with the Ollama parses stored in model_comparison_results.csv, and
+# check its confidence against the gold labels (model_comparison_gold.json) at several thresholds.
+# The gold queries are split in two: the confidence threshold is calibrated on one part, and precision
+# and coverage are reported on the held-out part, which nothing in the parser was tuned on.
+import ast
+import hashlib
+import json
+import time
+import pandas as pd
+from rule_parser import parse_with_rules, CONFIDENCE_THRESHOLD
+
+FIELDS = ["gender", "longevity", "sillage", "suitable_season", "suitable_time"]
+REFERENCE_MODEL = "mistral"
+REPEAT = 1000
+GOLD_FILE = "model_comparison_gold.json"
+
+# One gold query in HOLDOUT_MODULUS is held out (chosen by a hash of its text, so the split is stable)
+HOLDOUT_MODULUS = 3
+# Calibration picks the lowest threshold whose confident parses reach this precision
+TARGET_PRECISION = 0.95
+THRESHOLDS = (0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)
+
+
+def normalize_field(value):
+    """Treat None / missing / empty list alike and compare lists as sets"""
+    if value in (None, "", []) or (isinstance(value, float) and pd.isna(value)):
+        return None
+    if isinstance(value, list):
+        return frozenset(v.lower() for v in value)
+    return str(value).lower()
+
+
+def load_reference(path="model_comparison_results.csv", model=REFERENCE_MODEL):
+    df = pd.read_csv(path)
+    df = df[df["model"] == model]
+    rows = []
+    for query, parsed_json, time_sec in zip(df["query"], df["parsed_json"], df["time_sec"]):
+        if not isinstance(parsed_json, str):
+            continue  # the LLM answer was not valid JSON
+        rows.append((query, ast.literal_eval(parsed_json), time_sec))
+    return rows
+
+
+def split_gold(path=GOLD_FILE):
+    """(calibration labels, held-out labels) of the gold file: {query: labels} each"""
+    with open(path, "r", encoding="utf-8") as f:
+        gold_labels = json.load(f)
+    calibration, holdout = {}, {}
+    for query, labels in gold_labels.items():
+        held_out = int(hashlib.sha1(query.encode("utf-8")).hexdigest()[:8], 16) % HOLDOUT_MODULUS == 0
+        (holdout if held_out else calibration)[query] = labels
+    return calibration, holdout
+
+
+def score_gold(gold_labels):
+    """[(confidence, every gold field right)] of the rule parses of the labelled queries"""
+    scored = []
+    for query, gold in gold_labels.items():
+        parsed, confidence, _ = parse_with_rules(query)
+        # Fields missing from the labels must be empty
+        correct = all(normalize_field(parsed.get(field)) == normalize_field(gold.get(field)) for field in FIELDS)
+        scored.append((confidence, correct))
+    return scored
+
+
+def precision_coverage(scored, threshold):
+    """(precision, coverage) of the parses at or above the threshold; precision is nan when none is"""
+    confident = [correct for confidence, correct in scored if confidence >= threshold]
+    precision = sum(confident) / len(confident) if confident else float("nan")
+    return precision, len(confident) / len(scored)
+
+
+def calibrate_threshold(scored, thresholds=THRESHOLDS, target=TARGET_PRECISION):
+    """Lowest threshold whose confident parses reach the target precision (the highest one if none does)"""
+    for threshold in sorted(thresholds):
+        precision, coverage = precision_coverage(scored, threshold)
+        if coverage > 0 and precision >= target:
+            return threshold
+    return max(thresholds)
+
+
+def gold_calibration(path=GOLD_FILE, thresholds=THRESHOLDS):
+    """
+    Precision and coverage at each threshold on the calibration and held-out splits, and the threshold
+    calibrated on the calibration split alone
+    """
+    calibration, holdout = (score_gold(labels) for labels in split_gold(path))
+    rows = []
+    for threshold in thresholds:
+        row = {"threshold": threshold}
+        for name, scored in (("calibration", calibration), ("held_out", holdout)):
+            row[f"{name}_precision"], row[f"{name}_coverage"] = precision_coverage(scored, threshold)
+        rows.append(row)
+    return pd.DataFrame(rows), calibrate_threshold(calibration, thresholds)
+
+
+def main():
+    reference = load_reference()
+    records = []
+    rule_times = []
+
+    for query, llm_parsed, llm_time in reference:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            parsed, confidence, ambiguous = parse_with_rules(query)
+        rule_times.append((time.perf_counter() - start) / REPEAT)
+
+        record = {"query": query, "confidence": confidence, "llm_time_sec": llm_time}
+        for field in FIELDS:
+            record[field] = normalize_field(parsed.get(field)) == normalize_field(llm_parsed.get(field))
+        records.append(record)
+
+    df = pd.DataFrame(records)
+    df["all_fields"] = df[FIELDS].all(axis=1)
+    confident = df[df["confidence"] >= CONFIDENCE_THRESHOLD]
+
+    print(f"\n📊 Rule parser vs {REFERENCE_MODEL} on {len(df)} queries\n")
+    print("Field agreement (all queries):")
+    for field in FIELDS + ["all_fields"]:
+        print(f"  {field:16s} {df[field].mean():.2f}")
+    print(f"\nConfident (>= {CONFIDENCE_THRESHOLD}): {len(confident)}/{len(df)} queries "
+          f"-> field agreement {confident[FIELDS].to_numpy().mean():.2f}")
+    print(f"Falls through to the LLM in rules_then_llm mode: {len(df) - len(confident)}/{len(df)}")
+
+    calibration, threshold = gold_calibration()
+    calibration_labels, holdout_labels = split_gold()
+    print(f"\n🎯 Confidence vs gold labels ({len(calibration_labels)} calibration / "
+          f"{len(holdout_labels)} held-out queries):\n")
+    print(calibration.to_markdown(index=False, floatfmt=".2f"))
+    precision, coverage = precision_coverage(score_gold(holdout_labels), threshold)
+    print(f"\nCalibrated threshold {threshold} (CONFIDENCE_THRESHOLD = {CONFIDENCE_THRESHOLD}): "
+          f"held-out precision {precision:.2f}, coverage {coverage:.2f}")
+
+    avg_rule = sum(rule_times) / len(rule_times)
+    avg_llm = df["llm_time_sec"].mean()
+    print("\n⏱ Average parse time:")
+    print(f"  Rule parser: {avg_rule * 1e6:.1f} µs")
+    print(f"  {REFERENCE_MODEL} (Ollama): {avg_llm:.3f} s  ({avg_llm / avg_rule:,.0f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,30 @@ from flask_cors import CORS
 from server_config import app
 from product_search import product_search_bp
 from bert_search import bert_search_bp
+from health import health_bp
+from metrics import metrics_bp, init_request_metrics
+from lifecycle import start_warmup
+from logging_setup import setup_logging, init_request_logging
 
 
 CORS(app)
 
+# Non-blocking logging with per-request ids (PERFUME_LOG_LEVEL, PERFUME_LOG_DEBUG_SAMPLE)
+setup_logging()
+init_request_logging(app)
+# Request counters / latency histograms and the optional Server-Timing header
+init_request_metrics(app)
+
 
 app.register_blueprint(product_search_bp)
 app.register_blueprint(bert_search_bp)
+app.register_blueprint(health_bp)
+app.register_blueprint(metrics_bp)
+
+# Load the model, embeddings and indexes according to PERFUME_WARMUP (lazy / background / eager).
+# Importing this module stays cheap unless the mode is "eager".
+start_warmup(app)
 
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=8900, debug=True)
-
-
-
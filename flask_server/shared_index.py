@@ -0,0 +1,79 @@
+import threading
+import time
+from catalog_version import get_catalog_version
+from logging_setup import get_logger
+
+log = get_logger(__name__)
+
+
+class SharedIndex:
+    """
+    An in-memory index shared by the request threads and kept in line with the catalog version.
+    The first request builds it; afterwards one request at most every refresh interval checks the
+    version, and a change is handled by a background thread while every request keeps using the
+    current index. The rebuilt index then replaces it in one reference assignment.
+
+    load(engine, current) returns the index for the catalog as it is now; current is the index being
+    served (None on the first build), which load may reuse but must not modify.
+    """
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.index = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()  # held for the first build and for version checks
+        self._rebuilding = None  # thread of the rebuild in progress
+
+    def get(self, db, refresh_interval):
+        index = self.index
+        if index is not None and time.monotonic() - self._last_check < refresh_interval:
+            return index
+
+        if index is None:
+            with self._lock:
+                if self.index is None:
+                    self.index = self.load(db.engine, None)
+                    self._last_check = time.monotonic()
+                return self.index
+
+        # Requests arriving while another one checks the version do not wait for it
+        if self._lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._last_check >= refresh_interval and self._rebuilding is None:
+                    self._last_check = time.monotonic()
+                    with db.engine.connect() as conn:
+                        version = get_catalog_version(conn)
+                    if version != index.version:
+                        log.info("Catalog version changed (%s -> %s), rebuilding the %s in the background",
+                                 index.version, version, self.name)
+                        self._rebuilding = threading.Thread(target=self._rebuild, args=(db.engine, index),
+                                                            name=f"rebuild-{self.name}", daemon=True)
+                        self._rebuilding.start()
+            finally:
+                self._lock.release()
+        return index
+
+    def wait(self, timeout=None):
+        """Wait for the rebuild in progress, if any (tests, warmup)"""
+        thread = self._rebuilding
+        if thread is not None:
+            thread.join(timeout)
+
+    def clear(self):
+        """Drop the index; the next get() builds it again"""
+        self.wait()
+        with self._lock:
+            self.index = None
+
+    def _rebuild(self, engine, current):
+        try:
+            start = time.perf_counter()
+            self.index = self.load(engine, current)
+            log.info("Rebuilt the %s for catalog version %s in %.2f s", self.name, self.index.version,
+                     time.perf_counter() - start)
+        except Exception:
+            # The current index keeps being served; the next check tries again
+            log.exception("Rebuilding the %s failed", self.name)
+        finally:
+            self._rebuilding = None
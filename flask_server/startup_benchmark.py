@@ -0,0 +1,69 @@
+# Server startup timing: import cost of server.py (must not pull in torch) and time until /ready
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Fail when importing the app takes longer than this (seconds)
+IMPORT_BUDGET = 3.0
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import server
+print(json.dumps({"import_seconds": time.perf_counter() - start,
+                  "torch_imported": "torch" in sys.modules,
+                  "sentence_transformers_imported": "sentence_transformers" in sys.modules}))
+"""
+
+READY_PROBE = """
+import json, time
+start = time.perf_counter()
+import server
+client = server.app.test_client()
+response = client.get("/ready")
+while response.get_json()["status"] == "warming_up" and time.perf_counter() - start < {timeout}:
+    time.sleep(0.05)
+    response = client.get("/ready")
+print(json.dumps({{"ready_seconds": time.perf_counter() - start,
+                   "ready": response.status_code == 200, "details": response.get_json()}}))
+"""
+
+
+def run_probe(code, warmup_mode):
+    env = dict(os.environ, PERFUME_WARMUP=warmup_mode)
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server startup benchmark")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--ready-timeout", type=float, default=300)
+    parser.add_argument("--skip-ready", action="store_true", help="only measure the import")
+    args = parser.parse_args()
+
+    imports = [run_probe(IMPORT_PROBE, "lazy") for _ in range(args.runs)]
+    best = min(r["import_seconds"] for r in imports)
+    print(f"import server: best {best:.3f} s over {args.runs} runs")
+    print(f"torch imported at startup: {imports[0]['torch_imported']}")
+
+    ok = best <= IMPORT_BUDGET and not imports[0]["torch_imported"]
+    if not args.skip_ready:
+        for mode in ("background", "eager"):
+            result = run_probe(READY_PROBE.format(timeout=args.ready_timeout), mode)
+            print(f"time to ready ({mode}): {result['ready_seconds']:.2f} s, ready={result['ready']}")
+            print(json.dumps(result["details"], indent=2))
+            ok = ok and result["ready"]
+
+    print("✅ startup within budget" if ok else f"❌ startup over budget ({IMPORT_BUDGET:.1f} s) or not ready")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# The server modules use flat imports from flask_server/ and read their settings from the environment
+# at import time, so both are set up before any of them is imported: a throwaway SQLite database, a
+# temporary embedding store and the synthetic encoder of pipeline_benchmark instead of MiniLM.
+import os
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+_workdir = tempfile.mkdtemp(prefix="perfume_tests_")
+os.environ["PERFUME_DATABASE_URI"] = f"sqlite:///{os.path.join(_workdir, 'catalog.db')}"
+os.environ["PERFUME_EMBEDDING_DIR"] = os.path.join(_workdir, "embeddings")
+os.environ["PERFUME_RESPONSE_CACHE_URL"] = ""
+os.environ["PERFUME_WARMUP"] = "lazy"
+os.environ.setdefault("PERFUME_LOG_LEVEL", "WARNING")
+
+import bert_model  # noqa: E402
+from pipeline_benchmark import SyntheticEncoder  # noqa: E402
+
+bert_model._model = SyntheticEncoder(bert_model.MODEL_DIM)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+import pytest
+import async_server
+from async_server import AsyncServer
+from logging_setup import RequestContextFilter
+from metrics import span
+from ollama_client import OllamaError
+from server import app as flask_app
+
+
+def wsgi_ok(environ, start_response):
+    body = b'{"ok": true}'
+    start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+async def call(server, path="/search_by_bert", headers=()):
+    """(status, headers dict, body) of one request"""
+    body = json.dumps({"query": "citrus", "parse_mode": "llm"}).encode("utf-8")
+    scope = {"type": "http", "method": "POST", "path": path,
+             "headers": [(b"content-type", b"application/json"), *headers]}
+    messages = [{"type": "http.request", "body": body}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await server(scope, receive, send)
+    response_headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in sent[0]["headers"]}
+    return sent[0]["status"], response_headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+async def status(server, path="/search_by_bert"):
+    return (await call(server, path))[0]
+
+
+@pytest.fixture
+def held_parse(monkeypatch):
+    """pre_parse held open until release is set; parsing lists the bodies being parsed"""
+    state = {"release": None, "parsing": []}
+
+    async def slow_parse(body):
+        state["parsing"].append(body)
+        await state["release"].wait()
+        return {"main_accords": ["citrus"]}
+
+    monkeypatch.setattr(async_server, "pre_parse", slow_parse)
+    return state
+
+
+def test_parse_waiters_do_not_take_cpu_places(held_parse):
+    async def scenario():
+        held_parse["release"] = release = asyncio.Event()
+        server = AsyncServer(wsgi_ok, cpu_workers=1, cpu_queue=1, max_pending_parses=8)
+        waiting = [asyncio.create_task(status(server)) for _ in range(8)]
+        while len(held_parse["parsing"]) < 8:
+            await asyncio.sleep(0)
+
+        # Four times workers + queue requests wait for Ollama, and the CPU places are still free
+        assert server.pending_parses == 8 and server.admitted == 0
+        assert await status(server, "/health") == 200
+        assert not any(task.done() for task in waiting)
+        # Only the parse slots are full
+        assert await status(server) == 503
+
+        release.set()
+        assert await asyncio.gather(*waiting) == [200] * 8
+        assert server.admitted == 0 and server.pending_parses == 0
+        server.pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_parsed_requests_queue_for_a_cpu_place(held_parse):
+    async def scenario():
+        held_parse["release"] = release = asyncio.Event()
+        server = AsyncServer(wsgi_ok, cpu_workers=1, cpu_queue=0, max_pending_parses=4)
+        await server._enter_cpu(wait=False)  # a long-running request holds the only place
+        waiting = [asyncio.create_task(status(server)) for _ in range(3)]
+        release.set()
+        while len(server._cpu_waiters) < 3:
+            await asyncio.sleep(0)
+        # Parsed and waiting for the CPU place: the parse slots stay taken, others are rejected
+        assert server.pending_parses == 3
+        assert await status(server, "/health") == 503
+
+        server._leave_cpu()
+        assert await asyncio.gather(*waiting) == [200] * 3
+        assert server.admitted == 0 and server.pending_parses == 0
+        server.pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_failed_parse_is_answered_like_the_sync_path(monkeypatch):
+    seen = {}
+
+    async def failing_parse(body):
+        with span("ollama"):
+            await asyncio.sleep(0)
+        record = logging.LogRecord("perfume.test", logging.ERROR, __file__, 0, "parse", None, None)
+        RequestContextFilter().filter(record)
+        seen["request_id"] = record.request_id
+        raise OllamaError("ollama down")
+
+    async def scenario():
+        monkeypatch.setattr(async_server, "pre_parse", failing_parse)
+        monkeypatch.setitem(flask_app.config, "SERVER_TIMING_ENABLED", True)
+        server = AsyncServer(flask_app, cpu_workers=1, cpu_queue=0)
+        code, headers, body = await call(server, headers=[(b"x-request-id", b"abc123")])
+        assert code == 400 and json.loads(body) == {"error": "Failed to parse query"}
+        assert seen["request_id"] == "abc123" and headers["x-request-id"] == "abc123"
+        assert "ollama;dur=" in headers["server-timing"]
+        assert server.admitted == 0 and server.pending_parses == 0
+        server.pool.shutdown()
+
+    asyncio.run(scenario())
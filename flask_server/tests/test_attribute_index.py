@@ -0,0 +1,76 @@
+import threading
+import time
+import pytest
+import attribute_index
+from attribute_index import get_attribute_index
+from catalog_version import bump_catalog_version
+from import_csv_to_db import PRODUCT_COLUMNS, full_import
+from server_config import app, db
+
+
+def product(i, accords):
+    row = dict.fromkeys(PRODUCT_COLUMNS)
+    row.update(name=f"perfume {i}", url=f"https://example.com/{i}", description="a perfume",
+               main_accords=accords, positive_rate=0.5)
+    return row
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(attribute_index, "REFRESH_INTERVAL", 0.0)
+    with app.app_context():
+        full_import([[product(i, accords) for i, accords in enumerate(["Citrus", "Woody", "Amber, Citrus"])]],
+                    None, batch_size=100)
+        attribute_index._shared.clear()
+        yield
+
+
+def test_stale_index_is_served_while_the_new_one_is_built(catalog, monkeypatch):
+    old = get_attribute_index(db)
+    started, release = threading.Event(), threading.Event()
+    load = attribute_index._shared.load
+
+    def slow_load(engine, current):
+        started.set()
+        release.wait(5)
+        return load(engine, current)
+
+    monkeypatch.setattr(attribute_index._shared, "load", slow_load)
+    with db.engine.begin() as conn:
+        bump_catalog_version(conn)
+
+    start = time.perf_counter()
+    assert get_attribute_index(db) is old
+    assert started.wait(5)
+    # Other requests keep the old index without waiting for the rebuild, and do not start another one
+    assert get_attribute_index(db) is old
+    assert time.perf_counter() - start < 1
+
+    release.set()
+    attribute_index._shared.wait()
+    new = get_attribute_index(db)
+    assert new is not old and new.version == old.version + 1
+
+
+def test_failed_rebuild_keeps_the_current_index(catalog, monkeypatch):
+    old = get_attribute_index(db)
+
+    def failing_load(engine, current):
+        raise RuntimeError("database gone")
+
+    monkeypatch.setattr(attribute_index._shared, "load", failing_load)
+    with db.engine.begin() as conn:
+        bump_catalog_version(conn)
+    assert get_attribute_index(db) is old
+    attribute_index._shared.wait()
+    assert get_attribute_index(db) is old
+
+
+def test_term_cache_is_bounded(catalog, monkeypatch):
+    monkeypatch.setattr(attribute_index, "MAX_CACHED_TERMS", 3)
+    index = get_attribute_index(db)
+    terms = ["citrus", "woody", "amber", "vanilla", "musk"]
+    for term in terms:
+        index.filter({"main_accords": [term]})
+    assert list(index._term_cache) == [("main_accords", term, False) for term in terms[-3:]]
+    assert list(index.filter({"main_accords": ["citrus"]})) == [0, 2]
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+import embedding_store
+from embedding_store import (EmbeddingStoreBuilder, CURRENT_FILE, current_store_path, encode_descriptions,
+                             get_product_store, get_vector_index)
+
+
+def build(store_dir, rows, catalog_version):
+    builder = EmbeddingStoreBuilder(str(store_dir))
+    builder.add([r[0] for r in rows], [r[1] for r in rows])
+    return builder.finish(catalog_version)
+
+
+@pytest.fixture
+def shared_store(monkeypatch, tmp_path):
+    """get_product_store() over tmp_path, re-checked on every call, with a settable live catalog version"""
+    live = {"version": 1}
+    monkeypatch.setattr(embedding_store, "REFRESH_INTERVAL", 0.0)
+    monkeypatch.setattr(embedding_store, "product_store", None)
+    monkeypatch.setattr(embedding_store, "product_index", None)
+    monkeypatch.setattr(embedding_store, "_live_catalog_version", lambda: live["version"])
+    return live
+
+
+ROWS = [(1, "fresh citrus bergamot"), (2, "warm amber vanilla"), (3, "green fig leaves")]
+
+
+def test_build_is_published_through_pointer(tmp_path):
+    first = build(tmp_path, ROWS, 1)
+    assert os.path.isfile(tmp_path / CURRENT_FILE)
+    assert first.path == current_store_path(str(tmp_path)) != str(tmp_path)
+    assert first.catalog_version == 1
+
+    second = build(tmp_path, [(1, "smoky leather"), *ROWS[1:]], 2)
+    assert second.path != first.path
+    # The previous build stays readable for anyone still mapping it
+    assert os.path.isdir(first.path)
+
+
+def test_unchanged_rebuild_only_restamps_version(tmp_path):
+    first = build(tmp_path, ROWS, 1)
+    second = build(tmp_path, ROWS, 2)
+    assert second.path == first.path
+    assert second.catalog_version == 2
+
+
+def test_shared_store_reloads_on_new_build(tmp_path, shared_store):
+    build(tmp_path, ROWS, 1)
+    store = get_product_store(str(tmp_path))
+    assert not store.verify_hashes
+
+    build(tmp_path, [(1, "smoky leather"), *ROWS[1:]], 2)
+    shared_store["version"] = 2
+    reloaded = get_product_store(str(tmp_path))
+    assert reloaded is not store
+    assert not reloaded.verify_hashes
+    expected = encode_descriptions(["smoky leather"])[0]
+    assert np.allclose(reloaded.lookup([1])[0], expected, atol=1e-3)
+
+
+def test_stale_store_reencodes_changed_descriptions(tmp_path, shared_store):
+    build(tmp_path, ROWS, 1)
+    shared_store["version"] = 2  # products reloaded, store not rebuilt yet
+    store = get_product_store(str(tmp_path))
+    assert store.verify_hashes
+
+    vectors = store.lookup([1, 2], ["smoky leather", "warm amber vanilla"])
+    expected = encode_descriptions(["smoky leather", "warm amber vanilla"])
+    assert np.allclose(vectors, expected, atol=1e-3)
+
+
+def test_vector_index_follows_store(tmp_path, shared_store, monkeypatch):
+    monkeypatch.setattr(embedding_store, "STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(embedding_store.get_product_store, "__defaults__", (str(tmp_path),))
+    build(tmp_path, ROWS, 1)
+    first = get_vector_index("exact")
+
+    build(tmp_path, [*ROWS, (4, "salty sea breeze")], 2)
+    shared_store["version"] = 2
+    second = get_vector_index("exact")
+    assert second is not first
+    assert second.fingerprint == get_product_store().fingerprint
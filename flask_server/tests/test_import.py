@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import text
+from server_config import app, db
+from catalog_version import get_catalog_version
+from embedding_store import EmbeddingStoreBuilder, load_embedding_store
+from import_csv_to_db import PRODUCT_COLUMNS, full_import, incremental_import
+
+
+def product(name, description="fresh citrus", gender="Unisex", accords="Citrus, Woody"):
+    row = dict.fromkeys(PRODUCT_COLUMNS)
+    row.update(name=name, url=f"https://example.com/{name}", description=description, gender=gender,
+               main_accords=accords, positive_rate=0.5)
+    return row
+
+
+@pytest.fixture
+def conn():
+    with app.app_context(), db.engine.connect() as connection:
+        yield connection
+
+
+def ids_by_name(conn):
+    return dict((name, product_id) for product_id, name in conn.execute(text("SELECT id, name FROM products")))
+
+
+def test_full_import_keeps_ids_of_known_products(conn, tmp_path):
+    with app.app_context():
+        full_import([[product("a"), product("b")], [product("c")]], None, batch_size=2)
+    before = ids_by_name(conn)
+
+    with app.app_context():
+        full_import([[product("d"), product("c")], [product("a")]], None, batch_size=2)
+    after = ids_by_name(conn)
+    assert after["a"] == before["a"] and after["c"] == before["c"]
+    assert after["d"] not in before.values()
+    assert "b" not in after
+
+
+def test_store_is_stamped_before_the_version_bump(conn, tmp_path):
+    builder = EmbeddingStoreBuilder(str(tmp_path))
+    with app.app_context():
+        full_import([[product("a"), product("b")]], builder, batch_size=10)
+    store = load_embedding_store(str(tmp_path))
+    assert store.catalog_version == get_catalog_version(conn)
+    assert sorted(store.ids.tolist()) == sorted(ids_by_name(conn).values())
+
+    builder = EmbeddingStoreBuilder(str(tmp_path), keep_existing=True)
+    with app.app_context():
+        incremental_import([[product("c")]], builder, batch_size=10)
+    store = load_embedding_store(str(tmp_path))
+    assert store.catalog_version == get_catalog_version(conn)
+    assert len(store) == 3
+
+
+def test_duplicate_keys_in_a_batch_keep_the_last_row(conn):
+    with app.app_context():
+        full_import([[product("a", gender="Female"), product("a", gender="Male")]], None, batch_size=10)
+        incremental_import([[product("b", accords="Woody"), product("b", accords="Amber")]], None, batch_size=10)
+    rows = dict(conn.execute(text("SELECT name, gender FROM products")).fetchall())
+    assert rows == {"a": "male", "b": "unisex"}
+    accords = conn.execute(text(
+        "SELECT av.value FROM product_attributes pa JOIN attribute_values av ON av.id = pa.attribute_id "
+        "JOIN products p ON p.id = pa.product_id WHERE p.name = 'b' AND av.field = 'main_accords'"
+    )).scalars().all()
+    assert accords == ["amber"]
+
+
+def test_duplicate_keys_across_batches_keep_the_last_row(conn):
+    with app.app_context():
+        full_import([[product("a", description="first")], [product("a", description="second")]], None,
+                    batch_size=10)
+    assert conn.execute(text("SELECT description FROM products")).scalars().all() == ["second"]
@@ -0,0 +1,105 @@
+import pytest
+from llm_output import JsonObjectScanner, extract_json_object, loads_tolerant, normalize_parsed_query
+from query_vocab import DEFAULT_QUERY
+
+# Model answer -> object extracted from it
+REPAIRABLE = [
+    # Valid JSON and surrounding chatter
+    ('{"gender": "female"}', {"gender": "female"}),
+    ('Sure! Here it is:\n{"gender": "male"}\nHope this helps {', {"gender": "male"}),
+    ('```json\n{"longevity": "eternal"}\n```', {"longevity": "eternal"}),
+    # Python-style literals and quotes
+    ("{'gender': 'female', 'suitable_season': ['summer']}", {"gender": "female", "suitable_season": ["summer"]}),
+    ('{"gender": None, "unisex": True, "sillage": False}', {"gender": None, "unisex": True, "sillage": False}),
+    ("{'note': 'it\\'s fresh'}", {"note": "it's fresh"}),
+    ("{“gender”: “female”}", {"gender": "female"}),
+    # Bare words
+    ("{gender: female, longevity: eternal}", {"gender": "female", "longevity": "eternal"}),
+    ('{"k": 3, "score": -1.5e2}', {"k": 3, "score": -150.0}),
+    # Missing and trailing commas
+    ('{"gender": "male" "sillage": "strong"}', {"gender": "male", "sillage": "strong"}),
+    ('{"suitable_time": ["day" "night"]}', {"suitable_time": ["day", "night"]}),
+    ('{"gender": "male",}', {"gender": "male"}),
+    ('{"suitable_season": ["spring", "summer",],}', {"suitable_season": ["spring", "summer"]}),
+    ('{, "gender": "male",, "sillage": "strong"}', {"gender": "male", "sillage": "strong"}),
+    # Answers cut off mid-object (num_predict reached)
+    ('{"gender": "female", "suitable_season": ["sum', {"gender": "female", "suitable_season": ["sum"]}),
+    ('{"gender": "female", "longevity": "long', {"gender": "female", "longevity": "long"}),
+    ('{"gender": "female",', {"gender": "female"}),
+    ('{"a": {"b": [1, 2', {"a": {"b": [1, 2]}}),
+    # Braces and quotes inside strings
+    ('{"note": "a {b} c", "gender": "male"}', {"note": "a {b} c", "gender": "male"}),
+    ('{"note": "a } and ]", "gender": "male"} {"gender": "female"}', {"note": "a } and ]", "gender": "male"}),
+    ('{"note": "say \\"hi\\" {"}', {"note": 'say "hi" {'}),
+]
+
+# Answers without a usable object
+UNREPAIRABLE = [
+    "",
+    None,
+    "I cannot help with that.",
+    '["female", "male"]',
+    "{:}",
+    '{"gender": }',
+    '{"gender" "female"}',
+    "{1: 2}",
+    '{"gender": "female": "male"}',
+]
+
+
+@pytest.mark.parametrize("answer,expected", REPAIRABLE)
+def test_repairable_answers(answer, expected):
+    assert extract_json_object(answer) == expected
+
+
+@pytest.mark.parametrize("answer", UNREPAIRABLE)
+def test_unrepairable_answers(answer):
+    assert extract_json_object(answer) is None
+
+
+def test_loads_tolerant_raises_value_error():
+    with pytest.raises(ValueError):
+        loads_tolerant("{:}")
+
+
+@pytest.mark.parametrize("answer,expected", REPAIRABLE)
+def test_scanner_finds_the_object_in_any_chunking(answer, expected):
+    for size in (1, 3, len(answer)):
+        scanner = JsonObjectScanner()
+        for start in range(0, len(answer), size):
+            scanner.feed(answer[start:start + size])
+        assert extract_json_object(scanner.text) == expected
+
+
+# Parsed object -> fields that differ from DEFAULT_QUERY after normalization
+NORMALIZED = [
+    ({"gender": "female"}, {"gender": "female"}),
+    ({"gender": "Female "}, {"gender": "female"}),
+    ({"gender": "femal"}, {"gender": "female"}),
+    ({"gender": "mal"}, {"gender": "male"}),
+    ({"gender": "women"}, {"gender": "female"}),
+    ({"gender": "robot"}, {}),
+    ({"gender": True}, {}),
+    ({"gender": ["male", "female"]}, {"gender": "male"}),
+    ({"longevity": "long-lasting "}, {"longevity": "long lasting"}),
+    ({"longevity": "long lastin"}, {"longevity": "long lasting"}),
+    ({"longevity": "N/A"}, {}),
+    ({"sillage": "very strong"}, {"sillage": "very strong"}),
+    ({"sillage": "moderat"}, {"sillage": "moderate"}),
+    ({"suitable_season": "spring, summer"}, {"suitable_season": ["spring", "summer"]}),
+    ({"suitable_season": ["Winter", "autumn", "winter"]}, {"suitable_season": ["autumn", "winter"]}),
+    ({"suitable_season": ["sumer"]}, {"suitable_season": ["summer"]}),
+    ({"suitable_season": "all seasons"}, {"suitable_season": ["spring", "summer", "autumn", "winter"]}),
+    ({"suitable_season": ["monsoon"]}, {}),
+    ({"suitable_time": "day and night"}, {"suitable_time": ["day", "night"]}),
+    ({"suitable_time": "both"}, {"suitable_time": ["day", "night"]}),
+    ({"suitable_time": "none"}, {}),
+    ({"main_accords": "Vanilla, woody"}, {"main_accords": ["vanilla", "woody"]}),
+    ({"main_accords": ["Citrus", 3, " "]}, {"main_accords": ["citrus"]}),
+    ({"category": "cologne", "price": 100}, {}),
+]
+
+
+@pytest.mark.parametrize("parsed,changed", NORMALIZED)
+def test_normalize_parsed_query(parsed, changed):
+    assert normalize_parsed_query(parsed) == {**DEFAULT_QUERY, **changed}
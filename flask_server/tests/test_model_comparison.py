@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+import pytest
+import model_comparison
+from model_comparison import (GOLD_FILE, ResultCache, build_records, run_comparison, score_fields, summarize,
+                              test_queries)
+from ollama_client import OllamaError
+from ollama_parser import build_prompt
+
+with open(os.path.join(os.path.dirname(model_comparison.__file__), GOLD_FILE), encoding="utf-8") as f:
+    GOLD = json.load(f)
+
+QUERIES = test_queries[:6]
+
+
+class StubClient:
+    """
+    timed_generate() of OllamaClient without a server: answers the gold labels of the prompt's query
+    (as Python-style near-JSON for "sloppy", an empty object for "blank"), recording calls and concurrency.
+    """
+
+    def __init__(self, delay=0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.queries = {build_prompt(query): query for query in test_queries}
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def timed_generate(self, model, prompt, **options):
+        query = self.queries[prompt]
+        with self._lock:
+            self.calls.append((model, query))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if query in self.failing:
+                raise OllamaError("stub failure")
+            labels = GOLD[query] if model != "blank" else {}
+            response = json.dumps(labels) if model != "sloppy" else repr(labels)
+            return {"response": response, "eval_count": 10, "eval_duration": 10 ** 8}, self.delay
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_rerun_only_generates_new_pairs(tmp_path):
+    path = str(tmp_path / "cache.jsonl")
+    client = StubClient()
+    first = run_comparison(client, ["a"], QUERIES, ResultCache(path), workers=2)
+    assert len(client.calls) == len(QUERIES) and not any(e["cached"] for e in first)
+
+    client.calls.clear()
+    second = run_comparison(client, ["a", "b"], QUERIES, ResultCache(path), workers=2)
+    assert {model for model, _ in client.calls} == {"b"} and len(client.calls) == len(QUERIES)
+    assert [e["cached"] for e in second] == [True] * len(QUERIES) + [False] * len(QUERIES)
+    assert [e["query"] for e in second] == QUERIES * 2
+
+
+def test_failed_generations_are_not_cached(tmp_path):
+    path = str(tmp_path / "cache.jsonl")
+    entries = run_comparison(StubClient(failing=[QUERIES[0]]), ["a"], QUERIES, ResultCache(path), workers=2)
+    assert [e["query"] for e in entries] == QUERIES[1:]
+
+    client = StubClient()
+    run_comparison(client, ["a"], QUERIES, ResultCache(path), workers=2)
+    assert client.calls == [("a", QUERIES[0])]
+
+
+def test_generations_run_concurrently():
+    client = StubClient(delay=0.05)
+    start = time.perf_counter()
+    run_comparison(client, ["a", "b"], QUERIES, ResultCache(None), workers=4)
+    assert client.max_active == 4
+    assert time.perf_counter() - start < 0.05 * 2 * len(QUERIES) / 2
+
+
+def test_scores_against_the_gold_labels():
+    entries = run_comparison(StubClient(), ["exact", "sloppy", "blank"], QUERIES, ResultCache(None), workers=4)
+    summary = summarize(build_records(entries, GOLD)).set_index("model")
+
+    assert summary.loc["exact", "field_accuracy"] == 1.0 and summary.loc["exact", "exact_match"] == 1.0
+    # Near-JSON goes through the production repair, so it scores like valid JSON
+    assert summary.loc["sloppy", "field_accuracy"] == 1.0
+    assert summary.loc["blank", "exact_match"] == 0.0
+    assert 0 < summary.loc["blank", "field_accuracy"] < 1
+    assert summary.loc["exact", "tokens_per_sec"] == pytest.approx(100.0)
+    assert (summary["queries"] == len(QUERIES)).all()
+
+
+def test_missing_fields_must_be_empty():
+    gold = {"gender": "female", "suitable_season": ["summer", "spring"]}
+    correct = score_fields({"gender": "Female", "suitable_season": ["spring", "summer"], "sillage": None}, gold)
+    assert all(correct.values())
+    assert not score_fields({**gold, "longevity": "long lasting"}, gold)["longevity"]
+    assert not any(score_fields(None, gold)[field] for field in ("gender", "suitable_season"))
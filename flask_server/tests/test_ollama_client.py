@@ -0,0 +1,226 @@
+import asyncio
+import gc
+import json
+import threading
+import time
+import httpx
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+import ollama_client
+from ollama_client import AsyncOllamaClient, OllamaClient, OllamaError
+
+
+class MockAdapter(BaseAdapter):
+    """requests transport answering from handler(payload) -> (status, body) or raising its exception"""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def send(self, request, timeout=None, **kwargs):
+        with self._lock:
+            self.calls.append(timeout)
+        status, body = self.handler(json.loads(request.body))
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode("utf-8")
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def mocked_client(handler, **kwargs):
+    client = OllamaClient(base_url="http://ollama.test", **kwargs)
+    adapter = MockAdapter(handler)
+    client.session.mount("http://", adapter)
+    return client, adapter
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(ollama_client, "RETRY_BACKOFF_SECONDS", 0.01)
+
+
+def answer(payload):
+    return 200, {"response": payload["prompt"].upper()}
+
+
+def test_generate_returns_the_body():
+    client, adapter = mocked_client(answer)
+    assert client.generate("m", "citrus")["response"] == "CITRUS"
+    assert len(adapter.calls) == 1
+
+
+def test_connection_errors_and_busy_answers_are_retried():
+    outcomes = [requests.ConnectionError("refused"), (503, {"error": "busy"}), (200, {"response": "ok"})]
+
+    def handler(payload):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    client, adapter = mocked_client(handler, retries=2)
+    assert client.generate("m", "p")["response"] == "ok"
+    assert len(adapter.calls) == 3
+
+
+def test_read_timeouts_are_not_retried():
+    def handler(payload):
+        raise requests.ReadTimeout("read timed out")
+
+    client, adapter = mocked_client(handler, retries=3)
+    with pytest.raises(OllamaError):
+        client.generate("m", "p")
+    assert len(adapter.calls) == 1
+
+
+def test_retries_stay_within_the_deadline():
+    def handler(payload):
+        time.sleep(0.05)
+        return 503, {"error": "busy"}
+
+    client, adapter = mocked_client(handler, retries=50, read_timeout=60, deadline=0.3)
+    start = time.monotonic()
+    with pytest.raises(OllamaError):
+        client.generate("m", "p")
+    assert time.monotonic() - start < 0.45
+    assert all(read <= 0.3 for _, read in adapter.calls)
+    assert adapter.calls[-1][1] < adapter.calls[0][1]
+
+
+def test_request_time_excludes_the_wait_for_a_slot():
+    def handler(payload):
+        time.sleep(0.1)
+        return answer(payload)
+
+    client, _ = mocked_client(handler, max_concurrency=1)
+    start = time.perf_counter()
+    results = client.generate_many([("m", "a"), ("m", "b"), ("m", "c")], max_workers=3)
+    assert time.perf_counter() - start >= 0.3
+    assert all(error is None and 0.1 <= seconds < 0.18 for _, error, seconds in results)
+
+
+def test_identical_concurrent_prompts_share_one_generation():
+    def handler(payload):
+        time.sleep(0.1)
+        return answer(payload)
+
+    client, adapter = mocked_client(handler, max_concurrency=4)
+    results = client.generate_many([("m", "same")] * 4, max_workers=4)
+    assert [result["response"] for result, _, _ in results] == ["SAME"] * 4
+    assert len(adapter.calls) == 1
+    assert client.coalesced == 3
+
+
+def async_client(handler, **kwargs):
+    calls = []
+
+    def respond(request):
+        calls.append(request)
+        return handler(request)
+
+    return AsyncOllamaClient(base_url="http://ollama.test", transport=httpx.MockTransport(respond), **kwargs), calls
+
+
+def test_async_busy_answers_are_retried():
+    statuses = [503, 200]
+    client, calls = async_client(lambda request: httpx.Response(statuses.pop(0), json={"response": "ok"}))
+    assert asyncio.run(client.generate("m", "p"))["response"] == "ok"
+    assert len(calls) == 2
+
+
+def test_async_read_timeouts_are_not_retried():
+    def handler(request):
+        raise httpx.ReadTimeout("read timed out", request=request)
+
+    client, calls = async_client(handler, retries=3)
+    with pytest.raises(OllamaError):
+        asyncio.run(client.generate("m", "p"))
+    assert len(calls) == 1
+
+
+def test_async_retries_stay_within_the_deadline():
+    client, calls = async_client(lambda request: httpx.Response(503, json={"error": "busy"}),
+                                 retries=50, deadline=0.2)
+    start = time.monotonic()
+    with pytest.raises(OllamaError, match="deadline"):
+        asyncio.run(client.generate("m", "p"))
+    assert time.monotonic() - start < 0.35
+    assert 1 < len(calls) < 50
+
+
+def test_async_slot_wait_is_bounded_by_the_deadline():
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return httpx.Response(200, json={"response": "ok"})
+
+    client, calls = async_client(handler, max_concurrency=1, deadline=0.2)
+
+    async def main():
+        return await asyncio.gather(client.generate("m", "first"), client.generate("m", "second"),
+                                    return_exceptions=True)
+
+    first, second = asyncio.run(main())
+    assert first["response"] == "ok"
+    assert isinstance(second, OllamaError) and "free slot" in str(second)
+    assert len(calls) == 1
+
+
+def test_async_client_works_in_successive_event_loops():
+    async def handler(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"response": "ok"})
+
+    # One slot, so requests wait on the semaphore of the loop they run in
+    client, calls = async_client(handler, max_concurrency=1)
+
+    async def generate():
+        return await asyncio.gather(*(client.generate("m", f"p{i}") for i in range(3)))
+
+    for _ in range(3):
+        assert [r["response"] for r in asyncio.run(generate())] == ["ok"] * 3
+    assert len(calls) == 9
+
+
+def test_async_client_reopens_after_close():
+    client, calls = async_client(lambda request: httpx.Response(200, json={"response": "ok"}))
+
+    async def main():
+        first = await client.generate("m", "p")
+        await client.close()
+        second = await client.generate("m", "p")
+        await client.close()
+        return first, second
+
+    assert asyncio.run(main()) == ({"response": "ok"}, {"response": "ok"})
+    assert len(calls) == 2
+
+
+def test_async_error_is_retrieved_when_every_waiter_went_away():
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(500, json={"error": "model crashed"})
+
+    client, calls = async_client(handler)
+
+    async def main():
+        reported = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: reported.append(context))
+        waiter = asyncio.ensure_future(client.generate("m", "p"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()  # the client disconnected; the shielded generation goes on and fails
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.2)
+        gc.collect()
+        await client.close()
+        return reported
+
+    assert asyncio.run(main()) == []
+    assert len(calls) == 1
@@ -0,0 +1,30 @@
+import pytest
+from pagination import NDJSON_MIMETYPE, parse_stream_option
+from server import app
+
+
+@pytest.mark.parametrize("value, expected", [
+    (True, True), (False, False), (None, None), (1, True), (0, False),
+    ("true", True), ("1", True), ("false", False), ("0", False), (" TRUE ", True),
+])
+def test_stream_option_accepts_booleans(value, expected):
+    assert parse_stream_option({"stream": value}) is expected
+
+
+@pytest.mark.parametrize("value", ["no", "yes", "", 2, 1.0, [], {}, "streaming"])
+def test_stream_option_rejects_other_values(value):
+    with pytest.raises(ValueError):
+        parse_stream_option({"stream": value})
+
+
+def test_invalid_stream_flag_is_a_bad_request():
+    response = app.test_client().post("/search_products", json={"category": "citrus", "stream": "no"})
+    assert response.status_code == 400
+    assert "stream" in response.get_json()["error"]
+
+
+def test_string_false_is_not_streamed():
+    response = app.test_client().post("/search_products", json={"category": "citrus", "stream": "false"},
+                                      headers={"Accept": NDJSON_MIMETYPE})
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
@@ -0,0 +1,77 @@
+import re
+import pytest
+from preprocess_query import (CN_STOPWORDS, EN_STOPWORDS, PERFUME_SPELL_FIXES, PUNCT_TRANSLATION, QueryPreprocessor,
+                              preprocess_queries, preprocess_query)
+
+# Spelling fixes of the previous electronics-store version
+ELECTRONICS_SPELL_FIXES = {
+    "iphon": "iphone",
+    "lapptop": "laptop",
+    "celphone": "cellphone",
+    "moblie": "mobile",
+    "notbook": "notebook",
+    "phne": "phone"
+}
+
+
+def reference_preprocess(query, spell_fixes=PERFUME_SPELL_FIXES):
+    """The step-by-step pipeline QueryPreprocessor replaced, one regex pass per step and per typo"""
+    query = re.sub(r"<[^>]*>", "", query)
+    query = query.translate(PUNCT_TRANSLATION)
+    query = query.lower()
+    for typo, correct in spell_fixes.items():
+        query = re.sub(rf"\b{typo}\b", correct, query)
+    query = re.sub(r"\s+", " ", query).strip()
+    words = re.findall(r"\b\w+\b|[\u4e00-\u9fff]", query)
+    return " ".join(word for word in words if word not in EN_STOPWORDS and word not in CN_STOPWORDS)
+
+
+QUERIES = [
+    "Fresh citrus perfume for summer days",
+    "A long lasting VANILA perfum for the winter",
+    "fragance with lavendar, bergamont and sandlewood notes",
+    "Something like Tomford Tobacco Vanille but cheaper",
+    "jomalone wood sage & sea salt dupe?",
+    "cinammon and insence, very muskey",
+    "<b>Strong</b> sillag for clubbing<br/>",
+    "我想要一个夏天的香水，清新！",
+    "女士香水（花香）１００ml",
+    "Perfume, perfum, perfumme, parfume",
+    "versache eros vs givenchi gentleman",
+    "  the   an a  ",
+    "",
+    "perfum's trail, colonge-like, fragrence_oil",
+    "l'eau d'issey — acquatic, powdry",
+    "Tom Ford? TOMFORD! tomford.",
+    "lancom la vie est belle 2019",
+    "patchuli/pachouli and coconut cocunut",
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_same_output_as_the_step_by_step_pipeline(query):
+    assert preprocess_query(query) == reference_preprocess(query)
+
+
+def test_batch_matches_single_queries():
+    queries = QUERIES + QUERIES[:5]
+    assert preprocess_queries(queries) == [reference_preprocess(q) for q in queries]
+
+
+@pytest.mark.parametrize("query", ["Cheap iphon or lapptop", "moblie phne with a notbook", "celphone case"])
+def test_other_domain_dictionary(query):
+    preprocessor = QueryPreprocessor(spell_fixes=ELECTRONICS_SPELL_FIXES)
+    assert preprocessor(query) == reference_preprocess(query, ELECTRONICS_SPELL_FIXES)
+
+
+def test_chained_and_multi_word_corrections():
+    fixes = {"tomford": "tom ford", "vanila": "the vanilla", "ford": "fords", "perfum": "perfume"}
+    preprocessor = QueryPreprocessor(spell_fixes=fixes)
+    for query in ["tomford vanila perfum", "ford perfume", "perfum the vanila"]:
+        assert preprocessor(query) == reference_preprocess(query, fixes)
+
+
+@pytest.mark.parametrize("typo", ["tom ford", "Perfum", "perfum!", ""])
+def test_spelling_fixes_must_be_single_lowercase_words(typo):
+    with pytest.raises(ValueError):
+        QueryPreprocessor(spell_fixes={typo: "perfume"})
@@ -0,0 +1,100 @@
+import pytest
+from sqlalchemy import inspect, text
+import bm25_index
+import product_store
+from catalog_version import bump_catalog_version
+from import_csv_to_db import PRODUCT_COLUMNS, full_import
+from server import app
+from server_config import db
+
+
+def product(i, description):
+    row = dict.fromkeys(PRODUCT_COLUMNS)
+    row.update(name=f"perfume {i}", url=f"https://example.com/{i}", description=description, positive_rate=0.5)
+    return row
+
+
+@pytest.fixture
+def priced_catalog(monkeypatch):
+    """40 citrus products; the 20 best BM25 matches cost 500, the others 50"""
+    rows = [product(i, "citrus " * 5 + "bright") for i in range(20)]
+    rows += [product(i, "citrus woody amber musk vanilla") for i in range(20, 40)]
+    with app.app_context():
+        full_import([rows], None, batch_size=100)
+        with db.engine.begin() as conn:
+            if "price" not in {c["name"] for c in inspect(conn).get_columns("products")}:
+                conn.execute(text("ALTER TABLE products ADD COLUMN price FLOAT"))
+            conn.execute(text("UPDATE products SET price = CASE WHEN description LIKE 'citrus citrus%' "
+                              "THEN 500 ELSE 50 END"))
+            bump_catalog_version(conn)
+    bm25_index._shared.clear()
+    monkeypatch.setattr(product_store, "REFRESH_INTERVAL", 0.0)
+    app.config["BM25_ENABLED"] = True
+
+
+def search(**body):
+    response = app.test_client().post("/search_products", json={"category": "citrus", **body})
+    assert response.status_code == 200
+    return response
+
+
+def test_price_filter_applies_before_the_page_is_cut(priced_catalog):
+    response = search(k=5, max_price=100)
+    products = response.get_json()
+    assert len(products) == 5
+    assert all(p["description"].startswith("citrus woody") for p in products)
+    assert response.headers.get("X-Next-Cursor")
+
+
+def test_price_filtered_pages_do_not_overlap(priced_catalog):
+    first = search(k=15, max_price=100)
+    second = search(k=15, max_price=100, cursor=first.headers["X-Next-Cursor"])
+    ids = [p["id"] for p in first.get_json() + second.get_json()]
+    assert len(ids) == len(set(ids)) == 20
+    assert second.headers.get("X-Next-Cursor") is None
+
+
+def test_unfiltered_ranking_is_unchanged(priced_catalog):
+    products = search(k=5).get_json()
+    assert all(p["description"].startswith("citrus citrus") for p in products)
+
+
+@pytest.mark.parametrize("category", ["", "  ", None])
+def test_category_without_terms_lists_products_by_id(priced_catalog, category):
+    first = search(category=category, k=25)
+    second = search(category=category, k=25, cursor=first.headers["X-Next-Cursor"])
+    ids = [p["id"] for p in first.get_json() + second.get_json()]
+    assert ids == sorted(ids) and len(ids) == 40
+    assert second.headers.get("X-Next-Cursor") is None
+
+
+def test_category_without_terms_keeps_the_price_filter(priced_catalog):
+    products = search(category="", k=40, max_price="100").get_json()
+    assert len(products) == 20 and all(p["description"].startswith("citrus woody") for p in products)
+
+
+@pytest.mark.parametrize("max_price", ["cheap", True, [100], {"lt": 100}, "nan", "inf"])
+def test_invalid_max_price_is_rejected(priced_catalog, max_price):
+    response = app.test_client().post("/search_products", json={"category": "citrus", "max_price": max_price})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "max_price must be a number"}
+
+
+def test_catalog_change_is_synced_on_a_copy(priced_catalog, monkeypatch):
+    monkeypatch.setattr(bm25_index, "REFRESH_INTERVAL", 0.0)
+    with app.app_context():
+        old = bm25_index.get_bm25_index(db)
+        with db.engine.begin() as conn:
+            product_id = conn.execute(text("SELECT MIN(id) FROM products")).scalar()
+            conn.execute(text("UPDATE products SET description = 'vetiver smoke' WHERE id = :id"),
+                         {"id": product_id})
+            bump_catalog_version(conn)
+        # The request that notices the change keeps the current index; the sync runs in the background
+        assert bm25_index.get_bm25_index(db) is old
+        bm25_index._shared.wait()
+        new = bm25_index.get_bm25_index(db)
+
+    assert new is not old and new.version == old.version + 1
+    assert list(new.search("vetiver")[0]) == [product_id]
+    assert len(old.search("vetiver")[0]) == 0
+    assert product_id in old.search("citrus", k=40)[0] and product_id not in new.search("citrus", k=40)[0]
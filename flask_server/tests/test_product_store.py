@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import inspect, text
+import product_store
+from bert_search import build_dynamic_sql
+from catalog_version import bump_catalog_version
+from import_csv_to_db import PRODUCT_COLUMNS, full_import
+from product_store import (RANKING_COLUMNS, attribute_values, find_products_by_ids, find_products_by_keyword,
+                           table_columns)
+from server_config import app, db
+
+CATALOG = {
+    "citrus summer": dict(gender="Female", suitable_season="Summer, Spring", main_accords="Citrus, Fresh"),
+    "aquatic summer": dict(gender="Male", suitable_season="Summer", main_accords="Aquatic"),
+    "amber winter": dict(gender="Female", suitable_season="Winter", main_accords="Amber"),
+    "woody summer": dict(gender="Female", suitable_season="Summer", main_accords="Woody"),
+    "citrus winter": dict(gender="Unisex", suitable_season="Winter", main_accords="Citrus"),
+}
+
+
+def product(name, **attributes):
+    row = dict.fromkeys(PRODUCT_COLUMNS)
+    row.update(name=name, url=f"https://example.com/{name}", description=f"{name} perfume", positive_rate=0.5,
+               **attributes)
+    return row
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    """The CATALOG products (with a price column: 10, 20, ... in catalog order); yields (connection, ids by name)"""
+    monkeypatch.setattr(product_store, "REFRESH_INTERVAL", 0.0)
+    with app.app_context():
+        full_import([[product(name, **attributes) for name, attributes in CATALOG.items()]], None, batch_size=100)
+        with db.engine.begin() as connection:
+            if "price" not in {c["name"] for c in inspect(connection).get_columns("products")}:
+                connection.execute(text("ALTER TABLE products ADD COLUMN price FLOAT"))
+            for i, name in enumerate(CATALOG):
+                connection.execute(text("UPDATE products SET price = :price WHERE name = :name"),
+                                   {"price": 10 * (i + 1), "name": name})
+            bump_catalog_version(connection)
+        with db.engine.connect() as connection:
+            rows = connection.execute(text("SELECT id, name FROM products"))
+            ids = dict((name, product_id) for product_id, name in rows)
+            yield connection, ids
+
+
+def test_find_by_ids_maps_the_selected_columns_by_name(conn):
+    connection, ids = conn
+    rows = find_products_by_ids(connection, [ids["amber winter"], ids["citrus summer"], 10 ** 6],
+                                columns=("name", "positive_rate"))
+    assert set(rows) == {ids["amber winter"], ids["citrus summer"]}
+    assert rows[ids["amber winter"]] == {"id": ids["amber winter"], "name": "amber winter", "positive_rate": 0.5}
+    assert find_products_by_ids(connection, []) == {}
+
+
+def test_find_by_ids_applies_the_price_filter(conn):
+    connection, ids = conn
+    rows = find_products_by_ids(connection, list(ids.values()), {"max_price": 30})
+    assert {row["name"] for row in rows.values()} == {"citrus summer", "aquatic summer", "amber winter"}
+    assert len(find_products_by_ids(connection, list(ids.values()), {"max_price": None})) == len(CATALOG)
+
+
+def test_filters_on_missing_columns_are_ignored(conn):
+    connection, ids = conn
+    connection.commit()
+    with db.engine.begin() as other:
+        other.execute(text("ALTER TABLE products DROP COLUMN price"))
+        bump_catalog_version(other)
+    assert "price" not in table_columns(connection)
+    assert len(find_products_by_ids(connection, list(ids.values()), {"max_price": 10})) == len(CATALOG)
+    assert len(find_products_by_keyword(connection, "summer", {"max_price": 10})) == 3
+
+
+def test_keyword_search_is_keyset_paginated(conn):
+    connection, ids = conn
+    summer = sorted(ids[name] for name in CATALOG if "summer" in name)
+    first = find_products_by_keyword(connection, "summer", limit=2)
+    assert [row["id"] for row in first] == summer[:2]
+    assert set(first[0]) == {"id", "name", "description"}
+    rest = find_products_by_keyword(connection, "summer", limit=2, after_id=first[-1]["id"])
+    assert [row["id"] for row in rest] == summer[2:]
+    cheap = find_products_by_keyword(connection, "summer", {"max_price": 20})
+    assert {row["name"] for row in cheap} == {"citrus summer", "aquatic summer"}
+
+
+@pytest.mark.parametrize("parsed, expected", [
+    ({"gender": "female", "suitable_season": ["summer"]}, {"citrus summer", "woody summer"}),
+    ({"gender": "female", "main_accords": ["citrus"]}, {"citrus summer"}),
+    ({"main_accords": ["citrus"]}, {"citrus summer", "citrus winter"}),
+    ({"suitable_season": ["winter", "spring"]}, {"citrus summer", "amber winter", "citrus winter"}),
+    ({"longevity": "undefined"}, set(CATALOG)),
+    ({"gender": "female", "suitable_season": ["autumn"]}, set()),
+])
+def test_attribute_filtered_candidates(conn, parsed, expected):
+    connection, _ = conn
+    sql, params = build_dynamic_sql(parsed, attribute_values(connection))
+    rows = connection.execute(text(sql), params).mappings().all()
+    assert {row["name"] for row in rows} == expected
+    assert all(tuple(row.keys()) == RANKING_COLUMNS for row in rows)
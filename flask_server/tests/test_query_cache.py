@@ -0,0 +1,42 @@
+import sqlite3
+import time
+from query_cache import ParsedQueryCache
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return [key for key, in db.execute("SELECT cache_key FROM parsed_queries ORDER BY expires_at")]
+
+
+def test_disk_rows_are_capped_on_insert(tmp_path):
+    path = str(tmp_path / "parse_cache.db")
+    cache = ParsedQueryCache(max_entries=5, db_path=path, db_max_rows=10, db_prune_every=4)
+    for i in range(30):
+        cache.set(f"q{i}", {"note": str(i)})
+        assert len(disk_rows(path)) <= 10 + 4
+
+    cache._prune_disk()
+    assert disk_rows(path) == [f"q{i}" for i in range(20, 30)]
+    assert cache.stats()["db_pruned"] == 20
+
+
+def test_expired_rows_are_pruned(tmp_path):
+    path = str(tmp_path / "parse_cache.db")
+    cache = ParsedQueryCache(ttl=0.05, db_path=path, db_prune_every=3)
+    cache.set("old1", {})
+    cache.set("old2", {})
+    time.sleep(0.1)
+    cache.ttl = 60
+    cache.set("new", {})
+    assert disk_rows(path) == ["new"]
+
+
+def test_rows_survive_a_restart_within_the_cap(tmp_path):
+    path = str(tmp_path / "parse_cache.db")
+    cache = ParsedQueryCache(db_path=path, db_max_rows=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, {"key": key})
+
+    reopened = ParsedQueryCache(db_path=path, db_max_rows=2)
+    assert reopened.get("a") is None
+    assert reopened.get("c") == {"key": "c"}
@@ -0,0 +1,126 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import bert_model
+import query_encoder
+from query_encoder import QueryEncoder
+
+
+class GatedModel:
+    """The synthetic encoder, recording each batch; encode() blocks while the gate is closed"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        self.entered.set()
+        assert self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return bert_model._model.encode(texts, **kwargs)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = GatedModel()
+    monkeypatch.setattr(query_encoder, "get_model", lambda: model)
+    return model
+
+
+def expected(text):
+    return bert_model._model.encode([text], normalize_embeddings=True)[0]
+
+
+def hold_worker(encoder, model):
+    """Keep the worker busy on a first batch, so the next requests queue up behind it"""
+    model.gate.clear()
+    first = encoder.encode_async("warm up")
+    assert model.entered.wait(5)
+    return first
+
+
+def test_queued_requests_are_encoded_together(model):
+    encoder = QueryEncoder(max_batch=4, max_wait_ms=50)
+    first = hold_worker(encoder, model)
+    texts = [f"citrus query {i}" for i in range(10)]
+    futures = [encoder.encode_async(text) for text in texts]
+    model.gate.set()
+
+    for text, future in zip(texts, futures):
+        np.testing.assert_allclose(future.result(5), expected(text), rtol=1e-6)
+    first.result(5)
+    assert model.batches == [["warm up"], texts[:4], texts[4:8], texts[8:]]
+    assert encoder.stats()["batches"] == 4
+
+
+def test_concurrent_requests_get_their_own_vectors(model):
+    encoder = QueryEncoder(max_batch=8, max_wait_ms=2)
+    texts = [f"query {i % 40} woody amber" for i in range(200)]
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        vectors = list(pool.map(encoder.encode, texts))
+
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, expected(text), rtol=1e-6)
+    # Each distinct query is encoded once; repeats share the pending future or hit the cache
+    encoded = [text for batch in model.batches for text in batch]
+    assert sorted(encoded) == sorted(set(texts))
+    assert all(len(batch) <= 8 for batch in model.batches)
+
+
+def test_identical_pending_queries_share_one_encoding(model):
+    encoder = QueryEncoder(max_wait_ms=50)
+    hold_worker(encoder, model)
+    futures = [encoder.encode_async(text) for text in ("Vanilla  Musk", "vanilla musk", "VANILLA MUSK")]
+    model.gate.set()
+
+    assert futures[0] is futures[1] is futures[2]
+    np.testing.assert_allclose(futures[0].result(5), expected("vanilla musk"), rtol=1e-6)
+    assert model.batches[1] == ["vanilla musk"]
+
+
+def test_partial_batch_is_flushed_after_max_wait(model):
+    encoder = QueryEncoder(max_batch=64, max_wait_ms=30)
+    start = time.perf_counter()
+    encoder.encode("lone query")
+    assert time.perf_counter() - start >= 0.03
+    encoder.encode("later query")
+    assert model.batches == [["lone query"], ["later query"]]
+
+
+def test_full_batch_does_not_wait(model):
+    encoder = QueryEncoder(max_batch=3, max_wait_ms=10)
+    hold_worker(encoder, model)
+    encoder.max_wait = 10.0
+    futures = [encoder.encode_async(f"query {i}") for i in range(3)]
+    model.gate.set()
+
+    start = time.perf_counter()
+    for future in futures:
+        future.result(5)
+    assert time.perf_counter() - start < 5
+    assert model.batches[1] == ["query 0", "query 1", "query 2"]
+
+
+def test_encoding_error_reaches_every_waiter(model):
+    encoder = QueryEncoder(max_batch=64, max_wait_ms=50)
+    first = hold_worker(encoder, model)
+    model.error = RuntimeError("model crashed")
+    futures = [encoder.encode_async(f"query {i}") for i in range(5)]
+    futures.append(encoder.encode_async("query 0"))  # shares the pending future
+    model.gate.set()
+
+    for future in [first] + futures:
+        with pytest.raises(RuntimeError, match="model crashed"):
+            future.result(5)
+
+    # Nothing was cached or left pending: the next request encodes again
+    model.error = None
+    np.testing.assert_allclose(encoder.encode("query 0"), expected("query 0"), rtol=1e-6)
+    assert encoder.stats()["cache_entries"] == 1
@@ -0,0 +1,31 @@
+import json
+import pytest
+from ranking import parse_ranking_options
+from server import app
+
+
+@pytest.mark.parametrize("key", ["similarity_weight", "positive_weight", "positive_rate_power"])
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), "NaN", "Infinity", "-inf"])
+def test_non_finite_weights_are_rejected(key, value):
+    with pytest.raises(ValueError, match=f"{key} must be a finite number"):
+        parse_ranking_options({key: value})
+
+
+@pytest.mark.parametrize("value", [float("inf"), float("nan")])
+def test_non_finite_k_is_rejected(value):
+    with pytest.raises(ValueError, match="k must be an integer"):
+        parse_ranking_options({"k": value})
+
+
+def test_finite_weights_are_accepted():
+    options = parse_ranking_options({"similarity_weight": "0.5", "positive_weight": 0, "k": 3})
+    assert options["similarity_weight"] == 0.5 and options["positive_weight"] == 0.0 and options["k"] == 3
+
+
+@pytest.mark.parametrize("body", ['{"query": "citrus", "similarity_weight": NaN}',
+                                  '{"query": "citrus", "k": Infinity}',
+                                  '{"query": "citrus", "offset": 1e999}'])
+def test_non_finite_request_values_are_bad_requests(body):
+    response = app.test_client().post("/search_by_bert", data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert "error" in json.loads(response.data)
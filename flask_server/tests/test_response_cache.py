@@ -0,0 +1,105 @@
+import threading
+import time
+import pytest
+import attribute_index
+import bert_search
+from catalog_version import bump_catalog_version
+from fake_redis import FakeRedis
+from import_csv_to_db import PRODUCT_COLUMNS, full_import
+from response_cache import MemoryBackend, RedisBackend, ResponseCache
+from server import app
+from server_config import db
+
+
+def product(i):
+    row = dict.fromkeys(PRODUCT_COLUMNS)
+    row.update(name=f"perfume {i}", url=f"https://example.com/{i}", description=f"citrus woody note {i}",
+               gender="Unisex", main_accords="Citrus, Woody", positive_rate=0.5)
+    return row
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    with app.app_context():
+        full_import([[product(i) for i in range(20)]], None, batch_size=100)
+    attribute_index._shared.clear()
+    cache = ResponseCache(MemoryBackend())
+    monkeypatch.setattr(bert_search, "response_cache", cache)
+    monkeypatch.setattr(attribute_index, "REFRESH_INTERVAL", 0.0)
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    return cache
+
+
+def search(client):
+    response = client.post("/search_by_bert", json={"query": "citrus for summer", "k": 3, "parse_mode": "rules"})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_catalog_bump_invalidates_cached_pages(cache):
+    client = app.test_client()
+    first = search(client)
+    assert search(client) == first
+    assert (cache.misses, cache.hits) == (1, 1)
+
+    with app.app_context(), db.engine.begin() as conn:
+        bump_catalog_version(conn)
+    # The index is rebuilt in the background; until it is swapped in, pages come from the old snapshot
+    search(client)
+    attribute_index._shared.wait()
+    search(client)
+    assert (cache.misses, cache.hits) == (2, 2)
+
+
+def test_page_is_stored_under_the_version_it_was_computed_from():
+    cache = ResponseCache(MemoryBackend())
+    # The caller looked up version 2, but the page was computed from a snapshot still at version 1
+    assert cache.get_or_compute(2, "page", lambda: ({"results": []}, 1)) == {"results": []}
+    assert cache.backend.get(cache.make_key(1, "page")) is not None
+    assert cache.backend.get(cache.make_key(2, "page")) is None
+
+    cache.get_or_compute(2, "mixed", lambda: ({"results": []}, None))
+    assert cache.backend.get(cache.make_key(2, "mixed")) is None
+
+
+def test_shared_lock_lets_one_worker_compute_a_cold_key():
+    redis = FakeRedis()
+    workers = [ResponseCache(RedisBackend(redis), poll_interval=0.005) for _ in range(4)]
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return {"page": 1}, 7
+
+    results = [None] * len(workers)
+
+    def request(i):
+        if i:
+            started.wait()
+        results[i] = workers[i].get_or_compute(7, "cold", compute)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"page": 1}] * len(workers)
+    assert sum(w.peer_waits for w in workers) == len(workers) - 1
+    # The lock is released once the value is stored
+    assert redis.get(workers[0].backend._lock_key(workers[0].make_key(7, "cold"))) is None
+
+
+def test_lock_holder_error_is_not_cached():
+    cache = ResponseCache(RedisBackend(FakeRedis()))
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute(1, "key", fail)
+    assert cache.get_or_compute(1, "key", lambda: ({"ok": True}, 1)) == {"ok": True}
@@ -0,0 +1,75 @@
+import json
+import os
+import pytest
+import rule_parser_benchmark
+from rule_parser import CONFIDENCE_THRESHOLD, parse_with_rules
+from rule_parser_benchmark import (FIELDS, GOLD_FILE, calibrate_threshold, normalize_field, precision_coverage,
+                                   score_gold, split_gold)
+
+GOLD_PATH = os.path.join(os.path.dirname(rule_parser_benchmark.__file__), GOLD_FILE)
+
+# Queries written for these tests, none of them in the gold file, with the phrase tables' common
+# fragrance wording: {query: expected fields (the others must be empty)}
+PHRASE_QUERIES = {
+    "A skin scent for the office": {"sillage": "intimate", "suitable_time": ["day"]},
+    "Something close to skin and subtle for school": {"sillage": "intimate", "suitable_time": ["day"]},
+    "Androgynous cologne that lasts forever": {"gender": "unisex", "longevity": "eternal"},
+    "Gender neutral perfume for winter evenings": {"gender": "unisex", "suitable_season": ["winter"],
+                                                   "suitable_time": ["night"]},
+    "A date night perfume for him": {"gender": "male", "suitable_time": ["night"]},
+    "Perfume for her that I can wear year round": {
+        "gender": "female", "suitable_season": ["spring", "summer", "autumn", "winter"]},
+    "Room filling scent for parties": {"sillage": "very strong", "suitable_time": ["night"]},
+    "Long lasting fragrance for hot weather mornings": {"longevity": "long lasting", "suitable_season": ["summer"],
+                                                        "suitable_time": ["day"]},
+}
+
+
+def test_calibration_split_holds_out_part_of_the_gold_file():
+    calibration, holdout = split_gold(GOLD_PATH)
+    with open(GOLD_PATH, encoding="utf-8") as f:
+        assert set(calibration) | set(holdout) == set(json.load(f))
+    assert not set(calibration) & set(holdout) and len(holdout) >= 5
+
+
+def test_threshold_is_calibrated_without_the_held_out_queries():
+    calibration, _ = split_gold(GOLD_PATH)
+    assert calibrate_threshold(score_gold(calibration)) == CONFIDENCE_THRESHOLD
+
+
+def test_confident_parses_agree_with_the_held_out_labels():
+    _, holdout = split_gold(GOLD_PATH)
+    precision, coverage = precision_coverage(score_gold(holdout), CONFIDENCE_THRESHOLD)
+    assert precision >= 0.95 and coverage > 0
+
+
+@pytest.mark.parametrize("query, expected", PHRASE_QUERIES.items())
+def test_phrases_parse_queries_outside_the_gold_file(query, expected):
+    with open(GOLD_PATH, encoding="utf-8") as f:
+        assert query not in json.load(f)
+    parsed, _, ambiguous = parse_with_rules(query)
+    assert ambiguous == []
+    for field in FIELDS:
+        assert normalize_field(parsed.get(field)) == normalize_field(expected.get(field)), field
+
+
+def test_conflicting_phrases_are_ambiguous():
+    # "fleeting" (very weak) and "soft" (weak)
+    _, confidence, ambiguous = parse_with_rules("A fleeting soft spring scent")
+    assert ambiguous == ["longevity"]
+    assert confidence < CONFIDENCE_THRESHOLD
+
+
+def test_ambiguous_field_falls_through():
+    _, confidence, ambiguous = parse_with_rules("I need a perfume with good sillage")
+    assert ambiguous == ["sillage"]
+    assert confidence < CONFIDENCE_THRESHOLD
+
+
+def test_unparsed_words_and_empty_parses_lower_confidence():
+    _, clean, _ = parse_with_rules("perfume for women in summer")
+    _, wordy, _ = parse_with_rules("smoky leather tobacco perfume for women in summer")
+    _, empty, _ = parse_with_rules("perfume")
+    assert clean == 1.0
+    assert wordy < CONFIDENCE_THRESHOLD <= clean
+    assert empty < CONFIDENCE_THRESHOLD
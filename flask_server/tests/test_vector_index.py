@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import bert_similarity
+import embedding_store
+from embedding_store import EmbeddingStoreBuilder
+from vector_index import IVFIndex, build_vector_index
+
+
+def clustered_vectors(n, dim=32, clusters=50, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_calibrated_nprobe_meets_the_recall_target():
+    vectors = clustered_vectors(4000)
+    index = build_vector_index(np.arange(1, 4001), vectors, "ivf", nprobe=None)
+    assert index.calibrated_recall >= index.recall_target
+    assert 1 <= index.nprobe <= index.nlist
+
+
+def test_fixed_nprobe_skips_calibration():
+    index = build_vector_index(np.arange(1, 2001), clustered_vectors(2000), "ivf", nprobe=3)
+    assert index.nprobe == 3 and index.calibrated_recall is None
+
+
+def test_contains():
+    index = IVFIndex(32, nprobe=2)
+    index.add([1, 5], clustered_vectors(2))
+    assert index.contains([1, 2, 5, 10 ** 9]).tolist() == [True, False, True, False]
+
+
+@pytest.fixture
+def ann_store(monkeypatch, tmp_path):
+    """Store and IVF index over products 1..200; the ANN path used for any candidate count"""
+    descriptions = [f"note{i % 20} accord{i % 7} family{i % 3}" for i in range(200)]
+    builder = EmbeddingStoreBuilder(str(tmp_path))
+    builder.add(list(range(1, 201)), descriptions)
+    builder.finish(catalog_version=1)
+
+    monkeypatch.setattr(embedding_store, "REFRESH_INTERVAL", 0.0)
+    monkeypatch.setattr(embedding_store, "product_store", None)
+    monkeypatch.setattr(embedding_store, "product_index", None)
+    monkeypatch.setattr(embedding_store, "_live_catalog_version", lambda: 1)
+    monkeypatch.setattr(embedding_store.get_product_store, "__defaults__", (str(tmp_path),))
+    monkeypatch.setattr(embedding_store, "VECTOR_INDEX_KIND", "ivf")
+    monkeypatch.setattr(embedding_store.get_vector_index, "__defaults__", ("ivf",))
+    monkeypatch.setattr(bert_similarity, "VECTOR_INDEX_KIND", "ivf")
+    monkeypatch.setattr(bert_similarity, "ANN_MIN_CANDIDATES", 0)
+    return descriptions
+
+
+def test_candidates_missing_from_the_index_are_scored_exactly(ann_store):
+    # Product 201 was added after the store and index were built
+    ids = np.arange(1, 202)
+    descriptions = np.array(ann_store + ["smoky leather tobacco"], dtype=object)
+    rates = np.full(len(ids), 0.5, dtype=np.float32)
+    winners, cosine_scores, _ = bert_similarity.score_candidates(
+        "smoky leather tobacco", ids, descriptions, rates, k=3, similarity_weight=1.0, positive_weight=0.0)
+    assert ids[winners[0]] == 201
+    assert cosine_scores[200] == pytest.approx(1.0, abs=1e-3)